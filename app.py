@@ -62,11 +62,14 @@ custom_bus_stack = CustomBusStack(app, "rtcwprostats-custom-bus", lambda_tracing
 
 gamelog_lambda_stack = GamelogLambdaStack(app, "rtcwprostats-gamelog",
                                           ddb_table=database.ddb_table,
+                                          ddb_access_layer=database.ddb_access_layer,
+                                          numpy_layer=database.numpy_layer,
                                           custom_event_bus=custom_bus_stack.custom_bus,
                                           lambda_tracing=lambda_tracing, env=env)
 
 task_funnel_stack = TaskFunnelStack(app, "rtcwprostats-taskfunnel", lambda_tracing=lambda_tracing,
                                     ddb_table=database.ddb_table,
+                                    ddb_access_layer=database.ddb_access_layer,
                                     gamelog_lambda = gamelog_lambda_stack.gamelog_lambda,
                                     custom_event_bus=custom_bus_stack.custom_bus,
                                     prompt_id=prompt_id,
@@ -75,6 +78,8 @@ task_funnel_stack = TaskFunnelStack(app, "rtcwprostats-taskfunnel", lambda_traci
 post_process_stack = PostProcessStack(app, "rtcwprostats-postprocess", 
                                       lambda_tracing=lambda_tracing, 
                                       ddb_table=database.ddb_table, 
+                                      ddb_access_layer=database.ddb_access_layer,
+                                      numpy_layer=database.numpy_layer,
                                       gamelog_lambda = gamelog_lambda_stack.gamelog_lambda,
                                       custom_event_bus=custom_bus_stack.custom_bus,
                                       env=env)
@@ -82,6 +87,7 @@ post_process_stack = PostProcessStack(app, "rtcwprostats-postprocess",
 reader = ReadMatchStack(app, "rtcwprostats-reader", 
                         storage_bucket=storage.storage_bucket, 
                         ddb_table=database.ddb_table,
+                        ddb_access_layer=database.ddb_access_layer,
                         read_queue=storage.read_queue,
                         read_dlq=storage.read_dlq,
                         postproc_state_machine=post_process_stack.postproc_state_machine, 
@@ -91,6 +97,7 @@ reader = ReadMatchStack(app, "rtcwprostats-reader",
 
 retriever = DeliveryRetrieverStack(app, "rtcwprostats-retriever", 
                                    ddb_table=database.ddb_table, 
+                                   ddb_access_layer=database.ddb_access_layer,
                                    env=env, lambda_tracing=lambda_tracing)
 
 delivery_writer = DeliveryWriterStack(app, "rtcwprostats-delivery-writer",
@@ -114,6 +121,7 @@ DNSStack(app, "rtcwprostats-DNS",
 
 PeriodicalStack(app, "rtcwprostats-periodical", 
                 ddb_table=database.ddb_table,
+                ddb_access_layer=database.ddb_access_layer,
                 funnel_sf=task_funnel_stack.funnel_state_machine,
                 custom_event_bus=custom_bus_stack.custom_bus,
                 env=env, lambda_tracing=lambda_tracing)
@@ -1,4 +1,4 @@
-"""ANYTHING IN THIS FILE WILL BE SHARED WITH GROUP_CACHE.PY"""
+"""ANYTHING IN THIS FILE WILL BE SHARED WITH GROUP_CACHE.PY AND POSTPROCESS_MATCHINFO.PY"""
 
 import logging
 log_level = logging.INFO
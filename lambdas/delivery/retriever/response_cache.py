@@ -0,0 +1,397 @@
+"""
+Warm container cache of retriever responses.
+
+Responses are kept whole, keyed by the route (the event resource) and its
+path and query string parameters, so a repeated request skips DynamoDB
+and json encoding altogether. The cache is bounded by the bytes of the
+response bodies and drops the least recently used ones first.
+
+How long a response stays depends on its route, see route_ttls. Match
+data does not change once a match is over and post-processed, so the
+routes of given matches (match_id_params) keep their responses until they
+are evicted when the matches started more than settle_time ago.
+
+Errors are not cached. Lambdas that invoke the retriever right after they
+changed something can send "cache_bypass": true in the event to skip the
+lookup, the fresh response then replaces the cached one.
+
+Expensive routes (shared_routes) are also shared between containers when
+RTCWPROSTATS_SHARED_CACHE is set, "table" for the stats table or "local"
+for an in-memory stand-in. A shared entry is fresh for the route TTL and
+then stale for as long again. The first container to find it stale or
+missing takes a short lock (a conditional write) and builds the response,
+the others serve the stale one meanwhile or, with nothing to serve, wait
+for it. A burst of the same request is built once instead of once per
+container.
+
+    return response_cache.get(event, lambda: build_response(event, context))
+"""
+import hashlib
+import json
+import logging
+import threading
+import time as _time
+import zlib
+from collections import Counter, OrderedDict
+
+from botocore.exceptions import ClientError
+
+from data_codec import decode_data_text
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("response_cache")
+logger.setLevel(log_level)
+
+forever = float("inf")
+settle_time = 6 * 60 * 60  # match start to the end of its post-processing, and then some
+max_bytes = 16 * 1024 * 1024  # the retriever has 128 MB
+max_entry_bytes = max_bytes // 8  # bigger responses would push out too many others
+shared_max_ttl = 7 * 24 * 60 * 60  # how long settled matches stay fresh in the shared cache
+shared_max_bytes = 350 * 1024  # compressed, items are at most 400 KB
+lock_time = 5  # seconds a container has to build a response others wait for
+wait_time = 1.0  # seconds others wait for it before building it themselves
+wait_interval = 0.1
+
+# seconds a response is cached, routes that are not listed are not cached
+route_ttls = {
+    "/matches/{proxy+}": 60,
+    "/stats/{match_id}": 60,
+    "/wstats/{match_id}": 60,
+    "/gamelogs/{match_round_id}": 60,
+    "/wstats/player/{player_guid}/match/{match_id}": 60,
+    "/eloprogress/match/{match_id}": 60,
+    "/stats/player/{player_guid}": 60,
+    "/stats/player/{player_guid}/region/{region}/type/{type}": 60,
+    "/wstats/player/{player_guid}": 60,
+    "/player/{player_guid}": 60,
+    "/player/{player_guid}/season/{season_id}": 300,
+    "/eloprogress/player/{player_guid}/region/{region}/type/{type}": 60,
+    "/stats/group/{group_name}": 60,
+    "/wstats/group/{group_name}": 60,
+    "/groups/{proxy+}": 60,
+    "/leaders/{category}/region/{region}/type/{type}": 120,
+    "/leaders/{category}/region/{region}/type/{type}/limit/{limit}": 120,
+    "/leadershist/season/{season}/category/{category}/region/{region}/type/{type}/limit/{limit}": 3600,
+    "/seasons/region/{region}/type/{type}": 3600,
+    "/mapstats/region/{region}/type/{type}/all": 600,
+    "/mapstats/region/{region}/type/{type}/player/{player_guid}": 120,
+    "/player/search/{begins_with}": 60,
+    "/aliases/search/{begins_with}": 60,
+    "/aliases/player/{player_guid}": 60,
+    "/aliases/recent/limit/{limit}": 15,
+    "/servers": 60,
+    "/servers/detail": 60,
+    "/servers/region/{region}": 60,
+    "/servers/region/{region}/active": 60,
+    "/events/{limit}": 15
+}
+
+# routes worth a shared cache read on a local miss
+shared_routes = {
+    "/matches/{proxy+}",
+    "/stats/{match_id}",
+    "/stats/group/{group_name}",
+    "/wstats/group/{group_name}",
+    "/groups/{proxy+}",
+    "/leaders/{category}/region/{region}/type/{type}",
+    "/leaders/{category}/region/{region}/type/{type}/limit/{limit}",
+    "/leadershist/season/{season}/category/{category}/region/{region}/type/{type}/limit/{limit}",
+    "/mapstats/region/{region}/type/{type}/all"
+}
+
+# routes of given matches: path parameter holding the match ids
+match_id_params = {
+    "/matches/{proxy+}": "proxy",  # /matches/16098173561,16098173562
+    "/stats/{match_id}": "match_id",
+    "/wstats/{match_id}": "match_id",
+    "/gamelogs/{match_round_id}": "match_round_id",
+    "/wstats/player/{player_guid}/match/{match_id}": "match_id",
+    "/eloprogress/match/{match_id}": "match_id"
+}
+
+
+class ResponseCache:
+    """Responses by key with a ttl each, bounded by body bytes, least recently used dropped first."""
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()  # key: (expires, size, response)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        """Cached response, None when unknown or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < _time.time():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, response, ttl):
+        """Cache response for ttl seconds unless it is too big."""
+        size = len(key) + len(response["body"])
+        if size > self.max_entry_bytes:
+            return
+        with self.lock:
+            self.drop(key)
+            self.entries[key] = (_time.time() + ttl, size, response)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def invalidate(self, key=None):
+        """Drop key, or everything."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                self.size = 0
+            else:
+                self.drop(key)
+
+
+class TableBackend:
+    """Shared entries as items of the stats table, removed by its ExpirationTime TTL.
+
+    {"pk": "responsecache#<sha1 of the key>", "sk": "response", "data": zlib json, "data_enc": "zlib",
+     "headers": json, "fresh_until": unix time, "ExpirationTime": unix time, "lock_until": unix time}
+
+    Errors are logged and read as a miss, so the request builds its own response.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, key, consistent=False):
+        """Entry of key, None when there is no item."""
+        try:
+            response = self.table.get_item(Key={"pk": key, "sk": "response"}, ConsistentRead=consistent)
+        except ClientError as e:
+            logger.warning("Exception occurred: " + e.response['Error']['Message'])
+            return None
+        if "Item" not in response:
+            return None
+        item = response["Item"]
+        entry = {"lock_until": int(item.get("lock_until", 0))}
+        if "data" in item:
+            entry["body"] = decode_data_text(item)
+            entry["headers"] = json.loads(item["headers"])
+            entry["fresh_until"] = int(item["fresh_until"])
+            entry["expires"] = int(item["ExpirationTime"])
+        return entry
+
+    def put(self, key, entry):
+        """Write entry, which also releases the lock."""
+        data = zlib.compress(entry["body"].encode())
+        if len(data) > shared_max_bytes:
+            logger.info("Response is too big to share: " + str(len(data)) + " bytes")
+            self.unlock(key)
+            return
+        item = {"pk": key, "sk": "response", "data": data, "data_enc": "zlib", "headers": json.dumps(entry["headers"]),
+                "fresh_until": int(entry["fresh_until"]), "ExpirationTime": int(entry["expires"])}
+        try:
+            self.table.put_item(Item=item)
+        except ClientError as e:
+            logger.warning("Exception occurred: " + e.response['Error']['Message'])
+
+    def lock(self, key, now):
+        """True if this container got the lock of key, or the lock could not be checked."""
+        try:
+            self.table.update_item(Key={"pk": key, "sk": "response"},
+                                   UpdateExpression="SET lock_until = :until, "
+                                                    "ExpirationTime = if_not_exists(ExpirationTime, :until)",
+                                   ConditionExpression="attribute_not_exists(lock_until) OR lock_until < :now",
+                                   ExpressionAttributeValues={":until": int(now) + lock_time, ":now": int(now)})
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                return False
+            logger.warning("Exception occurred: " + e.response['Error']['Message'])
+        return True
+
+    def unlock(self, key):
+        try:
+            self.table.update_item(Key={"pk": key, "sk": "response"}, UpdateExpression="REMOVE lock_until")
+        except ClientError as e:
+            logger.warning("Exception occurred: " + e.response['Error']['Message'])
+
+
+class LocalBackend:
+    """In-memory stand-in for TableBackend, for local runs and tests."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock_ = threading.Lock()
+
+    def get(self, key, consistent=False):
+        with self.lock_:
+            entry = self.entries.get(key)
+            return None if entry is None else dict(entry)
+
+    def put(self, key, entry):
+        with self.lock_:
+            self.entries[key] = {name: value for name, value in entry.items() if name != "lock_until"}
+
+    def lock(self, key, now):
+        with self.lock_:
+            entry = self.entries.setdefault(key, {})
+            if entry.get("lock_until", 0) >= int(now):
+                return False
+            entry["lock_until"] = int(now) + lock_time
+            return True
+
+    def unlock(self, key):
+        with self.lock_:
+            self.entries.get(key, {}).pop("lock_until", None)
+
+
+cache = ResponseCache(max_bytes, max_entry_bytes)
+shared = None  # backend of the shared cache, see get_shared_backend
+shared_stats = Counter()
+
+
+def get_shared_backend(kind, table):
+    """Shared cache backend named by RTCWPROSTATS_SHARED_CACHE, None when it is off."""
+    if kind == "table":
+        return TableBackend(table)
+    if kind == "local":
+        return LocalBackend()
+    return None
+
+
+def get(event, build):
+    """Response of event from the cache, or build() when there is none."""
+    ttl = get_ttl(event)
+    if ttl is None:
+        return build()
+    key = get_key(event)
+    share = shared is not None and event["resource"] in shared_routes
+    if event.get("cache_bypass"):
+        cache.bypasses += 1
+        outcome = "bypass"
+    else:
+        response = cache.lookup(key)
+        if response is not None:
+            logger.info("Response cache hit " + event["resource"])
+            return copy_response(response)
+        outcome = "miss"
+        if share:
+            return get_shared(key, build, ttl, event["resource"])
+
+    response = build()
+    if is_cacheable(response):
+        cache.put(key, response, ttl)
+        if share:
+            put_shared(get_shared_key(key), response, ttl)
+    logger.info("Response cache " + outcome + " " + event["resource"])
+    return response
+
+
+def get_shared(key, build, ttl, resource):
+    """Response of key from the shared cache. Only one container at a time builds a stale or missing one."""
+    shared_key = get_shared_key(key)
+    now = _time.time()
+    entry = shared.get(shared_key)
+    if is_fresh(entry, now):
+        return use_shared(key, entry, ttl, now, "hit", resource)
+
+    stale = entry if entry is not None and "body" in entry and now < entry["expires"] else None
+    if not shared.lock(shared_key, now):
+        if stale is not None:
+            return use_shared(key, stale, 0, now, "stale", resource)  # the lock holder is refreshing it
+        deadline = now + wait_time
+        while _time.time() < deadline:
+            _time.sleep(wait_interval)
+            entry = shared.get(shared_key, consistent=True)
+            if is_fresh(entry, _time.time()):
+                return use_shared(key, entry, ttl, _time.time(), "wait", resource)
+            if entry is None or entry.get("lock_until", 0) < int(_time.time()):
+                break  # the lock holder gave up
+        shared_stats["timeouts"] += 1
+
+    shared_stats["builds"] += 1
+    response = build()
+    if is_cacheable(response):
+        cache.put(key, response, ttl)
+        put_shared(shared_key, response, ttl)
+    else:
+        shared.unlock(shared_key)
+    logger.info("Shared response cache build " + resource)
+    return response
+
+
+def use_shared(key, entry, ttl, now, outcome, resource):
+    shared_stats[outcome + "s"] += 1
+    response = {"statusCode": 200, "headers": entry["headers"], "body": entry["body"]}
+    if ttl > 0:
+        cache.put(key, response, min(ttl, entry["fresh_until"] - now))
+    logger.info("Shared response cache " + outcome + " " + resource)
+    return copy_response(response)
+
+
+def put_shared(shared_key, response, ttl):
+    fresh_time = min(ttl, shared_max_ttl)
+    now = _time.time()
+    shared.put(shared_key, {"body": response["body"], "headers": response["headers"],
+                            "fresh_until": now + fresh_time, "expires": now + 2 * fresh_time})
+
+
+def is_fresh(entry, now):
+    return entry is not None and "body" in entry and now < entry["fresh_until"]
+
+
+def is_cacheable(response):
+    return response["statusCode"] == 200 and not response["body"].startswith('{"error"')
+
+
+def copy_response(response):
+    return dict(response, headers=dict(response["headers"]))
+
+
+def get_shared_key(key):
+    return "responsecache#" + hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_key(event):
+    return (event["resource"] + json.dumps(event.get("pathParameters") or {}, sort_keys=True)
+            + json.dumps(event.get("queryStringParameters") or {}, sort_keys=True))
+
+
+def get_ttl(event):
+    """Seconds the response of event can be cached, None when its route is not cached."""
+    resource = event.get("resource")
+    ttl = route_ttls.get(resource)
+    if ttl is None or resource not in match_id_params:
+        return ttl
+    value = (event.get("pathParameters") or {}).get(match_id_params[resource], "")
+    match_ids = value.split("/")[0].split(",")
+    if all(is_settled(match_id) for match_id in match_ids):
+        return forever
+    return ttl
+
+
+def is_settled(match_id):
+    """True for a match id (or match_id + round) of a match that started more than settle_time ago."""
+    if not match_id.isdigit() or len(match_id) < 10:
+        return False
+    return int(match_id[0:10]) < _time.time() - settle_time
+
+
+def log_stats():
+    logger.info(f"Response cache: {cache.hits} hits, {cache.misses} misses, {cache.bypasses} bypasses, "
+                f"{cache.evictions} evictions, {len(cache.entries)} responses, {cache.size} bytes")
+    if shared is not None:
+        logger.info("Shared response cache: " + ", ".join(f"{count} {name}" for name, count in sorted(shared_stats.items())))
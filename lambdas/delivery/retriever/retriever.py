@@ -1,4 +1,7 @@
 import json
+import base64
+import hashlib
+import hmac
 import boto3
 from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
@@ -9,6 +12,11 @@ import decimal
 import urllib.parse
 import datetime
 from match_info import build_teams, build_new_match_summary, convert_stats_to_dict
+from data_codec import decode_data, decode_data_text, fetch_data_parts
+from ddb_access import get_batch_items
+import ref_cache
+import response_cache
+from match_shards import match_pk, is_match_pk, shards_between, all_shards, query_shards
 
 if __name__ == "__main__":
     TABLE_NAME = "rtcwprostats-database-DDBTable2F2A2F95-1BCIOU7IE3DSE"
@@ -17,6 +25,20 @@ else:
 
 dynamodb = boto3.resource('dynamodb')
 ddb_table = dynamodb.Table(TABLE_NAME)
+skoal_cache = ref_cache.get_cache("skoal")
+season_cache = ref_cache.get_cache("seasons")
+cursor_key = None  # signs pagination cursors, see get_cursor_key
+cursor_secret_arn = os.environ.get("RTCWPROSTATS_CURSOR_SECRET_ARN")
+response_cache.shared = response_cache.get_shared_backend(os.environ.get("RTCWPROSTATS_SHARED_CACHE"), ddb_table)
+
+# key attributes of match shard items per index, sort key last
+shard_key_names = {"lsi": ["pk", "sk", "lsipk"], "gsi1": ["pk", "sk", "gsi1pk", "gsi1sk"], None: ["pk", "sk"]}
+
+# monthly match shards one request of a list without a time range reads, older months by ?cursor=
+browse_shards = 12
+
+# seconds a ?since= feed looks back for items written out of order, see get_feed
+feed_overlaps = {"matches": 3 * 60 * 60, "aliases": 3 * 60 * 60, "events": 5 * 60}
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
@@ -26,6 +48,14 @@ logger.setLevel(log_level)
 
 def handler(event, context):
     """AWS Lambda handler."""
+    response = response_cache.get(event, lambda: build_response(event, context))
+    ref_cache.log_stats()
+    response_cache.log_stats()
+    return response
+
+
+def build_response(event, context):
+    """Response of one API request."""
     if __name__ == "__main__":
         log_stream_name = "local"
     else:
@@ -35,6 +65,12 @@ def handler(event, context):
     api_path = event["resource"]
     logger.info("incoming request " + api_path)
     data = make_error_dict("Unhandled path: ", api_path)
+    body = None  # ready made json, skips serializing data
+    try:
+        page = get_page(event)  # list routes pass it on to their query
+        since = get_since(event)  # feed routes poll with it instead
+    except ValueError as ex:
+        return make_response(make_error_dict(str(ex), api_path))
 
     if api_path == "/matches/{proxy+}":
         if "proxy" in event["pathParameters"]:
@@ -50,7 +86,7 @@ def handler(event, context):
                         if match in match_dups:
                             logger.warning("Matches query string contains duplicate values. Dropping duplicates.")
                             continue
-                        item_list.append({"pk": "match", "sk": match})
+                        item_list.append({"pk": match_pk(match[0:-1]), "sk": match})
                         match_dups.append(match)
 
                 responses = get_batch_items(item_list, ddb_table, log_stream_name)
@@ -67,16 +103,21 @@ def handler(event, context):
                     data = responses
             elif path_tokens[0] == "server" and len(path_tokens) > 1:
                 pk_name = "gsi1pk"
-                pk = "match"
                 begins_with = urllib.parse.unquote(path_tokens[1])
                 logger.info("Searching for matches from server " + begins_with)
                 index_name = "gsi1"
                 skname = "gsi1sk"
                 limit = 100
                 acending = False
-                projections = "data, lsipk, sk"
-                responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                       log_stream_name, limit, acending)
+                projections = "data, lsipk, pk, sk, gsi1pk, gsi1sk"
+                # the last browse_shards months, a paged request continues into older months
+                responses = get_match_shards(all_shards(),
+                                             lambda pk, shard_page: get_begins(pk_name, pk, begins_with, ddb_table,
+                                                                               index_name, skname, projections,
+                                                                               log_stream_name, limit, acending,
+                                                                               shard_page),
+                                             index_name, limit, acending, log_stream_name, page,
+                                             max_shards=browse_shards)
 
                 # logic specific to /matches/recent/{days}
                 if "error" not in responses:
@@ -113,14 +154,19 @@ def handler(event, context):
                     match_type = region + "#" + teams + "#"
                     logger.info("Processing match type " + match_type)
 
-                    pk = "match"
                     pk_name = "pk"
                     index_name = "lsi"
                     skname = "lsipk"
                     begins_with = match_type
-                    projections = "data, lsipk, sk"
-                    responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                           log_stream_name, 100, False)
+                    projections = "data, lsipk, pk, sk"
+                    # the last browse_shards months, a paged request continues into older months
+                    responses = get_match_shards(all_shards(),
+                                                 lambda pk, shard_page: get_begins(pk_name, pk, begins_with, ddb_table,
+                                                                                   index_name, skname, projections,
+                                                                                   log_stream_name, 100, False,
+                                                                                   shard_page),
+                                                 index_name, 100, False, log_stream_name, page,
+                                                 max_shards=browse_shards)
 
                     # logic specific to /matches/type/...
                     if "error" not in responses:
@@ -143,10 +189,24 @@ def handler(event, context):
                     else:
                         days = 92  # 3 months or so
                 logger.info("Number of days: " + str(days))
-                pk = "match"
                 skhigh = int(time.time())
                 sklow = skhigh - 60 * 60 * 24 * int(days)
-                responses = get_range(None, pk, str(sklow), str(skhigh), ddb_table, log_stream_name, 100, False)
+                if since is not None:
+                    # "9" sorts after every match_id + round and before the log# items
+                    responses = get_feed(since,
+                                         lambda low, extra: get_match_shards(
+                                             shards_between(max(low, sklow), skhigh, ascending=True),
+                                             lambda pk, shard_page: get_range(None, pk, str(max(low, sklow)), "9",
+                                                                              ddb_table, log_stream_name, 100 + extra,
+                                                                              True, shard_page),
+                                             None, 100 + extra, True, log_stream_name),
+                                         "sk", lambda sk: int(sk[0:-1]), feed_overlaps["matches"])
+                else:
+                    responses = get_match_shards(shards_between(sklow, skhigh),
+                                                 lambda pk, shard_page: get_range(None, pk, str(sklow), str(skhigh),
+                                                                                  ddb_table, log_stream_name, 100,
+                                                                                  False, shard_page),
+                                                 None, 100, False, log_stream_name, page)
 
                 # logic specific to /matches/recent/{days}
                 if "error" not in responses:
@@ -161,7 +221,6 @@ def handler(event, context):
                     data = responses
 
             elif path_tokens[0] == "health":
-                pk = "match"
                 limit = 600
                 region = path_tokens[1]
                 game_type = path_tokens[2]
@@ -174,19 +233,16 @@ def handler(event, context):
 
                 skhigh = int(time.time())
                 sklow = skhigh - 60 * 60 * 24 * 28  # get last 28 days for day-of-week consistency
-                responses_current = get_range("lsi", pk, sk_prefix + str(sklow), sk_prefix + str(skhigh), ddb_table,
-                                              log_stream_name, limit, False)
+                responses_current = get_match_range_lsi(sk_prefix, sklow, skhigh, log_stream_name, limit)
 
                 skhigh = int(time.time()) - 60 * 60 * 24 * 7 * 5
                 sklow = int(time.time()) - 60 * 60 * 24 * 7 * 9  # get 28 days 35 days ago for day-of-week consistency
-                responses_month_ago = get_range("lsi", pk, sk_prefix + str(sklow), sk_prefix + str(skhigh), ddb_table,
-                                                log_stream_name, limit, False)
+                responses_month_ago = get_match_range_lsi(sk_prefix, sklow, skhigh, log_stream_name, limit)
 
                 skhigh = int(time.time()) - 60 * 60 * 24 * 7 * 52
                 sklow = int(
                     time.time()) - 60 * 60 * 24 * 7 * 56  # get last 28 days exactly a year ago for day-of-week consistency. Predend leap year is not a thing.
-                responses_last_year = get_range("lsi", pk, sk_prefix + str(sklow), sk_prefix + str(skhigh), ddb_table,
-                                                log_stream_name, limit, False)
+                responses_last_year = get_match_range_lsi(sk_prefix, sklow, skhigh, log_stream_name, limit)
 
                 data = process_match_health_responses(responses_current, responses_month_ago, responses_last_year,
                                                       sk_prefix)
@@ -230,42 +286,48 @@ def handler(event, context):
             logger.info("Parameter: " + match_id)
 
             if match_id.isnumeric():
-
-                item_list = []
-                item_list.append({"pk": "statsall", "sk": match_id})
-                item_list.append({"pk": "wstatsall", "sk": match_id})
-                item_list.append({"pk": "match", "sk": match_id + "1"})
-                item_list.append({"pk": "match", "sk": match_id + "2"})
-                item_list.append({"pk": "gamelogs", "sk": match_id + "1"})
-                item_list.append({"pk": "gamelogs", "sk": match_id + "2"})
-                responses = get_batch_items(item_list, ddb_table, log_stream_name)
-
-                # logic specific to /stats/{match_id}
-                if "error" in responses:
-                    data = responses
+                # precomputed by post-processing, see lambdas/postprocessing/match_document.py
+                document_item = get_item("statsdoc", match_id, ddb_table, log_stream_name)
+                if "error" not in document_item:
+                    body = decode_data_text(document_item)
                 else:
-                    data = {}
-                    match_dict = {}
-                    gamelog_dict = {}
-                    for response in responses:
-                        if response["pk"] == "statsall":
-                            data["statsall"] = json.loads(response["data"])
-                            data["match_id"] = response["sk"]
-                            data["type"] = response["gsi1pk"].replace("statsall#", "")
-                        if response["pk"] == "wstatsall":
-                            data["wstatsall"] = json.loads(response["data"])
-                        if response["pk"] == "match":
-                            match_dict[response["sk"]] = json.loads(response["data"])
-                        if response["pk"] == "gamelogs":
-                            gamelog_dict[response["sk"]] = json.loads(response["data"])
-
-                    new_total_stats = {}
-                    new_total_stats[match_id] = convert_stats_to_dict(data["statsall"])
-
-                    teamA, teamB, aliases, team_mapping, alias_team_str = build_teams(new_total_stats)
-                    match_summary = build_new_match_summary(match_dict, team_mapping)
-                    data["match_summary"] = match_summary
-                    data["gamelog"] = gamelog_dict
+                    logger.info("No match document for " + match_id + ", assembling it.")
+                    item_list = []
+                    item_list.append({"pk": "statsall", "sk": match_id})
+                    item_list.append({"pk": "wstatsall", "sk": match_id})
+                    item_list.append({"pk": match_pk(match_id), "sk": match_id + "1"})
+                    item_list.append({"pk": match_pk(match_id), "sk": match_id + "2"})
+                    item_list.append({"pk": "gamelogs", "sk": match_id + "1"})
+                    item_list.append({"pk": "gamelogs", "sk": match_id + "2"})
+                    responses = get_batch_items(item_list, ddb_table, log_stream_name)
+
+                    # logic specific to /stats/{match_id}
+                    if "error" in responses:
+                        data = responses
+                    else:
+                        responses = get_data_parts(responses, log_stream_name)
+                        data = {}
+                        match_dict = {}
+                        gamelog_dict = {}
+                        for response in responses:
+                            if response["pk"] == "statsall":
+                                data["statsall"] = decode_data(response)
+                                data["match_id"] = response["sk"]
+                                data["type"] = response["gsi1pk"].replace("statsall#", "")
+                            if response["pk"] == "wstatsall":
+                                data["wstatsall"] = decode_data(response)
+                            if is_match_pk(response["pk"]):
+                                match_dict[response["sk"]] = json.loads(response["data"])
+                            if response["pk"] == "gamelogs":
+                                gamelog_dict[response["sk"]] = decode_data(response)
+
+                        new_total_stats = {}
+                        new_total_stats[match_id] = convert_stats_to_dict(data["statsall"])
+
+                        teamA, teamB, aliases, team_mapping, alias_team_str = build_teams(new_total_stats)
+                        match_summary = build_new_match_summary(match_dict, team_mapping)
+                        data["match_summary"] = match_summary
+                        data["gamelog"] = gamelog_dict
 
     if api_path == "/stats/group/{group_name}":
         logger.info("Processing " + api_path)
@@ -365,7 +427,7 @@ def handler(event, context):
 
             # logic specific to /wstats/{match_id}
             if "error" not in response:
-                data = {"wstatsall": json.loads(response["data"])}
+                data = {"wstatsall": decode_data(response)}
                 data["match_id"] = response["sk"]
                 # data["type"] = response["gsi1pk"].replace("wstats#","")
             else:
@@ -382,7 +444,10 @@ def handler(event, context):
 
             # logic specific to /gamelogs/{match_id}
             if "error" not in response:
-                data = json.loads(response["data"])
+                if len(get_data_parts([response], log_stream_name)) > 0:
+                    data = decode_data(response)
+                else:
+                    data = make_error_dict("[x] Gamelog parts are missing: ", match_round_id)
             else:
                 data = response
 
@@ -481,9 +546,17 @@ def handler(event, context):
 
         if season != "current":
             pk = season + "#" + pk
-
-        response = get_leaders(pk, ddb_table, projection, limit, only_recent, log_stream_name)
-        data = process_leader_response(response, season)
+            response = get_leaders(pk, ddb_table, projection, limit, only_recent, log_stream_name)
+            data = process_leader_response(response, season)
+        else:
+            # materialized by post-processing, see lambdas/layers/ddb_access/python/leaderboards.py
+            board = get_leaderboard(pk, limit, only_recent, log_stream_name)
+            if "error" in board:
+                logger.warning(board["error"] + " Querying leaders instead.")
+                response = get_leaders(pk, ddb_table, projection, limit, only_recent, log_stream_name)
+                data = process_leader_response(response, season)
+            else:
+                data = process_leaderboard(board, "games" in projection)
 
     if api_path == "/eloprogress/player/{player_guid}/region/{region}/type/{type}":
         logger.info("Processing " + api_path)
@@ -522,9 +595,13 @@ def handler(event, context):
         begins_with = region + "#" + type_ + "#"
         ascending = False
         projections = "season_name, lsipk, sk, player_number"
-        response = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
-                              limit, ascending)
-        data = process_seasons_response(response)
+        data = season_cache.lookup(begins_with)
+        if not isinstance(data, list):
+            response = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
+                                  limit, ascending)
+            data = process_seasons_response(response)
+            if isinstance(data, list):
+                season_cache.put(begins_with, data)
 
     if api_path == "/eloprogress/match/{match_id}":
         logger.info("Processing " + api_path)
@@ -581,7 +658,7 @@ def handler(event, context):
         skname = "gsi1sk"
         projections = "sk, gsi1sk, last_seen, lsipk, real_name"
         responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
-                               40, True)
+                               40, True, page)
         data = process_alias_responses(api_path, responses)
 
     if api_path == "/aliases/player/{player_guid}":
@@ -598,7 +675,7 @@ def handler(event, context):
         ascending = False
         projections = "sk, gsi1sk, last_seen, lsipk, real_name"
         responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
-                               limit, ascending)
+                               limit, ascending, page)
         data = process_alias_responses(api_path, responses)
 
     if api_path == "/aliases/recent/limit/{limit}":
@@ -618,8 +695,14 @@ def handler(event, context):
 
         ascending = False
         projections = "sk, gsi1sk, last_seen, lsipk, real_name"
-        responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
-                               limit, ascending)
+        if since is not None:
+            responses = get_feed(since,
+                                 lambda low, extra: get_after(pk_name, pk, str(low), ddb_table, index_name, skname,
+                                                              projections, log_stream_name, limit + extra),
+                                 "lsipk", lambda lsipk: int(lsipk.split("#")[0]), feed_overlaps["aliases"])
+        else:
+            responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
+                                   log_stream_name, limit, ascending, page)
         data = process_alias_responses(api_path, responses)
 
     if api_path == "/servers" or api_path == "/servers/detail":
@@ -627,7 +710,7 @@ def handler(event, context):
         pk_name = "pk"
         pk = "server"
         limit = 200
-        responses = get_query_all(pk_name, pk, ddb_table, log_stream_name, limit)
+        responses = get_query_all(pk_name, pk, ddb_table, log_stream_name, limit, page)
         data = process_server_responses(api_path, responses)
 
     if api_path == "/events/{limit}":
@@ -645,8 +728,15 @@ def handler(event, context):
             limit = min(int(limit_str), limit)
         ascending = False
         begins_with = "2"  # fix by year 3000
-        responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name,
-                               limit, ascending)
+        if since is not None:
+            responses = get_feed(since,
+                                 lambda low, extra: get_after(pk_name, pk, event_timestamp(low - 1), ddb_table,
+                                                              index_name, skname, projections + ", pk, sk",
+                                                              log_stream_name, limit + extra),
+                                 "gsi2sk", event_epoch, feed_overlaps["events"])
+        else:
+            responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
+                                   log_stream_name, limit, ascending, page)
         data = process_event_responses(api_path, responses)
 
     if api_path == "/mapstats/region/{region}/type/{type}/player/{player_guid}":
@@ -744,14 +834,15 @@ def handler(event, context):
             begins_with = region
             projections = "sk, region, lsipk, submissions, data"
             responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                   log_stream_name, limit, ascending)
+                                   log_stream_name, limit, ascending, page)
 
         if api_path == "/servers/region/{region}/active":
             dt = datetime.datetime.now() - datetime.timedelta(days=30)
             dt_str = dt.strftime("%Y-%m-%d %H:%M:%S")
             sklow = region + "#" + dt_str
             skhigh = region + "#" + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            responses = get_range(index_name, pk, str(sklow), str(skhigh), ddb_table, log_stream_name, limit, ascending)
+            responses = get_range(index_name, pk, str(sklow), str(skhigh), ddb_table, log_stream_name, limit, ascending,
+                                  page)
 
         data = process_server_responses(api_path, responses)
 
@@ -776,7 +867,7 @@ def handler(event, context):
             begins_with = path_tokens[1]
             ascending = True  # next group with same id will overwrite the older one
             responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                   log_stream_name, 100, ascending)
+                                   log_stream_name, 100, ascending, page)
             data = process_group_responses(responses)
 
         if (len(path_tokens) == 4 and path_tokens[0] == "region" and path_tokens[1] in ["sa", "na", "eu", "unk"] and
@@ -789,7 +880,7 @@ def handler(event, context):
             begins_with = path_tokens[1] + "#" + path_tokens[3]
             ascending = False
             responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                   log_stream_name, 100, ascending)
+                                   log_stream_name, 100, ascending, page)
             data = process_group_responses(responses)
 
         if (len(path_tokens) == 6 and path_tokens[0] == "region" and path_tokens[1] in ["sa", "na", "eu", "unk"] and
@@ -803,22 +894,185 @@ def handler(event, context):
             begins_with = path_tokens[1] + "#" + path_tokens[3] + "#" + path_tokens[5]
             ascending = False
             responses = get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections,
-                                   log_stream_name, 100, ascending)
+                                   log_stream_name, 100, ascending, page)
             data = process_group_responses(responses)
 
         if len(data) == 0:
             data = make_error_dict("Could not match path:", path)
 
+    if page is not None and page["used"]:
+        data = make_page_data(data, page)
+    if since is not None and since["next"] is not None:
+        data = make_feed_data(data, since)
+
+    return make_response(data, body)
+
+
+def make_response(data, body=None):
     return {
         'statusCode': 200,
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps(data, default=default_type_error_handler)
+        'body': body if body is not None else json.dumps(data, default=default_type_error_handler)
     }
 
 
+def get_page(event):
+    """Pagination state of a request that asks for pages, None for the plain list responses.
+
+    ?paginate=true asks for the first page and ?cursor=<next> for the page
+    after it. Paged list responses are {"items": [...], "next": cursor or null}.
+    A cursor is only valid for the path it came from.
+    """
+    params = event.get("queryStringParameters") or {}
+    if params.get("since") or ("cursor" not in params and params.get("paginate", "").lower() not in ["true", "1"]):
+        return None
+    shape = event["resource"] + json.dumps(event.get("pathParameters") or {}, sort_keys=True)
+    start_key = None
+    if params.get("cursor"):
+        start_key = decode_cursor(params["cursor"], shape)
+    return {"shape": shape, "start_key": start_key, "last_key": None, "used": False}
+
+
+def make_page_data(data, page):
+    """Wrap a list response with the cursor of the next page."""
+    if "error" in data:
+        if "Items do not exist" not in data["error"] or (page["start_key"] is None and page["last_key"] is None):
+            return data
+        data = []  # the previous page was the last one, or older pages may still have items
+    next_cursor = None
+    if page["last_key"] is not None:
+        next_cursor = encode_cursor(page["shape"], page["last_key"])
+    return {"items": data, "next": next_cursor}
+
+
+def get_since(event):
+    """Feed state of a ?since= request, None for other requests.
+
+    The first poll passes a unix time, ?since=1638402500, and every poll
+    after it the "since" cursor of the previous response. Feed responses are
+    {"items": [...], "since": cursor} with the items added since then, oldest
+    first, so a poll with nothing new is a few bytes.
+    """
+    params = event.get("queryStringParameters") or {}
+    if not params.get("since"):
+        return None
+    shape = "since|" + event["resource"] + json.dumps(event.get("pathParameters") or {}, sort_keys=True)
+    if params["since"].isdigit():
+        state = {"low": int(params["since"]), "seen": []}
+    else:
+        state = decode_cursor(params["since"], shape)
+        if not isinstance(state, dict) or "low" not in state or "seen" not in state:
+            raise ValueError("Invalid cursor")
+    return {"shape": shape, "low": state["low"], "seen": state["seen"], "next": None}
+
+
+def get_feed(since, query, sort_key, to_epoch, overlap):
+    """Items of a feed that were not returned before, oldest first.
+
+    query(low, extra) returns the items with a sort_key time from unix time
+    low on, ascending, extra more than the route limit. Items are keyed by
+    when the match (or event) happened, not when they were written, so they
+    can show up to overlap seconds out of order. The next poll starts overlap
+    seconds before the newest item returned and skips the ids of the items it
+    already got, which the cursor carries.
+    """
+    seen = set(item_id for epoch, item_id in since["seen"])
+    responses = query(since["low"], len(seen))
+    if "error" in responses:
+        if "Items do not exist" not in responses["error"]:
+            return responses
+        responses = []
+
+    delivered = [list(entry) for entry in since["seen"]]
+    items = []
+    for item in responses:
+        epoch = to_epoch(item[sort_key])
+        item_id = get_feed_item_id(item, sort_key)
+        if epoch < since["low"] or item_id in seen:
+            continue
+        items.append(item)
+        delivered.append([epoch, item_id])
+
+    newest = max([entry[0] for entry in delivered], default=since["low"])
+    low = max(since["low"], newest - overlap)
+    since["next"] = {"low": low, "seen": [entry for entry in delivered if entry[0] >= low]}
+    return items
+
+
+def get_feed_item_id(item, sort_key):
+    """Short id of an item in a feed cursor, changes when the item moves in the feed."""
+    key = item[sort_key] + "|" + item.get("pk", "") + "|" + item.get("sk", "")
+    return hashlib.sha1(key.encode()).hexdigest()[0:12]
+
+
+def make_feed_data(data, since):
+    """Wrap a feed response with the cursor of the next poll."""
+    if "error" in data:
+        return data
+    return {"items": data, "since": encode_cursor(since["shape"], since["next"])}
+
+
+def event_epoch(timestamp):
+    """Unix time of an event gsi2sk, an isoformat time written in UTC. 0 for anything else."""
+    try:
+        return int(datetime.datetime.fromisoformat(timestamp).replace(tzinfo=datetime.timezone.utc).timestamp())
+    except ValueError:
+        return 0
+
+
+def event_timestamp(epoch):
+    """Event gsi2sk of a unix time."""
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def encode_cursor(shape, start_key):
+    """Opaque token of an ExclusiveStartKey, signed together with the query shape."""
+    payload = base64.urlsafe_b64encode(json.dumps(start_key, default=default_type_error_handler,
+                                                  separators=(",", ":")).encode()).decode().rstrip("=")
+    return payload + "." + sign_cursor(shape, payload)
+
+
+def decode_cursor(cursor, shape):
+    """ExclusiveStartKey of a cursor. Raises ValueError if it was not made for this shape."""
+    payload, _, signature = cursor.partition(".")
+    if not hmac.compare_digest(signature, sign_cursor(shape, payload)):
+        raise ValueError("Invalid cursor")
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return start_key
+
+
+def sign_cursor(shape, payload):
+    digest = hmac.new(get_cursor_key(), (shape + "|" + payload).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[0:18]).decode()
+
+
+def get_cursor_key():
+    """Secret of the cursor signatures shared by all containers.
+
+    The stack generates it in Secrets Manager (stacks/delivery_retriever.py)
+    and passes its arn in RTCWPROSTATS_CURSOR_SECRET_ARN.
+    """
+    global cursor_key
+    if cursor_key is None:
+        if not cursor_secret_arn:
+            logger.warning("No cursor secret, cursors only work in this container.")
+            cursor_key = os.urandom(32)
+            return cursor_key
+        try:
+            secret = boto3.client('secretsmanager').get_secret_value(SecretId=cursor_secret_arn)
+        except ClientError as e:
+            logger.warning("Could not read the cursor secret, cursors only work for this request: " + e.response['Error']['Message'])
+            return os.urandom(32)  # try the secret again next time
+        cursor_key = secret["SecretString"].encode()
+    return cursor_key
+
+
 # https://stackoverflow.com/questions/63278737/object-of-type-decimal-is-not-json-serializable
 def default_type_error_handler(obj):
     if isinstance(obj, decimal.Decimal):
@@ -896,70 +1150,153 @@ def get_leaders(pk, table, projection, limit, only_recent, log_stream_name):
     return result
 
 
-def get_range(index_name, pk, sklow, skhigh, table, log_stream_name, limit, ascending):
+def get_leaderboard(pk, limit, only_recent, log_stream_name):
+    """Get top leaders of a materialized board the same way get_leaders reads the index."""
+    response = get_item("leaderboard", pk, ddb_table, log_stream_name)
+    if "error" in response:
+        return response
+    if limit > int(response.get("size", 0)):
+        return make_error_dict("[x] Leaderboard is smaller than the limit: ", pk)
+    entries = json.loads(response["data"])
+
+    leaders = entries[0:limit]
+    if only_recent:
+        dt_str = (datetime.datetime.now() - datetime.timedelta(days=30)).isoformat()
+        recent_leaders = [entry for entry in leaders if entry["updated"] > dt_str]
+        if len(recent_leaders) >= 10:  # same retry rule as get_leaders
+            leaders = recent_leaders
+        else:
+            logger.warning("Leaders API requirying due to low number of leaders " + pk)
+    return leaders
+
+
+def get_range(index_name, pk, sklow, skhigh, table, log_stream_name, limit, ascending, page=None):
     """Get several items by pk and range of sk."""
     item_info = pk + ":" + sklow + " to " + skhigh + ". Logstream: " + log_stream_name
-    try:
-        if index_name == "lsi":
-            response = table.query(IndexName=index_name,
-                                   KeyConditionExpression=Key('pk').eq(pk) & Key("lsipk").between(sklow, skhigh),
-                                   Limit=limit, ReturnConsumedCapacity='NONE', ScanIndexForward=ascending)
-        elif index_name == "gsi1":
-            response = table.query(IndexName=index_name,
-                                   KeyConditionExpression=Key('gsi1pk').eq(pk) & Key("gsi1sk").between(sklow, skhigh),
-                                   Limit=limit, ReturnConsumedCapacity='NONE', ScanIndexForward=ascending)
-        else:
-            response = table.query(KeyConditionExpression=Key('pk').eq(pk) & Key('sk').between(sklow, skhigh),
-                                   Limit=limit, ReturnConsumedCapacity='NONE', ScanIndexForward=ascending)
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
+    query_args = {"Limit": limit, "ReturnConsumedCapacity": 'NONE', "ScanIndexForward": ascending}
+    if index_name == "lsi":
+        query_args["IndexName"] = index_name
+        query_args["KeyConditionExpression"] = Key('pk').eq(pk) & Key("lsipk").between(sklow, skhigh)
+    elif index_name == "gsi1":
+        query_args["IndexName"] = index_name
+        query_args["KeyConditionExpression"] = Key('gsi1pk').eq(pk) & Key("gsi1sk").between(sklow, skhigh)
     else:
-        if response['Count'] > 0:
-            result = response['Items']
-        else:
-            result = make_error_dict("[x] Items do not exist: ", item_info)
+        query_args["KeyConditionExpression"] = Key('pk').eq(pk) & Key('sk').between(sklow, skhigh)
+    return query_page(table, query_args, item_info, page)
+
+
+def get_match_range_lsi(sk_prefix, sklow, skhigh, log_stream_name, limit):
+    """Match rounds of a region#type# from unix time sklow to skhigh, newest first."""
+    return get_match_shards(shards_between(sklow, skhigh),
+                            lambda pk, shard_page: get_range("lsi", pk, sk_prefix + str(sklow), sk_prefix + str(skhigh),
+                                                             ddb_table, log_stream_name, limit, False, shard_page),
+                            "lsi", limit, False, log_stream_name)
+
+
+def get_match_shards(shards, query, index_name, limit, ascending, log_stream_name, page=None, max_shards=None):
+    """Run query(pk, shard_page) on match shards in parallel and merge the results like one query would return them.
+
+    With a page, shards before the one of page["start_key"] are skipped and
+    the key of the last item is the next start once limit items are found.
+
+    max_shards bounds the shards one request reads. When they have fewer
+    than limit items a page continues at the top of the next shard, the
+    start key {"pk": shard} without a sort key.
+    """
+    start_key = None
+    if page is not None:
+        page["used"] = True
+        start_key = page["start_key"]
+        if start_key is not None:
+            shards = shards[shards.index(start_key["pk"]):] if start_key["pk"] in shards else []
+            if len(start_key) == 1:
+                start_key = None  # top of the shard
+    next_shards = []
+    if max_shards is not None:
+        shards, next_shards = shards[0:max_shards], shards[max_shards:]
+    item_info = str(len(shards)) + " match shards. Logstream: " + log_stream_name
+
+    def query_shard(pk):
+        shard_page = {"start_key": start_key if start_key is not None and start_key["pk"] == pk else None}
+        response = query(pk, shard_page)
+        if "error" not in response:
+            return response
+        if "Items do not exist" in response["error"]:
+            return []
+        raise Exception(response["error"])
+
+    try:
+        result = query_shards(shards, query_shard, shard_key_names[index_name][-1], limit, ascending)
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.warning(error_msg)
+        return make_error_dict("[x] Client error calling database: ", item_info)
+    if page is not None and len(result) == limit:
+        page["last_key"] = {name: result[-1][name] for name in shard_key_names[index_name]}
+    elif page is not None and len(next_shards) > 0:
+        page["last_key"] = {"pk": next_shards[0]}
+    if len(result) == 0:
+        return make_error_dict("[x] Items do not exist: ", item_info)
     return result
 
 
-def get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name, limit, ascending):
+def get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name, limit, ascending,
+               page=None):
     """Get several items by pk and range of sk."""
     item_info = pk + ": begins with " + begins_with + ". Logstream: " + log_stream_name
+    query_args = {"KeyConditionExpression": Key(pk_name).eq(pk) & Key(skname).begins_with(begins_with),
+                  "Limit": limit, "ScanIndexForward": ascending}
+    query_args.update(get_projection_args(projections))
+    if index_name:
+        query_args["IndexName"] = index_name
+    return query_page(ddb_table, query_args, item_info, page)
+
+
+def get_after(pk_name, pk, after, ddb_table, index_name, skname, projections, log_stream_name, limit):
+    """Get several items by pk with sk greater than after, oldest first."""
+    item_info = pk + ": after " + after + ". Logstream: " + log_stream_name
+    query_args = {"KeyConditionExpression": Key(pk_name).eq(pk) & Key(skname).gt(after),
+                  "Limit": limit, "ScanIndexForward": True}
+    query_args.update(get_projection_args(projections))
+    if index_name:
+        query_args["IndexName"] = index_name
+    return query_page(ddb_table, query_args, item_info)
+
+
+def get_projection_args(projections):
+    """ProjectionExpression of projections with the reserved words data and region aliased."""
     projections = projections.replace("data", "#data_value").replace("region", "#region_value")
+    projection_args = {"ProjectionExpression": projections}
 
     expressionAttributeNames = {}  # knee deep
     if '#data_value' in projections:
         expressionAttributeNames['#data_value'] = 'data'
     if '#region_value' in projections:
         expressionAttributeNames['#region_value'] = 'region'
+    if "_value" in projections:  # wish there was a way to not error over unuzed projection names
+        projection_args["ExpressionAttributeNames"] = expressionAttributeNames
+    return projection_args
+
+
+def query_page(table, query_args, item_info, page=None):
+    """Run one query. Returns its items, or an error dict when there are none.
 
+    With a page (see get_page) the query starts after page["start_key"] and
+    leaves its LastEvaluatedKey in page["last_key"] for the next cursor.
+    """
+    if page is not None:
+        page["used"] = True
+        if page["start_key"] is not None:
+            query_args = dict(query_args, ExclusiveStartKey=page["start_key"])
     try:
-        if index_name:
-            if "_value" in projections:  # wish there was a way to not error over unuzed projection names
-                response = ddb_table.query(IndexName=index_name,
-                                           KeyConditionExpression=Key(pk_name).eq(pk) & Key(skname).begins_with(
-                                               begins_with), ProjectionExpression=projections,
-                                           ExpressionAttributeNames=expressionAttributeNames, Limit=limit,
-                                           ScanIndexForward=ascending)
-            else:
-                response = ddb_table.query(IndexName=index_name,
-                                           KeyConditionExpression=Key(pk_name).eq(pk) & Key(skname).begins_with(
-                                               begins_with), ProjectionExpression=projections, Limit=limit,
-                                           ScanIndexForward=ascending)
-        else:
-            if "_value" in projections:
-                response = ddb_table.query(
-                    KeyConditionExpression=Key(pk_name).eq(pk) & Key(skname).begins_with(begins_with),
-                    ProjectionExpression=projections, ExpressionAttributeNames=expressionAttributeNames, Limit=limit,
-                    ScanIndexForward=ascending)
-            else:
-                response = ddb_table.query(
-                    KeyConditionExpression=Key(pk_name).eq(pk) & Key(skname).begins_with(begins_with),
-                    ProjectionExpression=projections, Limit=limit, ScanIndexForward=ascending)
+        response = table.query(**query_args)
     except ClientError as e:
         logger.warning("Exception occurred: " + e.response['Error']['Message'])
         result = make_error_dict("[x] Client error calling database: ", item_info)
     else:
+        if page is not None:
+            page["last_key"] = response.get("LastEvaluatedKey")
         if response['Count'] > 0:
             result = response['Items']
         else:
@@ -1014,37 +1351,19 @@ def get_maps_all(region_type, ddb_table, log_stream_name):
     return result
 
 
-def get_query_all(pk_name, pk, ddb_table, log_stream_name, limit):
+def get_query_all(pk_name, pk, ddb_table, log_stream_name, limit, page=None):
     """Get several items by pk."""
     item_info = pk + ". Logstream: " + log_stream_name
-    try:
-        response = ddb_table.query(KeyConditionExpression=Key(pk_name).eq(pk), Limit=limit)
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if response['Count'] > 0:
-            result = response['Items']
-        else:
-            result = make_error_dict("[x] Items do not exist: ", item_info)
-    return result
+    return query_page(ddb_table, {"KeyConditionExpression": Key(pk_name).eq(pk), "Limit": limit}, item_info, page)
 
 
-def get_batch_items(item_list, ddb_table, log_stream_name):
-    """Get items in a batch."""
-    dynamodb = boto3.resource('dynamodb')
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={ddb_table.name: {'Keys': item_list}})
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            result = make_error_dict("[x] Item does not exist: ", item_info)
-    return result
+def get_data_parts(items, log_stream_name):
+    """Attach the parts of split gamelogs in one batch, dropping the gamelogs with missing parts."""
+    missing_parts = fetch_data_parts(items, lambda keys: get_batch_items(keys, ddb_table, log_stream_name))
+    if len(missing_parts) > 0:
+        logger.warning("Gamelog parts are missing: " + ", ".join([key["sk"] for key in missing_parts]))
+        items = [item for item in items if "data_parts" not in item or "data_part_items" in item]
+    return items
 
 
 def make_error_dict(message, item_info):
@@ -1223,6 +1542,23 @@ def process_leader_response(response, season):
     return data
 
 
+def process_leaderboard(leaders, with_games):
+    skoal = get_skoal()
+    data = []
+    for entry in leaders:
+        if entry["guid"] in skoal:
+            logger.info(entry["guid"] + " is dropped due to skoal")
+            continue
+        data.append({
+            'real_name': entry["real_name"],
+            'value': entry["value"],
+            'guid': entry["guid"],
+            'games': entry["games"] if with_games else -1,
+            'match_id': entry["match_id"]
+        })
+    return data
+
+
 def process_eloprogress_response(response, filter_old_elos):
     data = []
     if "error" in response:
@@ -1275,17 +1611,21 @@ def get_skoal():
     """
     Get list of players that wish not to be on ladders and personal profiles.
     """
-    pk = "skoal"
-    sk = "v0"
     skoal = []
     try:
-        skoal_response = get_item(pk, sk, ddb_table, "skoal_get")
-        skoal = json.loads(skoal_response.get("skoal", "[]"))
+        skoal = skoal_cache.get("v0", load_skoal)
     except:
         logger.error("Could not get skoal.")
     return skoal
 
 
+def load_skoal(sk):
+    skoal_response = get_item("skoal", sk, ddb_table, "skoal_get")
+    if "error" in skoal_response and "does not exist" not in skoal_response["error"]:
+        raise Exception(skoal_response["error"])  # do not cache a failed read as an empty skoal
+    return json.loads(skoal_response.get("skoal", "[]"))
+
+
 if __name__ == "__main__":
     event_str = '''
     {
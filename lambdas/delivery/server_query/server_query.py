@@ -9,6 +9,9 @@ import os
 import decimal
 import datetime
 import traceback
+from ddb_access import get_batch_items
+import ref_cache
+from match_shards import all_shards, query_shards
 
 if __name__ == "__main__":
     TABLE_NAME = "rtcwprostats-database-DDBTable2F2A2F95-1BCIOU7IE3DSE"
@@ -17,6 +20,8 @@ else:
 
 dynamodb = boto3.resource('dynamodb')
 ddb_table = dynamodb.Table(TABLE_NAME)
+skoal_cache = ref_cache.get_cache("skoal")
+server_cache = ref_cache.get_cache("servers")
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
@@ -115,6 +120,7 @@ def handler(event, context):
 
     logger.info("The following response was sent.")
     logger.info(response)
+    ref_cache.log_stats()
     return {
         'statusCode': 200,
         'headers': {
@@ -189,18 +195,23 @@ def prepare_last_match_response(server_status, type_, log_stream_name, hacked_re
     region_code = get_server_region_code(server_status.get("server_name", "no_server"))
 
     logger.info("Getting last match.")
-    last_three_matches = ddb_table.query(IndexName='lsi',
-                                         KeyConditionExpression=Key('pk').eq('match') & Key('lsipk').begins_with(
-                                             region_code + "#" + type_ + "#"), Limit=3, ScanIndexForward=False)
+
+    def query_shard(pk):
+        response = ddb_table.query(IndexName='lsi',
+                                   KeyConditionExpression=Key('pk').eq(pk) & Key('lsipk').begins_with(
+                                       region_code + "#" + type_ + "#"), Limit=3, ScanIndexForward=False)
+        return response["Items"]
+
+    # newest shards first, stops once the last three rounds are found
+    last_three_matches = query_shards(all_shards(), query_shard, "lsipk", limit=3)
     last_match = None
-    if "Items" in last_three_matches:
-        for match_info in last_three_matches["Items"]:
-            if match_info["sk"][-1:] == "2":
-                last_match = match_info
-                break
+    for match_info in last_three_matches:
+        if match_info["sk"][-1:] == "2":
+            last_match = match_info
+            break
 
-        if not last_match:
-            raise ValueError("Could not find a full match.")
+    if not last_match:
+        raise ValueError("Could not find a full match.")
 
     match_data = json.loads(last_match["data"])
     match_id = last_match["sk"][:-1]
@@ -401,7 +412,7 @@ def get_server_region_code(server_name):
     server = None
     logger.info("Getting region code for " + server_name)
     if server_name:
-        server = ddb_get_server(server_name, ddb_table)
+        server = server_cache.get(server_name, lambda name: ddb_get_server(name, ddb_table))
     else:
         logger.warning("No server name is found in the server payload.")
         region = "na"
@@ -462,17 +473,21 @@ def get_skoal():
     """
     Get list of players that wish not to be on ladders and personal profiles.
     """
-    pk = "skoal"
-    sk = "v0"
     skoal = []
     try:
-        skoal_response = get_item(pk, sk, ddb_table, "skoal_get")
-        skoal = json.loads(skoal_response.get("skoal", "[]"))
+        skoal = skoal_cache.get("v0", load_skoal)
     except:
         logger.error("Could not get skoal.")
     return skoal
 
 
+def load_skoal(sk):
+    skoal_response = get_item("skoal", sk, ddb_table, "skoal_get")
+    if "error" in skoal_response and "does not exist" not in skoal_response["error"]:
+        raise Exception(skoal_response["error"])  # do not cache a failed read as an empty skoal
+    return json.loads(skoal_response.get("skoal", "[]"))
+
+
 def get_item(pk, sk, table, log_stream_name):
     """Get one dynamodb item."""
     item_info = pk + ":" + sk + ". Logstream: " + log_stream_name
@@ -521,23 +536,6 @@ def get_query_all(pk_name, pk, ddb_table, log_stream_name, limit):
     return result
 
 
-def get_batch_items(item_list, ddb_table, log_stream_name):
-    """Get items in a batch."""
-    dynamodb = boto3.resource('dynamodb')
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={ddb_table.name: {'Keys': item_list}})
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            result = make_error_dict("[x] Item does not exist: ", item_info)
-    return result
-
-
 def make_error_dict(message, item_info):
     """Make an error message for API gateway."""
     return {"error": message + " " + item_info}
@@ -0,0 +1,114 @@
+"""
+Encoding of the json kept in the "data" attribute of large items
+(statsall, wstatsall, gamelogs).
+
+Part of the ddb_access layer, the writer and every reader import it:
+
+    from data_codec import encode_data, decode_data, fetch_data_parts
+
+Encoded items carry a "data_enc" marker naming the encoding:
+
+    no data_enc    json text, every item written before encodings existed
+    "zlib"         zlib compressed json text in a binary attribute
+
+A new encoding gets a new marker and readers keep every older one, so
+items never need to be rewritten.
+
+Lists too big for one item (long gamelogs) are split in ordered parts.
+The item under the usual key has no data, only the number of parts,
+and each part is an item of its own:
+
+    {"pk": "gamelogs", "sk": "16098173561", "data_parts": 2}
+    {"pk": "gamelogs", "sk": "16098173561#part1", "data": ..., "data_enc": "zlib"}
+    {"pk": "gamelogs", "sk": "16098173561#part2", "data": ..., "data_enc": "zlib"}
+
+Readers call fetch_data_parts on the items they got before decoding them.
+"""
+import json
+import math
+import zlib
+
+write_encoding = "zlib"  # None writes plain json text
+compress_level = 6
+max_data_size = 350000  # bytes, stay clear of the 400 KB item limit
+
+
+def encode_data(obj, encoding=write_encoding):
+    """Attributes data and data_enc holding obj as json."""
+    text = json.dumps(obj)
+    if encoding is None:
+        return {"data": text}
+    if encoding == "zlib":
+        return {"data": zlib.compress(text.encode(), compress_level), "data_enc": "zlib"}
+    raise ValueError("Unknown data encoding " + str(encoding))
+
+
+def encode_data_parts(obj_list, encoding=write_encoding, max_size=None):
+    """Encode a list in as few ordered parts as needed for each to fit in an item."""
+    if max_size is None:
+        max_size = max_data_size
+    parts = [encode_data(obj_list, encoding)]
+    num_parts = 1
+    while max(len(part["data"]) for part in parts) > max_size:
+        if num_parts >= len(obj_list):
+            raise ValueError("Cannot split data in parts below " + str(max_size) + " bytes")
+        num_parts = min(num_parts * 2, len(obj_list))
+        part_length = math.ceil(len(obj_list) / num_parts)
+        parts = [encode_data(obj_list[start: start + part_length], encoding)
+                 for start in range(0, len(obj_list), part_length)]
+    return parts
+
+
+def get_part_keys(item):
+    """Keys of the parts of a split item."""
+    return [{"pk": item["pk"], "sk": item["sk"] + "#part" + str(num)} for num in range(1, int(item["data_parts"]) + 1)]
+
+
+def fetch_data_parts(items, get_items):
+    """Get the parts of every split item in items with one get_items(keys) call.
+
+    Parts are attached to their item so decode_data can put them back
+    together. Returns the keys of parts that were not found.
+    """
+    heads = [item for item in items if "data_parts" in item]
+    if len(heads) == 0:
+        return []
+    keys = []
+    for head in heads:
+        keys.extend(get_part_keys(head))
+    response = get_items(keys)
+    found = {} if "error" in response else {part["sk"]: part for part in response}
+
+    missing = []
+    for head in heads:
+        head_keys = get_part_keys(head)
+        head_missing = [key for key in head_keys if key["sk"] not in found]
+        if len(head_missing) > 0:
+            missing.extend(head_missing)
+        else:
+            head["data_part_items"] = [found[key["sk"]] for key in head_keys]
+    return missing
+
+
+def decode_data_text(item):
+    """Json text of the data attribute of an item, whatever its encoding."""
+    data_enc = item.get("data_enc")
+    data = item["data"]
+    if data_enc is None:
+        return data
+    if data_enc == "zlib":
+        # boto3 returns binary attributes wrapped in Binary
+        return zlib.decompress(getattr(data, "value", data)).decode()
+    raise ValueError("Unknown data encoding " + str(data_enc))
+
+
+def decode_data(item):
+    """Json loaded data attribute of an item, put back together if it was split."""
+    if "data_parts" in item:
+        if "data_part_items" not in item:
+            raise ValueError("Parts of " + item["pk"] + ":" + item["sk"] + " were not fetched")
+        data = []
+        for part in item["data_part_items"]:
+            data.extend(decode_data(part))
+        return data
+    return json.loads(decode_data_text(item))
@@ -0,0 +1,269 @@
+"""
+DynamoDB batch access shared by all lambdas.
+
+Deployed as the ddb_access Lambda layer (stacks/database.py), so lambdas
+import it as a top level module:
+
+    from ddb_access import get_batch_items, batch_write_items
+
+- one pooled keep-alive client per process, reused by warm invocations,
+- batch reads and writes of any size, split in 100 key and 25 item chunks
+  that run in parallel,
+- UnprocessedKeys and UnprocessedItems are retried with jittered
+  exponential backoff,
+- parallel writes follow an AIMD concurrency limit: one more batch in
+  flight per round of clean batches, half as many after a throttled one,
+- consumed capacity of every call is added up, see get_consumed_capacity.
+
+Items go in and come out as python types, same as with boto3 resources.
+"""
+import logging
+import random
+import threading
+import time as _time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("ddb_access")
+logger.setLevel(log_level)
+
+get_chunk_size = 100  # batch_get_item limit
+write_chunk_size = 25  # batch_write_item limit
+max_workers = 8
+max_attempts = 8
+backoff_base = 0.05  # seconds
+backoff_cap = 5  # seconds
+adaptive_concurrency = True  # False keeps max_workers write batches in flight
+start_concurrency = 4  # write batches in flight before the first one comes back
+throttle_error_codes = ["ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"]
+
+client_config = Config(max_pool_connections=max_workers * 2,
+                       tcp_keepalive=True,
+                       retries={"max_attempts": 5, "mode": "standard"})
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+_client = None
+_client_lock = threading.Lock()
+_capacity_lock = threading.Lock()
+consumed_capacity = {"read": 0.0, "write": 0.0}
+
+
+def get_client():
+    """DynamoDB client shared by every call in this process."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client("dynamodb", config=client_config)
+    return _client
+
+
+def set_client(client):
+    """Use another client, e.g. one for DynamoDB local in replays and tests."""
+    global _client
+    _client = client
+
+
+def get_consumed_capacity():
+    """Capacity units consumed by batch calls since the last reset."""
+    with _capacity_lock:
+        return dict(consumed_capacity)
+
+
+def reset_consumed_capacity():
+    with _capacity_lock:
+        consumed_capacity["read"] = 0.0
+        consumed_capacity["write"] = 0.0
+
+
+def add_consumed_capacity(kind, response):
+    units = sum([table_capacity.get("CapacityUnits", 0) for table_capacity in response.get("ConsumedCapacity", [])])
+    with _capacity_lock:
+        consumed_capacity[kind] += units
+
+
+def backoff(attempt):
+    """Sleep a random time up to an exponentially growing cap (full jitter)."""
+    _time.sleep(random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt)))
+
+
+def make_error_dict(message, item_info):
+    """Make an error message for API gateway."""
+    return {"error": message + " " + item_info}
+
+
+def get_batch_items(item_list, ddb_table, log_stream_name, projection=None):
+    """Get any number of items. Returns them, or an error dict like the rest of the lambdas.
+
+    projection may use #data_value for the reserved word data.
+    """
+    item_info = "get_batch_items. Logstream: " + log_stream_name
+    attribute_names = None
+    if projection is not None and "#data_value" in projection:
+        attribute_names = {"#data_value": "data"}
+    try:
+        items = batch_get_items(ddb_table.name, item_list, projection, attribute_names)
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.warning(error_msg)
+        return make_error_dict("[x] Client error calling database: ", item_info)
+    if len(items) == 0:
+        return make_error_dict("[x] Items do not exist: ", item_info)
+    return items
+
+
+def batch_get_items(table_name, keys, projection=None, attribute_names=None, consistent_read=False):
+    """Get any number of items by key. Missing items are left out and the order of keys is not kept."""
+    requests = []
+    for start in range(0, len(keys), get_chunk_size):
+        request = {"Keys": [serialize(key) for key in keys[start: start + get_chunk_size]],
+                   "ConsistentRead": consistent_read}
+        if projection is not None:
+            request["ProjectionExpression"] = projection
+        if attribute_names is not None:
+            request["ExpressionAttributeNames"] = attribute_names
+        requests.append(request)
+
+    items = []
+    for chunk_items in run_parallel(lambda request: get_chunk(table_name, request), requests):
+        items.extend(chunk_items)
+    return items
+
+
+def get_chunk(table_name, request):
+    client = get_client()
+    items = []
+    request_items = {table_name: request}
+    for attempt in range(max_attempts):
+        response = client.batch_get_item(RequestItems=request_items, ReturnConsumedCapacity="TOTAL")
+        add_consumed_capacity("read", response)
+        items.extend([deserialize(item) for item in response["Responses"].get(table_name, [])])
+        request_items = response.get("UnprocessedKeys", {})
+        if len(request_items) == 0:
+            return items
+        logger.warning(f"{len(request_items[table_name]['Keys'])} unprocessed keys, retrying")
+        backoff(attempt)
+    raise Exception("Gave up getting unprocessed keys after " + str(max_attempts) + " attempts")
+
+
+class AimdLimiter:
+    """Concurrency limit of parallel batches, additive increase and multiplicative decrease.
+
+    Every clean batch adds 1/limit, so the limit grows by about one per
+    round of batches. A throttled batch halves it, once for all batches
+    that were already in flight when it went out.
+    """
+
+    def __init__(self, limit, max_limit):
+        self.limit = float(min(limit, max_limit))
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot. Returns the ticket to release it with."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.decreases
+
+    def release(self, ticket, throttled):
+        with self.condition:
+            self.in_flight -= 1
+            if adaptive_concurrency:
+                if not throttled:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                elif ticket == self.decreases:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreases += 1
+            self.condition.notify_all()
+
+
+def batch_write_items(table_name, items):
+    """Put any number of items. Raises if any of them could not be written.
+
+    Returns items, batches, retries (batches sent again), throttles
+    (throttling errors), seconds, items_per_second and the final concurrency.
+    """
+    return write_requests(table_name, [{"PutRequest": {"Item": serialize(item)}} for item in items], "Wrote")
+
+
+def batch_delete_items(table_name, keys):
+    """Delete any number of items by key. Raises if any of them could not be deleted, returns write stats."""
+    return write_requests(table_name, [{"DeleteRequest": {"Key": serialize(key)}} for key in keys], "Deleted")
+
+
+def write_requests(table_name, write_list, verb):
+    """Send put or delete requests in parallel batches, see batch_write_items."""
+    t1 = _time.time()
+    requests = []
+    for start in range(0, len(write_list), write_chunk_size):
+        requests.append(write_list[start: start + write_chunk_size])
+    limit = start_concurrency if adaptive_concurrency else max_workers
+    limiter = AimdLimiter(limit, max_workers)
+    write_stats = {"items": len(write_list), "batches": len(requests), "retries": 0, "throttles": 0}
+    run_parallel(lambda request: write_chunk(table_name, request, limiter, write_stats), requests)
+
+    seconds = _time.time() - t1
+    write_stats["seconds"] = round(seconds, 3)
+    write_stats["items_per_second"] = round(len(write_list) / seconds, 1) if seconds > 0 else len(write_list)
+    write_stats["concurrency"] = round(limiter.limit, 2)
+    logger.info(f"{verb} {len(write_list)} items in {len(requests)} batches in {write_stats['seconds']} s "
+                f"({write_stats['items_per_second']} items/s), {write_stats['retries']} retries, "
+                f"{write_stats['throttles']} throttles, concurrency {write_stats['concurrency']}")
+    return write_stats
+
+
+def write_chunk(table_name, request, limiter, write_stats):
+    client = get_client()
+    request_items = {table_name: request}
+    for attempt in range(max_attempts):
+        ticket = limiter.acquire()
+        throttled = False
+        try:
+            response = client.batch_write_item(RequestItems=request_items, ReturnConsumedCapacity="TOTAL")
+            add_consumed_capacity("write", response)
+            request_items = response.get("UnprocessedItems", {})
+            throttled = len(request_items) > 0
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in throttle_error_codes:
+                raise
+            logger.warning(err.response["Error"]["Code"] + ", retrying")
+            throttled = True
+            with _capacity_lock:
+                write_stats["throttles"] += 1
+        finally:
+            limiter.release(ticket, throttled)
+        if not throttled:
+            return
+        with _capacity_lock:
+            write_stats["retries"] += 1
+        backoff(attempt)
+    raise Exception("Gave up writing unprocessed items after " + str(max_attempts) + " attempts")
+
+
+def run_parallel(function, requests):
+    """Results of function for every request, in order."""
+    if len(requests) <= 1:
+        return [function(request) for request in requests]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+        return list(executor.map(function, requests))
+
+
+def serialize(item):
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item):
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
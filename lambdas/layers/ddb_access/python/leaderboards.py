@@ -0,0 +1,202 @@
+"""
+Materialized top-N leaderboards.
+
+Every gsi1 leader partition (leaderelo#na#6, leaderkdr#..., leaderacc#...,
+leader#<achievement or metric>#na#6) has one board item
+
+    {"pk": "leaderboard", "sk": "leaderelo#na#6", "version": 12,
+     "size": 150, "data": '[{"guid": ..., "real_name": ..., "value": 1712.0, "games": 40,
+               "match_id": -1, "updated": "2023-01-17T06:11:02"}, ...]'}
+
+holding the board_size best players sorted by value. Post-processing merges
+the leader items written for a match into their boards, so the leaders API
+reads one item instead of querying the whole index. Players who drop out of
+a board are not replaced until the next rebuild, which is why boards keep
+more players than the API usually asks for. The season maker clears the
+boards whose leader items it moves to the season archive.
+
+Part of the ddb_access layer, so the fused and the standalone calculators
+and the season maker share it.
+
+Rebuild every board from the existing leader items:
+    python leaderboards.py rebuild [board ...]
+"""
+import heapq
+import json
+import logging
+import sys
+import time as _time
+from datetime import datetime
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("leaderboards")
+logger.setLevel(log_level)
+
+board_size = 150  # the leaders API defaults to 50
+merge_retries = 5
+regions = ["na", "sa", "eu", "unk"]
+types = ["3", "6", "6plus"]
+stat_categories = ["elo", "kdr", "acc"]
+achievement_categories = ["Caps per Game", "Caps per Taken", "HS Ratio",
+                          "Killpeak", "Combat Medic", "Combat Engineer", "Lieutenant Colonel", "Sharpshooter",
+                          "Longest Kill", "MegaKill", "Kills Per Game"]
+
+
+def get_board_names():
+    """gsi1pk of every leader partition."""
+    board_names = []
+    for region in regions:
+        for type_ in types:
+            for category in stat_categories:
+                board_names.append("leader" + category + "#" + region + "#" + type_)
+            for category in achievement_categories:
+                board_names.append("leader#" + category + "#" + region + "#" + type_)
+    return board_names
+
+
+def make_entry(item):
+    """Board line of a leader item."""
+    return {
+        "guid": item["pk"].split("#")[1],
+        "real_name": item.get("real_name", "no_name#"),
+        "value": float(item["gsi1sk"]),
+        "games": int(item.get("games", -1)),
+        "match_id": int(item.get("match_id", -1)),
+        "updated": item.get("updated", "")
+    }
+
+
+def get_candidates(items):
+    """Group leader items of a match by board, later items of the same player win."""
+    candidates = {}
+    for item in items:
+        if str(item.get("gsi1pk", "")).startswith("leader"):
+            candidates.setdefault(item["gsi1pk"], {})[item["pk"].split("#")[1]] = make_entry(item)
+    return candidates
+
+
+def merge_entries(current, entries):
+    """Replace entries of the same players and keep the best board_size."""
+    merged = [entry for entry in current if entry["guid"] not in entries]
+    merged.extend(entries.values())
+    return heapq.nlargest(board_size, merged, key=lambda entry: entry["value"])
+
+
+def update_boards(ddb_table, items):
+    """Merge leader items written for a match into their boards."""
+    t1 = _time.time()
+    candidates = get_candidates(items)
+    for board_name, entries in candidates.items():
+        try:
+            merge_board(ddb_table, board_name, entries)
+        except Exception as ex:
+            # a stale board is fixed by the next match or a rebuild, do not fail the match
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            error_msg = template.format(type(ex).__name__, ex.args)
+            logger.error("Failed to update leaderboard " + board_name + "\n" + error_msg)
+    time_to_update = str(round((_time.time() - t1), 3))
+    logger.info(f"Updated {len(candidates)} leaderboards in {time_to_update} s")
+
+
+def merge_board(ddb_table, board_name, entries):
+    """Read, merge and conditionally write one board, retrying when another match got there first."""
+    for attempt in range(merge_retries):
+        response = ddb_table.get_item(Key={"pk": "leaderboard", "sk": board_name}, ConsistentRead=True)
+        board_item = response.get("Item")
+        if board_item is None:
+            current = []
+            version = 0
+        else:
+            current = json.loads(board_item["data"])
+            version = int(board_item["version"])
+
+        top = merge_entries(current, entries)
+        if top == current:
+            return
+        try:
+            put_board(ddb_table, board_name, top, version)
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info("Leaderboard " + board_name + " changed, merging again.")
+        else:
+            return
+    raise Exception("Gave up merging leaderboard " + board_name + " after " + str(merge_retries) + " attempts")
+
+
+def put_board(ddb_table, board_name, entries, version):
+    item = {
+        "pk": "leaderboard",
+        "sk": board_name,
+        "data": json.dumps(entries),
+        "version": version + 1,
+        "size": board_size,
+        "updated": datetime.now().isoformat()
+    }
+    if version == 0:
+        ddb_table.put_item(Item=item, ConditionExpression="attribute_not_exists(pk)")
+    else:
+        ddb_table.put_item(Item=item, ConditionExpression="#version = :version",
+                           ExpressionAttributeNames={"#version": "version"},
+                           ExpressionAttributeValues={":version": version})
+
+
+def rebuild_board(ddb_table, board_name):
+    """Repopulate a board from all of its leader items."""
+    entries = []
+    query_args = {
+        "IndexName": "gsi1",
+        "KeyConditionExpression": Key("gsi1pk").eq(board_name),
+        "ProjectionExpression": "pk, gsi1sk, real_name, match_id, games, updated"
+    }
+    while True:
+        response = ddb_table.query(**query_args)
+        for item in response["Items"]:
+            entries.append(make_entry(item))
+        if "LastEvaluatedKey" not in response:
+            break
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    top = heapq.nlargest(board_size, entries, key=lambda entry: entry["value"])
+    replace_board(ddb_table, board_name, top)
+    logger.info(f"Rebuilt {board_name} from {len(entries)} leaders")
+
+
+def clear_boards(ddb_table, board_names):
+    """Empty boards whose leader items are gone, e.g. at a season rollover.
+
+    gsi1 is eventually consistent, a rebuild right after deleting the leader
+    items could bring archived players back.
+    """
+    for board_name in board_names:
+        replace_board(ddb_table, board_name, [])
+    logger.info(f"Cleared {len(board_names)} leaderboards")
+
+
+def replace_board(ddb_table, board_name, top):
+    """Overwrite a board and bump its version so in-flight merges start over."""
+    ddb_table.update_item(
+        Key={"pk": "leaderboard", "sk": board_name},
+        UpdateExpression="SET #data = :data, #size = :size, #updated = :updated ADD #version :one",
+        ExpressionAttributeNames={"#data": "data", "#size": "size", "#updated": "updated", "#version": "version"},
+        ExpressionAttributeValues={":data": json.dumps(top), ":size": board_size, ":updated": datetime.now().isoformat(), ":one": 1})
+
+
+def rebuild_boards(ddb_table, board_names=None):
+    if board_names is None:
+        board_names = get_board_names()
+    for board_name in board_names:
+        rebuild_board(ddb_table, board_name)
+
+
+if __name__ == "__main__":
+    import boto3
+    TABLE_NAME = "rtcwprostats-database-DDBTable2F2A2F95-1BCIOU7IE3DSE"
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+    rebuild_boards(boto3.resource('dynamodb').Table(TABLE_NAME), sys.argv[2:] or None)
@@ -0,0 +1,162 @@
+"""
+Load everything post-processing needs for one match in two batched reads.
+
+The first read gets statsall, wstatsall, both match rounds and both gamelogs.
+Gamelogs that were split in parts take one more read, see data_codec.py in the ddb_access layer.
+The second read gets realname and elo for every player in the match
+(aggstats and aggwstats are counters that summaries add to without reading).
+The result is normalized once and shared by the elo, summary and gamelog
+calculators. It is part of the ddb_access layer, so the fused post-processing
+lambda and the standalone calculator lambdas load a match the same way:
+
+    {
+        "match_id": "1609817356",
+        "match_region_type": "na#6",
+        "stats": {guid: {...}},
+        "wstats": {guid: {weapon: {...}}},
+        "match": {...round 2 gameinfo...},
+        "gamelogs": [...round 1 and round 2 events...],
+        "real_names": {guid: real_name},
+        "player_items": {"elo#na#6": {guid: item}},
+        "items": [...raw match items, for match_document...]
+    }
+"""
+import json
+import logging
+import time as _time
+
+from ddb_access import batch_get_items
+from match_shards import match_pk
+from data_codec import decode_data, fetch_data_parts
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("match_context")
+logger.setLevel(log_level)
+
+player_sk_prefixes = ["elo#"]
+
+
+def make_error_dict(message, item_info):
+    """Make an error message for API gateway."""
+    return {"error": message + " " + item_info}
+
+
+def load_match_context(ddb_table, match_id, log_stream_name, with_gamelogs=True):
+    """Get and normalize all items for a match or return an error dict.
+
+    Calculators that do not look at events pass with_gamelogs=False and get
+    an empty gamelogs list without reading the biggest items of the match.
+    """
+    t1 = _time.time()
+    match_id = str(match_id)
+    item_info = "load_match_context " + match_id + ". Logstream: " + log_stream_name
+
+    match_keys = [
+        {"pk": "statsall", "sk": match_id},
+        {"pk": "wstatsall", "sk": match_id},
+        {"pk": match_pk(match_id), "sk": match_id + "1"},
+        {"pk": match_pk(match_id), "sk": match_id + "2"}
+    ]
+    if with_gamelogs:
+        match_keys.append({"pk": "gamelogs", "sk": match_id + "1"})
+        match_keys.append({"pk": "gamelogs", "sk": match_id + "2"})
+    projection = 'pk, sk, #data_value, data_enc, data_parts, lsipk, gsi1pk'
+    response = get_batch_items(match_keys, ddb_table, projection, log_stream_name)
+    if "error" in response:
+        return response
+    items = response
+    missing_parts = fetch_data_parts(items, lambda keys: get_batch_items(keys, ddb_table, projection, log_stream_name))
+    if len(missing_parts) > 0:
+        return make_error_dict("[x] Failed to retrieve gamelog parts:", item_info)
+    match_items = {item["pk"] + item["sk"]: item for item in items}
+
+    if "statsall" + match_id not in match_items:
+        return make_error_dict("[x] Failed to retrieve statsall:", item_info)
+    if "wstatsall" + match_id not in match_items:
+        return make_error_dict("[x] Failed to retrieve wstatsall:", item_info)
+    if match_pk(match_id) + match_id + "2" not in match_items:
+        return make_error_dict("[x] Failed to retrieve match:", item_info)
+
+    statsall = match_items["statsall" + match_id]
+    match_item = match_items[match_pk(match_id) + match_id + "2"]
+    match_region_type = "#".join(match_item["lsipk"].split("#")[0:2])
+
+    stats = convert_stats_to_dict(decode_data(statsall))
+    wstats = convert_wstats_to_dict(decode_data(match_items["wstatsall" + match_id]))
+
+    gamelogs = []
+    for round_num in ["1", "2"]:
+        gamelog_item = match_items.get("gamelogs" + match_id + round_num)
+        if gamelog_item:
+            gamelogs.extend(decode_data(gamelog_item))
+
+    player_keys = []
+    for guid in stats:
+        player_keys.append({"pk": "player#" + guid, "sk": "realname"})
+        for sk_prefix in player_sk_prefixes:
+            player_keys.append({"pk": "player#" + guid, "sk": sk_prefix + match_region_type})
+    response = get_batch_items(player_keys, ddb_table, 'pk, sk, #data_value, real_name, games, gsi1sk', log_stream_name)
+    if "error" in response:
+        return response
+
+    real_names = {}
+    player_items = {sk_prefix + match_region_type: {} for sk_prefix in player_sk_prefixes}
+    for item in response:
+        guid = item["pk"].split("#")[1]
+        if item["sk"] == "realname":
+            if "data" in item:
+                real_names[guid] = item["data"]
+        elif item["sk"] in player_items:
+            player_items[item["sk"]][guid] = item
+
+    time_to_read = str(round((_time.time() - t1), 3))
+    logger.info(f"Loaded match context for {match_id} with {len(stats)} players and {len(gamelogs)} events in {time_to_read} s")
+
+    return {
+        "match_id": match_id,
+        "match_region_type": match_region_type,
+        "stats": stats,
+        "wstats": wstats,
+        "match": json.loads(match_item["data"]),
+        "gamelogs": gamelogs,
+        "real_names": real_names,
+        "player_items": player_items,
+        "items": items
+    }
+
+
+def convert_stats_to_dict(stats):
+    """Merge statsall list (or 2 team lists) into {guid: stats}."""
+    if len(stats) == 2 and len(stats[0]) > 1:  # stats grouped in teams in a list of 2 teams , each team over 1 player
+        stats_tmp = stats[0].copy()
+        stats_tmp.update(stats[1])
+    else:
+        stats_tmp = {}
+        for player in stats:
+            stats_tmp.update(player)
+    return stats_tmp
+
+
+def convert_wstats_to_dict(wstats):
+    """Convert wstatsall list into {guid: {weapon: wstat}}."""
+    new_wstats = {}
+    for wplayer_wrap in wstats:
+        for wplayer_guid, wplayer in wplayer_wrap.items():
+            new_wplayer = {}
+            for weapon in wplayer:
+                new_wplayer[weapon["weapon"]] = weapon
+            new_wstats[wplayer_guid] = new_wplayer
+    return new_wstats
+
+
+def get_batch_items(item_list, ddb_table, projection, log_stream_name):
+    """Get any number of items, see ddb_access.py."""
+    item_info = "get_batch_items. Logstream: " + log_stream_name
+    try:
+        return batch_get_items(ddb_table.name, item_list, projection, {'#data_value': 'data'})
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.warning(error_msg)
+        return make_error_dict("[x] Client error calling database: ", item_info)
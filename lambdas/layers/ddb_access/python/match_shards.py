@@ -0,0 +1,79 @@
+"""
+Partition keys of match rounds.
+
+Match rounds used to share one partition, pk "match", that every match
+list read from and that capped the match item collection (pk plus the
+lsi) at 10 GB. They are written under one partition per month instead,
+pk "match#YYYYMM", and so is gsi1pk (matches by server).
+
+The month comes from the match id, the unix time the match started, so a
+round is still read by key alone:
+
+    {"pk": match_pk(match_id), "sk": match_id + "2"}
+
+Lists of matches query the shards of the months they cover in parallel
+and merge them by sort key:
+
+    shards = shards_between(sklow, skhigh)
+    items = query_shards(shards, lambda pk: query_one_shard(pk), "sk", limit=100)
+
+Existing items are moved by lambdas/storage/read_match/migrate_match_shards.py.
+"""
+import heapq
+from datetime import datetime, timezone
+
+from ddb_access import run_parallel
+
+legacy_pk = "match"
+shard_prefix = "match#"
+first_month = "202009"  # month of the oldest match in the table, migrate_match_shards.py reports it
+shards_per_wave = 4  # shards queried in parallel before checking if a limit is filled
+
+
+def month_of(timestamp):
+    return datetime.fromtimestamp(int(timestamp), timezone.utc).strftime("%Y%m")
+
+
+def match_pk(match_id):
+    """Partition of the rounds of match_id (the match id without its round number)."""
+    return shard_prefix + month_of(match_id)
+
+
+def is_match_pk(pk):
+    return pk == legacy_pk or pk.startswith(shard_prefix)
+
+
+def shards_between(low, high, ascending=False):
+    """Partitions of the months from unix time low to high, newest first unless ascending."""
+    low_month = max(month_of(low), first_month)
+    year, month = int(month_of(high)[0:4]), int(month_of(high)[4:6])
+    shards = []
+    while "%04d%02d" % (year, month) >= low_month:
+        shards.append(shard_prefix + "%04d%02d" % (year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    if ascending:
+        shards.reverse()
+    return shards
+
+
+def all_shards(ascending=False):
+    """Partitions of every month up to now."""
+    return shards_between(datetime.strptime(first_month, "%Y%m").replace(tzinfo=timezone.utc).timestamp(),
+                          datetime.now(timezone.utc).timestamp(), ascending)
+
+
+def query_shards(shards, query, sort_key, limit=None, ascending=False):
+    """Items of query(pk) for every shard, merged by sort_key.
+
+    query(pk) returns the items of one shard ordered by sort_key, the same
+    way for every shard. shards are in the same order as the result (see
+    shards_between), so once limit items are found the older (or newer)
+    shards left cannot have any that sort before them.
+    """
+    items = []
+    for start in range(0, len(shards), shards_per_wave):
+        results = run_parallel(query, shards[start: start + shards_per_wave])
+        items = list(heapq.merge(items, *results, key=lambda item: item[sort_key], reverse=not ascending))
+        if limit is not None and len(items) >= limit:
+            return items[0:limit]
+    return items
@@ -0,0 +1,136 @@
+"""
+Warm container cache for reference items that rarely change.
+
+Part of the ddb_access layer. Caches live in module memory, so every
+invocation served by the same container shares them:
+
+    servers     server item by server name      5 min
+    real_names  real name by guid               10 min
+    skoal       players hidden from ladders     1 min
+    seasons     season list by region#type      1 h
+
+Items that do not exist are cached too (negative caching), for a shorter
+time. Each cache keeps at most max_size keys and drops the least recently
+used one first.
+
+A lambda that writes one of these items puts it in its own cache, see
+read_match.cache_new_items. Every other container, and every edit made by
+hand (real names, skoal), is picked up when the TTL runs out.
+
+    server_cache = ref_cache.get_cache("servers")
+    server = server_cache.get(server_name, lambda name: ddb_get_server(name, table))
+"""
+import logging
+import threading
+import time as _time
+from collections import OrderedDict
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("ref_cache")
+logger.setLevel(log_level)
+
+# name: (ttl, max_size, negative_ttl) in seconds and keys
+cache_settings = {
+    "servers": (300, 2000, 60),
+    "real_names": (600, 20000, 60),
+    "skoal": (60, 1, 60),
+    "seasons": (3600, 100, 300)
+}
+
+_missing = object()  # cached marker of an item that does not exist
+
+
+class TtlCache:
+    """Values by key that expire after ttl seconds, least recently used dropped first."""
+
+    def __init__(self, name, ttl, max_size, negative_ttl):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key: (expires, value)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        """Cached value, None for a cached missing item, _missing when unknown or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < _time.time():
+                self.misses += 1
+                return _missing
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return None if entry[1] is _missing else entry[1]
+
+    def put(self, key, value):
+        """Cache value, None caches key as a missing item."""
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self.lock:
+            self.entries[key] = (_time.time() + ttl, _missing if value is None else value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get(self, key, load):
+        """Cached value of key, or load(key) when there is none. load raising caches nothing."""
+        value = self.lookup(key)
+        if value is not _missing:
+            return value
+        value = load(key)
+        self.put(key, value)
+        return value
+
+    def get_many(self, keys, load_many):
+        """Values of keys that exist. Keys not cached are loaded with one load_many(keys) call returning {key: value}."""
+        found, missing = self.split(keys)
+        if len(missing) > 0:
+            loaded = load_many(missing)
+            self.put_many(missing, loaded)
+            found.update(loaded)
+        return found
+
+    def split(self, keys):
+        """Cached values of keys that exist and the keys that need loading."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.lookup(key)
+            if value is _missing:
+                missing.append(key)
+            elif value is not None:
+                found[key] = value
+        return found, missing
+
+    def put_many(self, keys, loaded):
+        """Cache what was loaded for keys, keys that are not in loaded as missing items."""
+        for key in keys:
+            self.put(key, loaded.get(key))
+
+    def invalidate(self, key=None):
+        """Drop key, or everything."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    """The process wide cache called name, see cache_settings."""
+    with _caches_lock:
+        if name not in caches:
+            ttl, max_size, negative_ttl = cache_settings[name]
+            caches[name] = TtlCache(name, ttl, max_size, negative_ttl)
+        return caches[name]
+
+
+def log_stats():
+    for name, cache in caches.items():
+        logger.info(f"{name} cache: {cache.hits} hits, {cache.misses} misses, {len(cache.entries)} keys")
@@ -9,6 +9,7 @@ import os
 import time
 from datetime import datetime, timedelta
 from notify_discord import post_custom_bus_event
+from match_shards import shards_between
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
@@ -64,19 +65,18 @@ def handler(event, context):
     return "Finished without critical errors"
 
 def get_range(sklow, skhigh, ddb_table):
-    """Get several items by pk and range of sk."""
+    """Get several items by pk and range of sk from the match shards of the range."""
     item_info = "match" + ":" + sklow + " to " + skhigh
+    result = []
     try:
         logger.info("Looking for " + item_info)
-        response = ddb_table.query(IndexName='lsi', KeyConditionExpression=Key('pk').eq("match") & Key('lsipk').between(sklow, skhigh), ProjectionExpression="lsipk")
+        for pk in shards_between(sklow.split("#")[-1], skhigh.split("#")[-1]):
+            response = ddb_table.query(IndexName='lsi', KeyConditionExpression=Key('pk').eq(pk) & Key('lsipk').between(sklow, skhigh), ProjectionExpression="lsipk")
+            result.extend(response['Items'])
     except ClientError as e:
         logger.warning("Exception occurred: " + e.response['Error']['Message'])
-    else:
-        if response['Count'] > 0:
-            result = response['Items']
-        else:
-            logger.warning("Request returned no results")
-            result = {}
+    if len(result) == 0:
+        logger.warning("Request returned no results")
     return result
 
 def ddb_prepare_group_item(region_match_type, matches, submitter_ip):
@@ -8,9 +8,10 @@ import logging
 import os
 import sys
 import traceback
-import time as _time
 import datetime
 from notify_discord import post_custom_bus_event
+from ddb_access import batch_write_items
+from leaderboards import clear_boards
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
@@ -27,8 +28,8 @@ else:
 
 dynamodb = boto3.resource('dynamodb')
 ddb_table = dynamodb.Table(TABLE_NAME)
-ddb_client = boto3.client('dynamodb')
 event_client = boto3.client('events')
+season_categories = ["acc", "kdr", "HS Ratio", "Caps per Game", "Caps per Taken"]
 
 
 def handler(event, context):
@@ -83,6 +84,9 @@ def process_new_season(region_match_type):
         logger.info("Deleted residual metrics successfully.")
         delete_ddb_items(delete_items2)
 
+    logger.info("Clearing leaderboards of the passing season.")
+    clear_season_boards(region_match_type)
+
     create_old_season_record(ddb_table, region_match_type, old_season, new_seq, player_metrics)
     logger.info("Saved the current season successfully.")
 
@@ -160,8 +164,7 @@ def delete_current_metrics_items(player_metrics):
 
 def get_current_metrics(region_match_type):
     player_metrics = []
-    categories = ["acc", "kdr", "HS Ratio", "Caps per Game", "Caps per Taken"]
-    for category in categories:
+    for category in season_categories:
         leaders_category = get_leaders(category, region_match_type)
         player_metrics.extend(leaders_category)
 
@@ -169,17 +172,31 @@ def get_current_metrics(region_match_type):
     return player_metrics
 
 
-def get_leaders(category, region_match_type):
-
+def get_leaders_pk(category, region_match_type):
     pound_goes_here = "#"
     if category.lower() in ["kdr", "acc"]:
         pound_goes_here = ""
-    pk = "leader" + pound_goes_here + category + "#" + region_match_type
+    return "leader" + pound_goes_here + category + "#" + region_match_type
+
 
+def get_leaders(category, region_match_type):
+    pk = get_leaders_pk(category, region_match_type)
     response = ddb_table.query(IndexName='gsi1', KeyConditionExpression=Key('gsi1pk').eq(pk))
     return response["Items"]
 
 
+def clear_season_boards(region_match_type):
+    """Leaderboards of the archived categories would keep serving the passing season."""
+    board_names = [get_leaders_pk(category, region_match_type) for category in season_categories]
+    try:
+        clear_boards(ddb_table, board_names)
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        message = "Failed to clear leaderboards. Rebuild them with leaderboards.py rebuild. Error " + error_msg
+        logger.error(message)
+
+
 def delete_ddb_items(delete_items):
     try:
         with ddb_table.batch_writer() as batch:
@@ -208,7 +225,7 @@ def copy_current_metrics(player_metrics, old_season, region_match_type):
             del new_item["gsi2sk"]
         new_player_metrics.append(new_item)
     try:
-        ddb_batch_write(ddb_client, ddb_table.name, new_player_metrics)
+        batch_write_items(ddb_table.name, new_player_metrics)
     except Exception as ex:
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
         error_msg = template.format(type(ex).__name__, ex.args)
@@ -236,79 +253,6 @@ def announce_new_season(old_season_name, region_match_type):
     return events
 
 
-def create_batch_write_structure(table_name, items, start_num, batch_size):
-    """
-    Create item structure for passing to batch_write_item
-    :param table_name: DynamoDB table name
-    :param items: large collection of items
-    :param start_num: Start index
-    :param batch_size: Number of items
-    :return: dictionary of tables to write to
-    """
-
-    serializer = boto3.dynamodb.types.TypeSerializer()
-    item_batch = {table_name: []}
-    item_batch_list = items[start_num: start_num + batch_size]
-    if len(item_batch_list) < 1:
-        return None
-    for item in item_batch_list:
-        item_serialized = {k: serializer.serialize(v) for k, v in item.items()}
-        item_batch[table_name].append({'PutRequest': {'Item': item_serialized}})
-
-    return item_batch
-
-
-def ddb_batch_write(client, table_name, items):
-    messages = ""
-    num_items = len(items)
-    logger.info(f'Performing ddb_batch_write to dynamo with {num_items} items.')
-    start = 0
-    batch_size = 25
-    while True:
-        # Loop adding 25 items to dynamo at a time
-        request_items = create_batch_write_structure(table_name, items, start, batch_size)
-        if not request_items:
-            break
-        try:
-            response = client.batch_write_item(RequestItems=request_items)
-        except ClientError as err:
-            logger.error(err.response['Error']['Message'])
-            logger.error("Failed to run full batch_write_item")
-            raise
-        if len(response['UnprocessedItems']) == 0:
-            logger.info(f'Wrote a batch of about {batch_size} items to dynamo')
-        else:
-            # Hit the provisioned write limit
-            logger.warning('Hit write limit, backing off then retrying')
-            sleep_time = 5  # seconds
-            logger.warning(f"Sleeping for {sleep_time} seconds")
-            _time.sleep(sleep_time)
-
-            # Items left over that haven't been inserted
-            unprocessed_items = response['UnprocessedItems']
-            logger.warning('Resubmitting items')
-            # Loop until unprocessed items are written
-            while len(unprocessed_items) > 0:
-                response = client.batch_write_item(RequestItems=unprocessed_items)
-                # If any items are still left over, add them to the
-                # list to be written
-                unprocessed_items = response['UnprocessedItems']
-
-                # If there are items left over, we could do with
-                # sleeping some more
-                if len(unprocessed_items) > 0:
-                    sleep_time = 5  # seconds
-                    logger.warning(f"Sleeping for {sleep_time} seconds")
-                    _time.sleep(sleep_time)
-
-            # Inserted all the unprocessed items, exit loop
-            logger.warning('Unprocessed items successfully inserted')
-            break
-        if response["ResponseMetadata"]['HTTPStatusCode'] != 200:
-            messages += f"\nBatch {start} returned non 200 code"
-        start += 25
-
-
 def ddb_get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, limit, ascending):
     """Get several items by pk and range of sk."""
     try:
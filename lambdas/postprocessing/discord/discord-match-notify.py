@@ -4,6 +4,7 @@ import json
 import os
 import urllib3
 from boto3.dynamodb.conditions import Key
+from match_shards import match_pk
 
 # for local testing use actual table
 # for lambda execution runtime use dynamic reference
@@ -57,7 +58,7 @@ def get_skoal():
 def notify_discord(match_id, round_id):
     """Process logic."""
     try:
-        response_match = ddb_table.get_item(Key={'pk': "match", 'sk': match_id + round_id})
+        response_match = ddb_table.get_item(Key={'pk': match_pk(match_id), 'sk': match_id + round_id})
 
         if round_id == "2":
             players = get_elo_progress_info(match_id)
@@ -52,20 +52,20 @@ if __name__ == "__main__":
         if write_once:
 
             from boto3.dynamodb.conditions import Attr, Key
+            from match_shards import shards_between, query_shards
 
-            matches_response1 = ddb_table.query(
-                KeyConditionExpression=Key('pk').eq("match") & Key("sk").between("16709628642", "16752168362"),
-                ProjectionExpression="pk,sk",
-                ScanIndexForward=True)
-
-            matches_response2 = ddb_table.query(
-                KeyConditionExpression=Key('pk').eq("match") & Key("sk").between("16745511142", "16752168362"),
-                ProjectionExpression="pk,sk",
-                ScanIndexForward=True)
+            def query_matches(sklow, skhigh):
+                def query_shard(pk):
+                    return ddb_table.query(
+                        KeyConditionExpression=Key('pk').eq(pk) & Key("sk").between(sklow, skhigh),
+                        ProjectionExpression="pk,sk",
+                        ScanIndexForward=True)["Items"]
+                shards = shards_between(sklow[0:-1], skhigh[0:-1], ascending=True)
+                return query_shards(shards, query_shard, "sk", ascending=True)
 
             matches_responses = []
-            matches_responses.extend(matches_response1["Items"])
-            matches_responses.extend(matches_response2["Items"])
+            matches_responses.extend(query_matches("16709628642", "16752168362"))
+            matches_responses.extend(query_matches("16745511142", "16752168362"))
 
             match_array = []
             for match_item in matches_responses:
@@ -0,0 +1,265 @@
+"""
+Backtest EloParms and KReduction settings against real match outcomes.
+
+The match history is parsed once into compact numpy arrays (player codes,
+scores, teams, match offsets) and handed to a process pool. Every worker
+replays the whole history through elo_calc.process_elos for one parameter
+set at a time. Before each match the team win probability is predicted from
+the current ratings, and the parameter set is scored on decisive matches by
+log-loss, Brier score and plain accuracy. The ranked report is printed and
+optionally saved as json.
+
+Local example:
+    python elo_backtest.py --directory ../../../test/gamestats4 --match-type unk#6
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time as _time
+
+import boto3
+import numpy as np
+
+from elo_calc import (
+    EloParms,
+    KReduction,
+    Player,
+    process_elos,
+    calculate_player_scores,
+    get_winner_duration
+)
+from elo_replay import DirectoryMatchSource, DdbMatchSource
+from match_context import convert_wstats_to_dict
+import ddb_access
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("elo_backtest")
+logger.setLevel(log_level)
+
+logging.getLogger("elo_calc").setLevel(logging.ERROR)
+
+TEAM_CODES = {"Axis": 1, "Allied": 2}
+OUTCOME_DRAW = 0
+
+# Current production values are part of the default grid so the report shows where they rank
+DEFAULT_GRID = {
+    "global_K": [100, 150, 200, 250],
+    "floor": [1000, 1200],
+    "logdistancefactor": [math.log(10) / 300, math.log(10) / 400, math.log(10) / 600],
+    "kreduction": [
+        [900, 75, 0.5, 3, 20, 0.2],
+        [900, 75, 0.5, 3, 20, 0.3],
+        [900, 75, 0.5, 5, 40, 0.2]
+    ]
+}
+
+
+class BacktestCorpus:
+    """Match history flattened into arrays; match m owns rows offsets[m]:offsets[m + 1]."""
+
+    def __init__(self, guids, match_ids, offsets, players, scores, teams, durations, outcomes):
+        self.guids = guids
+        self.match_ids = match_ids
+        self.offsets = offsets
+        self.players = players
+        self.scores = scores
+        self.teams = teams
+        self.durations = durations
+        self.outcomes = outcomes
+
+    def __len__(self):
+        return len(self.match_ids)
+
+    @classmethod
+    def from_records(cls, records):
+        """Parse match records (see elo_replay sources) once."""
+        guid_codes = {}
+        match_ids = []
+        offsets = [0]
+        players = []
+        scores = []
+        teams = []
+        durations = []
+        outcomes = []
+        for record in records:
+            stats = record["stats"]
+            winner, duration = get_winner_duration(record["match"])
+            # games only matter to KReduction, the score itself does not depend on them
+            player_scores = calculate_player_scores(stats, convert_wstats_to_dict(record["wstats"]), winner, duration, {})
+            for guid, player_score in player_scores.items():
+                players.append(guid_codes.setdefault(guid, len(guid_codes)))
+                scores.append(player_score.score)
+                teams.append(TEAM_CODES.get(stats[guid].get("team"), 0))
+            match_ids.append(record["match_id"])
+            offsets.append(len(players))
+            durations.append(duration)
+            outcomes.append(TEAM_CODES.get(winner, OUTCOME_DRAW))
+
+        guids = [None] * len(guid_codes)
+        for guid, code in guid_codes.items():
+            guids[code] = guid
+
+        return cls(guids, match_ids,
+                   np.array(offsets, dtype=np.int64),
+                   np.array(players, dtype=np.int32),
+                   np.array(scores, dtype=np.int32),
+                   np.array(teams, dtype=np.int8),
+                   np.array(durations, dtype=np.int32),
+                   np.array(outcomes, dtype=np.int8))
+
+
+def make_parameter_sets(grid):
+    """Cartesian product of the grid values."""
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+
+def backtest(corpus, parameter_set, warmup=0):
+    """Replay the corpus with one parameter set and score its predictions."""
+    ep = EloParms(global_K=parameter_set.get("global_K", 200),
+                  floor=parameter_set.get("floor", 1200),
+                  logdistancefactor=parameter_set.get("logdistancefactor", math.log(10) / float(400)))
+    kreduction = KReduction(*parameter_set.get("kreduction", [900, 75, 0.5, 3, 20, 0.2]))
+
+    elos = {}
+    games = {}
+    log_loss = brier = 0.0
+    correct = predicted = 0
+    epsilon = 1e-15
+
+    offsets = corpus.offsets.tolist()
+    players = corpus.players.tolist()
+    scores = corpus.scores.tolist()
+    teams = corpus.teams.tolist()
+    durations = corpus.durations.tolist()
+    outcomes = corpus.outcomes.tolist()
+
+    for m in range(len(corpus)):
+        lo, hi = offsets[m], offsets[m + 1]
+        if hi - lo == 0:
+            continue
+        match_players = players[lo:hi]
+        match_teams = teams[lo:hi]
+
+        outcome = outcomes[m]
+        if outcome != OUTCOME_DRAW and m >= warmup:
+            axis = [elos.get(p, ep.initial) for p, t in zip(match_players, match_teams) if t == 1]
+            allied = [elos.get(p, ep.initial) for p, t in zip(match_players, match_teams) if t == 2]
+            if len(axis) > 0 and len(allied) > 0:
+                elodiff = (sum(axis) / len(axis) - sum(allied) / len(allied)) * ep.logdistancefactor
+                elodiff = min(ep.maxlogdistance, max(-ep.maxlogdistance, elodiff))
+                p_axis = min(1 - epsilon, max(epsilon, 1 / (1 + math.exp(-elodiff))))
+                y = 1 if outcome == TEAM_CODES["Axis"] else 0
+                log_loss -= y * math.log(p_axis) + (1 - y) * math.log(1 - p_axis)
+                brier += (p_axis - y) ** 2
+                correct += 1 if (p_axis > 0.5) == (y == 1) else 0
+                predicted += 1
+
+        player_scores = {}
+        for p, score in zip(match_players, scores[lo:hi]):
+            player_scores[p] = Player(score, durations[m], games.get(p, 0))
+        elo_dict = {p: elos[p] for p in match_players if p in elos}
+        (elo_deltas, new_elos) = process_elos(player_scores, elo_dict, ep, kreduction)
+        for p, elo in new_elos.items():
+            elos[p] = elo.elo
+            games[p] = elo.games
+
+    result = dict(parameter_set)
+    result["matches_scored"] = predicted
+    result["log_loss"] = log_loss / predicted if predicted else None
+    result["brier"] = brier / predicted if predicted else None
+    result["accuracy"] = correct / predicted if predicted else None
+    return result
+
+
+_corpus = None
+_warmup = 0
+
+
+def _init_worker(corpus, warmup):
+    """Runs once per worker process, the corpus is not re-sent per parameter set."""
+    global _corpus, _warmup
+    _corpus = corpus
+    _warmup = warmup
+
+
+def _backtest_worker(parameter_set):
+    return backtest(_corpus, parameter_set, _warmup)
+
+
+def run_grid(corpus, parameter_sets, processes=None, warmup=0):
+    """Fan parameter sets over a process pool and rank them, best first."""
+    t1 = _time.time()
+    processes = processes or os.cpu_count()
+    logger.info(f"Backtesting {len(parameter_sets)} parameter sets over {len(corpus)} matches with {processes} processes")
+    if processes == 1:
+        results = [backtest(corpus, parameter_set, warmup) for parameter_set in parameter_sets]
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(corpus, warmup)) as pool:
+            results = pool.map(_backtest_worker, parameter_sets, chunksize=max(1, len(parameter_sets) // (processes * 4)))
+    results.sort(key=lambda result: (result["log_loss"] is None, result["log_loss"] or 0, result["brier"] or 0))
+    time_to_process = str(round((_time.time() - t1), 3))
+    logger.info(f"Backtest finished in {time_to_process} s")
+    return results
+
+
+def format_report(results, top=20):
+    lines = ["rank  log_loss  brier   acc    global_K floor  logdist   kreduction"]
+    for rank, result in enumerate(results[0:top], start=1):
+        if result["log_loss"] is None:
+            lines.append(str(rank).ljust(6) + "not enough decisive matches")
+            continue
+        lines.append(str(rank).ljust(6) +
+                     f"{result['log_loss']:.4f}".ljust(10) +
+                     f"{result['brier']:.4f}".ljust(8) +
+                     f"{result['accuracy']:.3f}".ljust(7) +
+                     str(result.get("global_K")).ljust(9) +
+                     str(result.get("floor")).ljust(7) +
+                     f"{result.get('logdistancefactor', 0):.6f}".ljust(10) +
+                     str(result.get("kreduction")))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest ELO parameters for a region#type.")
+    parser.add_argument("--match-type", required=True, help="region#type, ex. na#6")
+    parser.add_argument("--directory", help="directory with raw intake json files")
+    parser.add_argument("--server-regions", help="json file with {server name: region} for directory replays")
+    parser.add_argument("--table", help="DynamoDB table name to read matches from")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, ex. http://localhost:8000 for DynamoDB Local")
+    parser.add_argument("--grid", help="json file with lists of values per parameter, see DEFAULT_GRID")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--warmup", type=int, default=0, help="matches to replay before scoring predictions")
+    parser.add_argument("--report", help="save the full ranked report to this json file")
+    args = parser.parse_args()
+
+    if args.directory:
+        server_regions = {}
+        if args.server_regions:
+            with open(args.server_regions) as file:
+                server_regions = json.load(file)
+        source = DirectoryMatchSource(args.directory, args.match_type, server_regions)
+    else:
+        if args.endpoint_url:
+            ddb_access.set_client(boto3.client('dynamodb', endpoint_url=args.endpoint_url))
+        dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+        source = DdbMatchSource(dynamodb.Table(args.table), args.match_type)
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid) as file:
+            grid = json.load(file)
+
+    corpus = BacktestCorpus.from_records(source.matches())
+    results = run_grid(corpus, make_parameter_sets(grid), args.processes, args.warmup)
+    print(format_report(results))
+
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(results, file, indent=1)
+        logger.info("Saved report to " + args.report)
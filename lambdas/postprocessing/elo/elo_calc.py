@@ -7,18 +7,24 @@ ELO algorithm to calculate player ranks
 from datetime import datetime
 import logging
 import math
-from botocore.exceptions import ClientError
-from botocore.exceptions import ClientError
-import json
-import boto3
 from collections import namedtuple
 import time as _time
 
+from ddb_access import batch_write_items
+from leaderboards import update_boards
+from match_context import load_match_context
+try:
+    import numpy as np
+except ImportError:  # numpy is not bundled with every deployment of this lambda
+    np = None
+
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger("elo_calc")
 logger.setLevel(log_level)
 debug = False  # very local debug
+vectorized = np is not None  # set to False to use the reference pairwise loop
+vectorized_min_players = 12  # below this numpy overhead is bigger than the loop itself
 
 class PlayerElo(object):
     def __init__(self, player_id=None, game_type_cd=None, elo=None):
@@ -92,117 +98,41 @@ KREDUCTION = KReduction(900, 75, 0.5, 3, 20, 0.2)
 # only global_K may be touched even if the DB already exists
 # we start at K=200, and fall to K=40 over the first 20 games
 ELOPARMS = EloParms(global_K=200)
+
+Player = namedtuple('Player', 'score duration games')
   
-def process_rtcwpro_elo(ddb_table, ddb_client, match_id, log_stream_name):
-    "RTCWPro pipeline specific logic."
+def process_rtcwpro_elo(ddb_table, ddb_client, match_id, log_stream_name, match_context=None):
+    """RTCWPro pipeline specific logic.
+
+    match_context is the shared match_context.load_match_context result when
+    running in the fused post-processing lambda, otherwise items are fetched here.
+    """
     t1 = _time.time()
-    sk = match_id
-    
-    response = get_item("statsall", sk, ddb_table, log_stream_name)
-    if "error" not in response:
-        stats = json.loads(response["data"])
-        logger.info("Retrieved statsall for " + str(len(stats)) + " players")
-        stats = convert_stats_to_dict(stats)
-    else:
-        message = "Failed to retrieve statsall."
-        logger.error(message)
-        return message
-        logger.error(json.dumps(response))
-    
-    response = get_item("wstatsall", sk, ddb_table, log_stream_name)
-    if "error" not in response:
-        wstats = json.loads(response["data"])
-        logger.info("Retrieved wstatsall for " + str(len(wstats)) + " players")
-    else:
-        message = "Failed to retrieve wstatsall."
-        logger.error(message)
-        return message
-        logger.error(json.dumps(response))
-
-    response = get_item("match", sk + "2", ddb_table, log_stream_name)  # round 2
-    if "error" not in response:
-        match = json.loads(response["data"])
-        match_region = response["lsipk"].split("#")[0]
-        match_type = response["lsipk"].split("#")[1]
-        match_region_type = match_region + "#" + match_type
-        try:
-            time_split = match["time_limit"].split(":")
-            duration = int(time_split[0]) * 60 + int(time_split[1])
-        except Exception:
-            duration = 600
-        if match["winner"].strip() == "":
-            if duration in [480, 600, 720]:
-                winner = "Draw"
-            else:
-                logger.warning("Elo is calculating without a winner.")
-                winner = "Draw"
-        elif duration in [480, 600, 720]:
-            logger.warning("Elo is calculating on assumption of a draw.")
-            winner = "Draw"
-        else:
-            winner = match["winner"]
-    else:
-        message = "Failed to retrieve match."
-        logger.error(message)
-        return message
-        logger.error(json.dumps(response))
-        
-    real_name_request_list = prepare_player_name_list(stats)
-    response = get_batch_items(real_name_request_list, ddb_table, log_stream_name)
-    real_names = {}
-    if "error" not in response:
-        for result in response:
-            guid = result["pk"].split("#")[1]
-            if "data" in result:
-                real_names[guid] = result["data"]
-                logger.debug("Retrieved " + guid + " name: " + result["data"])
-
-       
-    elo_item_list = prepare_player_elo_list(stats, match_region_type)
-    response = get_batch_items(elo_item_list, ddb_table, log_stream_name)
+
+    standalone = match_context is None
+    if standalone:
+        match_context = load_match_context(ddb_table, match_id, log_stream_name, with_gamelogs=False)
+        if "error" in match_context:
+            message = match_context["error"]
+            logger.error(message)
+            return message
+
+    stats = match_context["stats"]
+    match_region_type = match_context["match_region_type"]
+    real_names = match_context["real_names"]
+    winner, duration = get_winner_duration(match_context["match"])
 
     elo_dict = {}
     elo_games = {}
-    if "error" not in response:
-        for result in response:
-            guid = result["pk"].split("#")[1]
-            if match_region_type in result["sk"]:
-                new_elo = int(result["data"])
-                if new_elo < 500:  # old elo calc
-                    new_elo = new_elo * 4.453  # new elo increase
-                elo_dict[guid] = new_elo
-                elo_games[guid] = int(result["games"]) 
-                logger.debug("Retrieved " + match_region_type + "#elo" + " " + " " + real_names.get(guid,"no_name").ljust(20) + " elo:" + str(elo_dict[guid]) + " games " + str(elo_games[guid]))
+    for guid, result in match_context["player_items"].get("elo#" + match_region_type, {}).items():
+        new_elo = int(result["data"])
+        if new_elo < 500:  # old elo calc
+            new_elo = new_elo * 4.453  # new elo increase
+        elo_dict[guid] = new_elo
+        elo_games[guid] = int(result["games"])
+        logger.debug("Retrieved " + match_region_type + "#elo" + " " + " " + real_names.get(guid,"no_name").ljust(20) + " elo:" + str(elo_dict[guid]) + " games " + str(elo_games[guid]))
 
-    else:
-        logger.error("Failed to retrieve any player elos.")
-        logger.error(json.dumps(response))
-    
-    Player = namedtuple('Player', 'score duration games')
-   
-    new_wstats = {}
-    for wplayer_wrap in wstats:
-        for wplayer_guid, wplayer in wplayer_wrap.items():
-            new_wplayer = {}
-            for weapon in wplayer:
-                new_wplayer[weapon["weapon"]] = weapon
-            new_wstats[wplayer_guid] = new_wplayer
-    
-    player_scores = {}
-    for guid, player_stats in stats.items():
-        score_step_1 = player_stats["categories"].get("kills", 0)
-        score_step_2 = score_step_1 \
-            - wstat(new_wstats, guid, "Panzer", "kills") * .20 \
-            - wstat(new_wstats, guid, "Artillery", "kills") * .10 \
-            - wstat(new_wstats, guid, "Airstrike", "kills") * .10 \
-            - wstat(new_wstats, guid, "Mauser", "kills") * .30
-        
-        win_multiplier = 1.25 if player_stats["team"] == winner else 1
-        score_step_3 = int(score_step_2 * win_multiplier)
-        
-        player_scores[guid] = Player(score_step_3, duration, elo_games.get(guid,0)) # if elo is not there, default will be 0 anyway
-        if debug:
-            logger.info(player_stats.get("alias", "missing_alias").ljust(20) + str(player_stats["categories"].get("kills", 0)).ljust(5) + str(win_multiplier).ljust(5) + str(score_step_3).ljust(5) + str(player_scores[guid].games).ljust(5))
+    player_scores = calculate_player_scores(stats, match_context["wstats"], winner, duration, elo_games)
 
     (elo_deltas, elos) = process_elos(player_scores, elo_dict)
     
@@ -214,7 +144,7 @@ def process_rtcwpro_elo(ddb_table, ddb_client, match_id, log_stream_name):
     
     if len(items) > 0:
         try:
-            ddb_batch_write(ddb_client, ddb_table.name, items)
+            batch_write_items(ddb_table.name, items)
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
@@ -223,6 +153,10 @@ def process_rtcwpro_elo(ddb_table, ddb_client, match_id, log_stream_name):
             return message
         else:
             message = "Elo progress records inserted.\n"
+            # leaderboards are merged once all calculators are done with the match
+            match_context.setdefault("leader_items", []).extend(player_elo_items)
+            if standalone:
+                update_boards(ddb_table, player_elo_items)
     else:
         message = "There are no ELOs to update"
         logger.warning(message)
@@ -232,20 +166,47 @@ def process_rtcwpro_elo(ddb_table, ddb_client, match_id, log_stream_name):
     return message
  
 
-def convert_stats_to_dict(stats):
-    if len(stats) == 2 and len(stats[0]) > 1: #stats grouped in teams in a list of 2 teams , each team over 1 player
-        logger.info("Number of stats entries 2, trying to merge teams")
-        stats_tmp = stats[0].copy()
-        stats_tmp.update(stats[1])
+def get_winner_duration(match):
+    """Figure out the winner and round duration the way ELO sees them."""
+    try:
+        time_split = match["time_limit"].split(":")
+        duration = int(time_split[0]) * 60 + int(time_split[1])
+    except Exception:
+        duration = 600
+    if match["winner"].strip() == "":
+        if duration in [480, 600, 720]:
+            winner = "Draw"
+        else:
+            logger.warning("Elo is calculating without a winner.")
+            winner = "Draw"
+    elif duration in [480, 600, 720]:
+        logger.warning("Elo is calculating on assumption of a draw.")
+        winner = "Draw"
     else:
-        logger.info("Merging list into dict.")
-        stats_tmp = {}
-        for player in stats:
-            stats_tmp.update(player)
-    logger.info("New statsall has " + str(len(stats_tmp)) + " players in a " + str(type(stats_tmp)))
-    return stats_tmp
+        winner = match["winner"]
+    return winner, duration
+
 
+def calculate_player_scores(stats, new_wstats, winner, duration, elo_games):
+    """Make performance scores that process_elos compares between players."""
+    player_scores = {}
+    for guid, player_stats in stats.items():
+        score_step_1 = player_stats["categories"].get("kills", 0)
+        score_step_2 = score_step_1 \
+            - wstat(new_wstats, guid, "Panzer", "kills") * .20 \
+            - wstat(new_wstats, guid, "Artillery", "kills") * .10 \
+            - wstat(new_wstats, guid, "Airstrike", "kills") * .10 \
+            - wstat(new_wstats, guid, "Mauser", "kills") * .30
         
+        win_multiplier = 1.25 if player_stats["team"] == winner else 1
+        score_step_3 = int(score_step_2 * win_multiplier)
+        
+        player_scores[guid] = Player(score_step_3, duration, elo_games.get(guid,0)) # if elo is not there, default will be 0 anyway
+        if debug:
+            logger.info(player_stats.get("alias", "missing_alias").ljust(20) + str(player_stats["categories"].get("kills", 0)).ljust(5) + str(win_multiplier).ljust(5) + str(score_step_3).ljust(5) + str(player_scores[guid].games).ljust(5))
+    return player_scores
+
+
 def wstat(new_wstats, guid, weapon, metric):
     """Safely get a number from a deeply nested dict."""
     if guid not in new_wstats:
@@ -259,8 +220,10 @@ def wstat(new_wstats, guid, weapon, metric):
     return value
     
 
-def process_elos(player_scores, elo_dict):
+def process_elos(player_scores, elo_dict, ep=None, kreduction=None):
     """Given the players perforance and previous record, calculate new ELOs."""
+    ep = ep or ELOPARMS
+    kreduction = kreduction or KREDUCTION
     duration = player_scores[list(player_scores.keys())[0]].duration
     
     scores = {}
@@ -284,21 +247,25 @@ def process_elos(player_scores, elo_dict):
     # ensure that all player_ids have an elo record
     for pid in player_ids:
         if pid not in elos.keys():
-            elos[pid] = PlayerElo(pid, None, ELOPARMS.initial)
+            elos[pid] = PlayerElo(pid, None, ep.initial)
 
     for pid in list(player_ids):
-        elos[pid].k = KREDUCTION.eval(games[pid], alivetimes[pid], duration)
+        elos[pid].k = kreduction.eval(games[pid], alivetimes[pid], duration)
         if elos[pid].k == 0:
             del(elos[pid])
             del(scores[pid])
             del(alivetimes[pid])
     
-    elos = update_elos(elos, scores, ELOPARMS)
+    if vectorized and len(elos) >= vectorized_min_players:
+        elos = update_elos_vectorized(elos, scores, ep)
+    else:
+        elos = update_elos(elos, scores, ep)
 
     return elos
 
 
 def update_elos(elos, scores, ep):
+    """Reference implementation: walk every pair of players."""
     if len(elos) < 2:
         return ({}, elos)
 
@@ -398,129 +365,69 @@ def update_elos(elos, scores, ep):
     return (elo_deltas, elos)
 
 
-def make_error_dict(message, item_info):
-    """Make an error message for API gateway."""
-    return {"error": message + " " + item_info}
+def update_elos_vectorized(elos, scores, ep):
+    """
+    Same math as update_elos, but on broadcast n x n matrices.
 
+    Row i, column j holds the values update_elos computes for the pair
+    (pids[i], pids[j]). Only the upper triangle (i < j) is used so the
+    tie-breaking at scorefactor_elo == 0.5 matches the loop exactly.
+    """
+    if len(elos) < 2:
+        return ({}, elos)
 
-def get_item(pk, sk, table, log_stream_name):
-    """Get one dynamodb item."""
-    item_info = pk + ":" + sk + ". Logstream: " + log_stream_name
-    try:
-        response = table.get_item(Key={'pk': pk, 'sk': sk})
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if "Item" in response:
-            result = response['Item']
-        else:
-            result = make_error_dict("[x] Item does not exist: ", item_info)
-    return result
+    pids = list(elos.keys())
+    n = len(pids)
 
+    player_scores = np.array([scores[elos[pid].player_id] for pid in pids], dtype=float)
+    player_elos = np.array([float(elos[pid].elo) for pid in pids], dtype=float)
+    player_ks = np.array([elos[pid].k for pid in pids], dtype=float)
 
-def prepare_player_elo_list(stats, match_region_type):
-    """Make a list of guids to retrieve from ddb."""
-    item_list = []
-    for guid, player_stats in stats.items():
-        item_list.append({"pk": "player#"+guid, "sk": "elo#" + match_region_type})
-    return item_list
+    si = player_scores[:, None]
+    sj = player_scores[None, :]
 
-def prepare_player_name_list(stats):
-    """Make a list of guids to retrieve from ddb."""
-    item_list = []
-    for guid, player_stats in stats.items():
-        item_list.append({"pk": "player#"+guid, "sk": "realname"})
-    return item_list
+    # normalize scores
+    ofs = np.minimum(np.minimum(si, sj), 0)
+    si = si - ofs
+    sj = sj - ofs
+    draws = (si + sj) == 0
+    si = np.where(draws, 1.0, si)
+    sj = np.where(draws, 1.0, sj)
 
+    # real score factor
+    scorefactor_real = si / (si + sj)
 
-def get_batch_items(item_list, ddb_table, log_stream_name):
-    """Get items in a batch."""
-    dynamodb = boto3.resource('dynamodb')
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={ddb_table.name: {'Keys': item_list, 'ProjectionExpression': 'pk, sk, #data_value, real_name, games', 'ExpressionAttributeNames': {'#data_value': 'data'}}})
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            result = make_error_dict("[x] Item does not exist: ", item_info)
-    return result
-            
-def create_batch_write_structure(table_name, items, start_num, batch_size):
-    """
-    Create item structure for passing to batch_write_item
-    :param table_name: DynamoDB table name
-    :param items: large collection of items
-    :param start_num: Start index
-    :param num_items: Number of items
-    :return: dictionary of tables to write to
-    """
-    
-    serializer = boto3.dynamodb.types.TypeSerializer()
-    item_batch = { table_name: []}
-    item_batch_list = items[start_num : start_num + batch_size]
-    if len(item_batch_list) < 1:
-        return None
-    for item in item_batch_list:
-        item_serialized = {k: serializer.serialize(v) for k,v in item.items()}
-        item_batch[table_name].append({'PutRequest': {'Item': item_serialized}})
-                
-    return item_batch
-
-
-def ddb_batch_write(client, table_name, items):
-        messages = ""
-        num_items = len(items)
-        logger.info(f'Performing ddb_batch_write to dynamo with {num_items} items.')
-        start = 0
-        batch_size = 25
-        while True:
-            # Loop adding 25 items to dynamo at a time
-            request_items = create_batch_write_structure(table_name,items, start, batch_size)
-            if not request_items:
-                break
-            try: 
-                response = client.batch_write_item(RequestItems=request_items)
-            except ClientError as err:
-                logger.error(err.response['Error']['Message'])
-                logger.error("Failed to run full batch_write_item")
-                raise
-            if len(response['UnprocessedItems']) == 0:
-                logger.info(f'Wrote a batch of about {batch_size} items to dynamo')
-            else:
-                # Hit the provisioned write limit
-                logger.warning('Hit write limit, backing off then retrying')
-                sleep_time = 5 #seconds
-                logger.warning(f"Sleeping for {sleep_time} seconds")
-                _time.sleep(sleep_time)
-
-                # Items left over that haven't been inserted
-                unprocessed_items = response['UnprocessedItems']
-                logger.warning('Resubmitting items')
-                # Loop until unprocessed items are written
-                while len(unprocessed_items) > 0:
-                    response = client.batch_write_item(RequestItems=unprocessed_items)
-                    # If any items are still left over, add them to the
-                    # list to be written
-                    unprocessed_items = response['UnprocessedItems']
-
-                    # If there are items left over, we could do with
-                    # sleeping some more
-                    if len(unprocessed_items) > 0:
-                        sleep_time = 5 #seconds
-                        logger.warning(f"Sleeping for {sleep_time} seconds")
-                        _time.sleep(sleep_time)
-
-                # Inserted all the unprocessed items, exit loop
-                logger.warning('Unprocessed items successfully inserted')
-                break
-            if response["ResponseMetadata"]['HTTPStatusCode'] != 200:
-                messages += f"\nBatch {start} returned non 200 code"
-            start += 25
+    # expected score factor by elo
+    elodiff = np.clip((player_elos[:, None] - player_elos[None, :]) * ep.logdistancefactor,
+                      -ep.maxlogdistance, ep.maxlogdistance)
+    scorefactor_elo = 1 / (1 + np.exp(-elodiff))
+
+    adjustmenti = scorefactor_real - scorefactor_elo
+    adjustmentj = scorefactor_elo - scorefactor_real
+
+    i_expected = scorefactor_elo > 0.5
+    real_won = scorefactor_real > 0.5
+
+    # player i expected to win: never lose points when he did, lose less when he did not
+    adjustmenti = np.where(i_expected & real_won, np.maximum(0, adjustmenti), adjustmenti)
+    adjustmenti = np.where(i_expected & ~real_won, (2 * scorefactor_real - 1) * scorefactor_elo, adjustmenti)
+    # player j expected to win: same rules from his side
+    adjustmentj = np.where(~i_expected & real_won, (1 - 2 * scorefactor_real) * (1 - scorefactor_elo), adjustmentj)
+    adjustmentj = np.where(~i_expected & ~real_won, np.maximum(0, adjustmentj), adjustmentj)
+
+    pairs = np.triu(np.ones((n, n), dtype=bool), k=1)
+    eloadjust = np.where(pairs, adjustmenti, 0).sum(axis=1) + np.where(pairs, adjustmentj, 0).sum(axis=0)
+
+    new_elos = np.maximum(player_elos + eloadjust * player_ks * ep.global_K / float(n - 1), ep.floor)
+
+    elo_deltas = {}
+    for idx, pid in enumerate(pids):
+        new_elo = float(new_elos[idx])
+        elo_deltas[pid] = new_elo - float(player_elos[idx])
+        elos[pid].elo = new_elo
+        elos[pid].games += 1
+
+    return (elo_deltas, elos)
 
 
 def ddb_prepare_eloprogress_items(player_scores, elos, elo_deltas, match_id, match_region_type, real_names):
@@ -567,4 +474,4 @@ def ddb_prepare_elo_item(guid, match_region_type, elo, games, ts, real_name):
             "real_name"     : real_name
         }
     logger.info("Setting   " + guid + " " + real_name + " elo:" + str(elo) + " games " + str(games))
-    return elo_item
\ No newline at end of file
+    return elo_item
@@ -0,0 +1,321 @@
+"""
+Offline replay of the full ELO history for one region#type.
+
+The live pipeline moves ELO forward one step function execution at a time.
+This module replays every round 2 in chronological order with ratings held
+in memory, reusing the same elo_calc functions, so EloParms or KReduction
+can be retuned without pushing years of matches through the pipeline.
+
+Matches come either from the database (any DynamoDB compatible endpoint,
+e.g. DynamoDB Local) or from a directory of raw intake json files.
+Progress is saved to a checkpoint file every few matches so an interrupted
+replay picks up where it stopped. Final player#guid/elo#region#type items
+and eloprogress items are emitted in one pass at the end.
+
+Local example:
+    python elo_replay.py --directory ../../../test/gamestats4 --match-type unk#6 --output elo_items.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time as _time
+from datetime import datetime
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from elo_calc import (
+    process_elos,
+    calculate_player_scores,
+    get_winner_duration,
+    ddb_prepare_eloprogress_items,
+    ddb_prepare_elo_item
+)
+import ddb_access
+from ddb_access import batch_get_items, batch_write_items
+from match_context import convert_stats_to_dict, convert_wstats_to_dict
+from match_shards import match_pk, is_match_pk, all_shards
+from data_codec import decode_data
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("elo_replay")
+logger.setLevel(log_level)
+
+# elo_calc is chatty on INFO for every match
+logging.getLogger("elo_calc").setLevel(logging.WARNING)
+
+
+def gametype_from_player_number(total_size):
+    """Same cutoffs read_match uses to tag a match type."""
+    gametype = "notype"
+    if 5 < total_size <= 7:
+        gametype = "3"
+    if 7 < total_size <= 14:
+        gametype = "6"
+    if 14 < total_size:
+        gametype = "6plus"
+    return gametype
+
+
+class DirectoryMatchSource:
+    """Round 2 matches from a directory of raw intake json (s3 intake/ or test/gamestats*)."""
+
+    def __init__(self, directory, match_region_type, server_regions=None, default_region="unk"):
+        self.directory = directory
+        self.match_region_type = match_region_type
+        self.server_regions = server_regions or {}
+        self.default_region = default_region
+
+    def matches(self):
+        records = []
+        for file_name in glob.glob(os.path.join(self.directory, "*")):
+            if os.path.isdir(file_name):
+                continue
+            try:
+                with open(file_name) as file:
+                    gamestats = json.load(file)
+            except Exception as ex:
+                logger.warning("Skipping unreadable file " + file_name + " " + str(ex))
+                continue
+
+            if "gameinfo" not in gamestats or "stats" not in gamestats:
+                continue
+            if gamestats["gameinfo"].get("round") != "2":
+                continue
+
+            stats = convert_stats_to_dict(gamestats["stats"])
+            server_name = gamestats.get("serverinfo", {}).get("serverName", "")
+            region = self.server_regions.get(server_name, self.default_region)
+            match_region_type = region + "#" + gametype_from_player_number(len(stats))
+            if match_region_type != self.match_region_type:
+                continue
+
+            records.append({
+                "match_id": gamestats["gameinfo"]["match_id"],
+                "stats": stats,
+                "wstats": gamestats.get("wstats", []),
+                "match": gamestats["gameinfo"],
+                "real_names": {}
+            })
+
+        records.sort(key=lambda record: record["match_id"])
+        logger.info("Found " + str(len(records)) + " round 2 files for " + self.match_region_type)
+        return records
+
+
+class DdbMatchSource:
+    """Round 2 matches from the database, oldest first."""
+
+    def __init__(self, ddb_table, match_region_type, batch_size=30):
+        self.ddb_table = ddb_table
+        self.match_region_type = match_region_type
+        self.batch_size = batch_size  # matches decoded at a time, 3 keys per match
+
+    def list_match_ids(self):
+        match_ids = []
+        for pk in all_shards(ascending=True):
+            query_params = {
+                "IndexName": "lsi",
+                "KeyConditionExpression": Key("pk").eq(pk) & Key("lsipk").begins_with(self.match_region_type + "#"),
+                "ProjectionExpression": "sk",
+                "ScanIndexForward": True
+            }
+            while True:
+                response = self.ddb_table.query(**query_params)
+                for item in response.get("Items", []):
+                    if item["sk"][-1:] == "2":
+                        match_ids.append(item["sk"][0:-1])
+                if "LastEvaluatedKey" not in response:
+                    break
+                query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        logger.info("Found " + str(len(match_ids)) + " round 2 matches for " + self.match_region_type)
+        return match_ids
+
+    def get_items(self, keys):
+        return batch_get_items(self.ddb_table.name, keys)
+
+    def matches(self):
+        match_ids = self.list_match_ids()
+        for start in range(0, len(match_ids), self.batch_size):
+            batch_ids = match_ids[start: start + self.batch_size]
+            keys = []
+            for match_id in batch_ids:
+                keys.append({"pk": "statsall", "sk": match_id})
+                keys.append({"pk": "wstatsall", "sk": match_id})
+                keys.append({"pk": match_pk(match_id), "sk": match_id + "2"})
+
+            records = {}
+            for item in self.get_items(keys):
+                match_id = item["sk"][0:10]
+                record = records.setdefault(match_id, {"match_id": match_id, "real_names": {}})
+                if item["pk"] == "statsall":
+                    record["stats"] = convert_stats_to_dict(decode_data(item))
+                elif item["pk"] == "wstatsall":
+                    record["wstats"] = decode_data(item)
+                elif is_match_pk(item["pk"]):
+                    record["match"] = json.loads(item["data"])
+
+            guids = set()
+            for record in records.values():
+                guids.update(record.get("stats", {}).keys())
+            real_names = self.get_real_names(guids)
+
+            for match_id in batch_ids:
+                record = records.get(match_id, {})
+                if "stats" not in record or "match" not in record:
+                    logger.warning("Skipping match " + match_id + " with missing statsall or match.")
+                    continue
+                record.setdefault("wstats", [])  # wstatsall expires after 3 months
+                record["real_names"] = {guid: real_names[guid] for guid in record["stats"] if guid in real_names}
+                yield record
+
+    def get_real_names(self, guids):
+        real_names = {}
+        keys = [{"pk": "player#" + guid, "sk": "realname"} for guid in guids]
+        for item in self.get_items(keys):
+            real_names[item["pk"].split("#")[1]] = item.get("data", "")
+        return real_names
+
+
+class EloReplay:
+    """Replays matches through elo_calc.process_elos keeping every rating in memory."""
+
+    def __init__(self, match_region_type, checkpoint_file=None, checkpoint_every=100):
+        self.match_region_type = match_region_type
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_every = checkpoint_every
+        self.elos = {}
+        self.games = {}
+        self.real_names = {}
+        self.eloprogress_items = []
+        self.last_match_id = ""
+        self.matches_processed = 0
+
+    def load_checkpoint(self):
+        """Resume from the checkpoint file if there is one."""
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return False
+        with open(self.checkpoint_file) as file:
+            state = json.load(file)
+        if state["match_region_type"] != self.match_region_type:
+            raise ValueError("Checkpoint is for " + state["match_region_type"] + " not " + self.match_region_type)
+        self.elos = state["elos"]
+        self.games = state["games"]
+        self.real_names = state["real_names"]
+        self.eloprogress_items = state["eloprogress_items"]
+        self.last_match_id = state["last_match_id"]
+        self.matches_processed = state["matches_processed"]
+        logger.info(f"Resuming after match {self.last_match_id} with {self.matches_processed} matches processed")
+        return True
+
+    def save_checkpoint(self):
+        if not self.checkpoint_file:
+            return
+        state = {
+            "match_region_type": self.match_region_type,
+            "last_match_id": self.last_match_id,
+            "matches_processed": self.matches_processed,
+            "elos": self.elos,
+            "games": self.games,
+            "real_names": self.real_names,
+            "eloprogress_items": self.eloprogress_items
+        }
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_file, self.checkpoint_file)  # never leave a half written checkpoint
+        logger.info(f"Checkpoint saved after match {self.last_match_id}")
+
+    def process_match(self, record):
+        """Same steps as process_rtcwpro_elo minus the database."""
+        match_id = record["match_id"]
+        stats = record["stats"]
+        winner, duration = get_winner_duration(record["match"])
+        new_wstats = convert_wstats_to_dict(record["wstats"])
+        self.real_names.update(record.get("real_names", {}))
+
+        elo_dict = {guid: self.elos[guid] for guid in stats if guid in self.elos}
+        player_scores = calculate_player_scores(stats, new_wstats, winner, duration, self.games)
+        (elo_deltas, elos) = process_elos(player_scores, elo_dict)
+
+        for guid, elo in elos.items():
+            self.elos[guid] = elo.elo
+            self.games[guid] = elo.games
+
+        self.eloprogress_items.extend(ddb_prepare_eloprogress_items(player_scores, elos, elo_deltas, match_id, self.match_region_type, self.real_names))
+        self.last_match_id = match_id
+        self.matches_processed += 1
+
+    def run(self, records):
+        self.load_checkpoint()
+        t1 = _time.time()
+        processed_now = 0
+        for record in records:
+            if record["match_id"] <= self.last_match_id:
+                continue
+            self.process_match(record)
+            processed_now += 1
+            if processed_now % self.checkpoint_every == 0:
+                self.save_checkpoint()
+        self.save_checkpoint()
+        time_to_process = str(round((_time.time() - t1), 3))
+        logger.info(f"Replayed {processed_now} matches in {time_to_process} s, {len(self.elos)} players rated")
+
+    def prepare_items(self, include_expired_progress=False):
+        """Final player elo items and eloprogress items ready for ddb_batch_write."""
+        items = []
+        ts = datetime.now().isoformat()
+        for guid, elo in self.elos.items():
+            items.append(ddb_prepare_elo_item(guid, self.match_region_type, elo, self.games.get(guid, 0), ts, self.real_names.get(guid, "")))
+
+        # eloprogress items carry a 3 month ExpirationTime; old ones would be deleted by TTL right away
+        now = int(_time.time())
+        for item in self.eloprogress_items:
+            if include_expired_progress or item["ExpirationTime"] > now:
+                items.append(item)
+        return items
+
+
+def replay(source, match_region_type, checkpoint_file=None, checkpoint_every=100):
+    elo_replay = EloReplay(match_region_type, checkpoint_file, checkpoint_every)
+    elo_replay.run(source.matches())
+    return elo_replay
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay ELO history for a region#type.")
+    parser.add_argument("--match-type", required=True, help="region#type, ex. na#6")
+    parser.add_argument("--directory", help="directory with raw intake json files")
+    parser.add_argument("--server-regions", help="json file with {server name: region} for directory replays")
+    parser.add_argument("--table", help="DynamoDB table name to read matches from")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, ex. http://localhost:8000 for DynamoDB Local")
+    parser.add_argument("--checkpoint", default="elo_replay_checkpoint.json")
+    parser.add_argument("--checkpoint-every", type=int, default=100)
+    parser.add_argument("--output", help="write final items to this json file instead of the table")
+    parser.add_argument("--write", action="store_true", help="batch write final items to --table")
+    args = parser.parse_args()
+    if args.endpoint_url:
+        ddb_access.set_client(boto3.client('dynamodb', endpoint_url=args.endpoint_url))
+
+    if args.directory:
+        server_regions = {}
+        if args.server_regions:
+            with open(args.server_regions) as file:
+                server_regions = json.load(file)
+        source = DirectoryMatchSource(args.directory, args.match_type, server_regions)
+    else:
+        dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+        source = DdbMatchSource(dynamodb.Table(args.table), args.match_type)
+
+    elo_replay = replay(source, args.match_type, args.checkpoint, args.checkpoint_every)
+    items = elo_replay.prepare_items()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(items, file, indent=1)
+        logger.info(f"Saved {len(items)} items to {args.output}")
+    if args.write:
+        batch_write_items(args.table, items)
@@ -3,6 +3,7 @@ import logging
 import os
 import json
 from gamelog_process.gamelog_calc import process_gamelog
+import ref_cache
 
 # for local testing use actual table
 # for lambda execution runtime use dynamic reference
@@ -48,7 +49,8 @@ def handler(event, context):
     else:
         message = "Award processing finished for " + str(match_or_group_id)
         logger.info(message)
-        
+
+    ref_cache.log_stats()
     return {"group_name": json.dumps(match_or_group_id)}
 
 if __name__ == "__main__":
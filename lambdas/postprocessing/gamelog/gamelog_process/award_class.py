@@ -1,6 +1,71 @@
+from collections import namedtuple
+
+# shared fields of a kill event parsed once for all awards, event is the raw json for anything else
+# positions are [x, y, z] and angles are floats, all None unless an award asked for them
+Kill = namedtuple('Kill', 'unixtime agent other weapon agent_pos other_pos agent_angle other_angle event')
+
+
+def parse_kill(rtcw_event, positions=False):
+    """Make a Kill out of a raw kill event, unixtime is None if it is not numeric."""
+    unixtime = str(rtcw_event.get("unixtime", ""))
+    agent_pos = other_pos = agent_angle = other_angle = None
+    if positions:
+        agent_pos, other_pos = parse_coordinates(rtcw_event)
+        agent_angle, other_angle = parse_angles(rtcw_event)
+    return Kill(int(unixtime) if unixtime.isnumeric() else None,
+                rtcw_event.get("agent", "no guid"),
+                rtcw_event.get("other", "no guid"),
+                rtcw_event.get("weapon", None),
+                agent_pos,
+                other_pos,
+                agent_angle,
+                other_angle,
+                rtcw_event)
+
+
+def parse_coordinates(rtcw_event):
+    """Agent and other xyz from the position strings, coordinates after a bad one stay 0."""
+    try:
+        agent_coord = rtcw_event["agent_pos"].split(",")
+        other_coord = rtcw_event["other_pos"].split(",")
+        return ([float(agent_coord[0]), float(agent_coord[1]), float(agent_coord[2])],
+                [float(other_coord[0]), float(other_coord[1]), float(other_coord[2])])
+    except Exception:
+        pass
+
+    # keep what parsed before the bad coordinate
+    xyz = [0.0] * 6
+    try:
+        agent_coord = rtcw_event["agent_pos"].split(",")
+        other_coord = rtcw_event["other_pos"].split(",")
+        for num, (coord, axis) in enumerate([(agent_coord, 0), (agent_coord, 1), (agent_coord, 2),
+                                             (other_coord, 0), (other_coord, 1), (other_coord, 2)]):
+            xyz[num] = float(coord[axis])
+    except Exception:
+        # exception handling and reporting is not desired here because of data volumes and who receives them
+        pass
+    return xyz[0:3], xyz[3:6]
+
+
+def parse_angles(rtcw_event):
+    """Agent and other view angles, 0 and 180 when they do not parse."""
+    agent_angle = 0.0
+    other_angle = 180.0
+    try:
+        agent_angle = float(rtcw_event["agent_angle"])
+        other_angle = float(rtcw_event["other_angle"])
+    except Exception:
+        pass
+    return agent_angle, other_angle
+
+
 class AwardClass:
     """Calculate the longest kill in the game."""
 
+    labels = ["kill"]  # event labels this award consumes, see award_engine.AwardEngine
+    weapons = None  # weapons of kills this award consumes, None for all kills
+    positions = False  # award reads positions and view angles of kills, see parse_kill
+
     def __init__(self, award_name):
         self.award_name = award_name
         self.players_values = {}
@@ -40,8 +105,41 @@ class AwardClass:
             return {}
 
     def process_event(self, rtcw_event):
-        """User implemented event processing."""
+        """Process one raw event, AwardEngine is faster for whole gamelogs."""
+        label = rtcw_event.get("label", None)
+        if label not in self.labels:
+            return
+        if label == "kill":
+            kill = parse_kill(rtcw_event, self.positions)
+            if self.weapons is None or kill.weapon in self.weapons:
+                self.process_kill(kill)
+        elif label == "round_start":
+            self.process_round_start()
+
+    def process_kill(self, kill):
+        """User implemented kill processing."""
         raise ValueError("Not implemented!")
+
+    def process_round_start(self):
+        """Reset per round state."""
+        return
+
+    def get_partial(self):
+        """Compact json-able state of this award for one match, see merge_partial."""
+        return self.players_values
+
+    def merge_partial(self, partial):
+        """Add the state of another match as if its events were processed here."""
+        raise NotImplementedError("Method was not implemented.")
+
+    def merge_max(self, partial):
+        for guid, value in partial.items():
+            if self.players_values.get(guid, 0) < value:
+                self.players_values[guid] = value
+
+    def merge_sum(self, partial):
+        for guid, value in partial.items():
+            self.players_values[guid] = self.players_values.get(guid, 0) + value
     
     
     def clean_dups(self):
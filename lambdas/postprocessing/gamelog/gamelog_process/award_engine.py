@@ -0,0 +1,141 @@
+import logging
+import time as _time
+
+from gamelog_process.award_class import Kill, parse_kill
+from gamelog_process.gamelog_columns import GamelogColumns, np
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("award_engine")
+logger.setLevel(log_level)
+
+
+class AwardEngine:
+    """
+    Feed gamelog events to award classes in a single pass.
+
+    Every award class declares the event labels and kill weapons it consumes.
+    Subscriptions are indexed by label once, so each event costs one dict
+    lookup. Shared kill fields are parsed once and handed to every award that
+    wants that weapon, positions and view angles only when one of them reads
+    them.
+
+    With numpy available the gamelog is also decoded once into
+    gamelog_columns.GamelogColumns and awards implementing process_columns
+    get the whole gamelog as vectorized columns instead of one event at a time.
+    """
+
+    def __init__(self, award_classes, columnar=None):
+        self.award_classes = award_classes
+        if columnar is None:
+            columnar = np is not None
+        self.column_awards = [class_ for class_ in award_classes if columnar and hasattr(class_, "process_columns")]
+        self.kill_awards = []
+        self.kill_awards_by_weapon = {}
+        self.round_start_awards = []
+        for class_ in award_classes:
+            if class_ in self.column_awards:
+                continue
+            for label in class_.labels:
+                if label == "kill":
+                    self.kill_awards.append(class_)
+                elif label == "round_start":
+                    self.round_start_awards.append(class_)
+                else:
+                    raise ValueError(class_.award_name + " wants unsupported label " + label)
+        self.events_processed = 0
+        self.kills_processed = 0
+        self.processing_time = 0
+
+    def get_kill_awards(self, weapon):
+        """Award classes subscribed to kills with this weapon and if any reads positions, cached per weapon."""
+        subscription = self.kill_awards_by_weapon.get(weapon)
+        if subscription is None:
+            awards = [class_ for class_ in self.kill_awards if class_.weapons is None or weapon in class_.weapons]
+            subscription = (awards, any(class_.positions for class_ in awards))
+            self.kill_awards_by_weapon[weapon] = subscription
+        return subscription
+
+    def process_events(self, gamelog):
+        """Dispatch a list (or any iterable) of raw events in order."""
+        t1 = _time.time()
+        if len(self.column_awards) > 0:
+            if not isinstance(gamelog, list):
+                gamelog = list(gamelog)
+            columns = GamelogColumns(gamelog)
+            for class_ in self.column_awards:
+                class_.process_columns(columns)
+            self.process_columns(columns, gamelog)
+            self.events_processed += len(columns)
+            self.kills_processed += len(columns.kill_rows)
+            self.processing_time += _time.time() - t1
+            return
+
+        events = kills = 0
+        has_kill_awards = len(self.kill_awards) > 0
+        round_start_awards = self.round_start_awards
+        for rtcw_event in gamelog:
+            events += 1
+            label = rtcw_event.get("label", None)
+            if label == "kill":
+                kills += 1
+                if has_kill_awards:
+                    awards, positions = self.get_kill_awards(rtcw_event.get("weapon", None))
+                    if len(awards) > 0:
+                        kill = parse_kill(rtcw_event, positions)
+                        for class_ in awards:
+                            class_.process_kill(kill)
+            elif label == "round_start":
+                for class_ in round_start_awards:
+                    class_.process_round_start()
+        self.events_processed += events
+        self.kills_processed += kills
+        self.processing_time += _time.time() - t1
+
+    def process_columns(self, columns, gamelog):
+        """Feed kills and round starts from decoded columns to awards without process_columns."""
+        if len(self.kill_awards) == 0 and len(self.round_start_awards) == 0:
+            return
+        kill_rows = columns.kill_rows.tolist()
+        kill_unixtime = columns.kill_unixtime.tolist()
+        agents = columns.agents.tolist()
+        others = columns.others.tolist()
+        weapons = columns.weapons.tolist()
+        agent_pos = other_pos = agent_angle = other_angle = None
+        if any(class_.positions for class_ in self.kill_awards):
+            agent_pos = columns.agent_pos.tolist()
+            other_pos = columns.other_pos.tolist()
+            agent_angle = columns.agent_angle.tolist()
+            other_angle = columns.other_angle.tolist()
+        round_start_rows = columns.label_rows("round_start").tolist()
+        round_start_rows.append(len(columns))  # sentinel
+
+        next_round_start = 0
+        for kill_num, row in enumerate(kill_rows):
+            while round_start_rows[next_round_start] < row:
+                for class_ in self.round_start_awards:
+                    class_.process_round_start()
+                next_round_start += 1
+            awards, positions = self.get_kill_awards(columns.weapon_names[weapons[kill_num]])
+            if len(awards) == 0:
+                continue
+            unixtime = kill_unixtime[kill_num]
+            kill = Kill(unixtime if unixtime >= 0 else None,
+                        columns.guids[agents[kill_num]],
+                        columns.guids[others[kill_num]],
+                        columns.weapon_names[weapons[kill_num]],
+                        agent_pos[kill_num] if positions else None,
+                        other_pos[kill_num] if positions else None,
+                        agent_angle[kill_num] if positions else None,
+                        other_angle[kill_num] if positions else None,
+                        gamelog[row])
+            for class_ in awards:
+                class_.process_kill(kill)
+        for round_start in round_start_rows[next_round_start:-1]:
+            for class_ in self.round_start_awards:
+                class_.process_round_start()
+
+    def log_counters(self):
+        events_per_second = int(self.events_processed / self.processing_time) if self.processing_time > 0 else 0
+        logger.info(f"Processed {self.events_processed} events ({self.kills_processed} kills) in "
+                    f"{round(self.processing_time, 3)} s, {events_per_second} events/s")
@@ -1,4 +1,5 @@
 from gamelog_process.award_class import AwardClass
+from gamelog_process.gamelog_columns import np
 
 """
 relevant json element
@@ -30,26 +31,43 @@ class Frontliner(AwardClass):
     """
 
     award_name = "Frontliner"
+    labels = ["kill", "round_start"]
     first_kill_processed = False
 
     def __init__(self):
         super().__init__(self.award_name)
 
-    def process_event(self, rtcw_event):
-        """Take incoming kill with SMG or Pistol and see if it's a longest one for the killer."""
+    def merge_partial(self, partial):
+        self.merge_sum(partial)
+
+    def process_round_start(self):
+        self.first_kill_processed = False
+
+    def process_kill(self, kill):
+        """Award the first kill of the round to both - killer and a victim."""
         try:
-            event_label = rtcw_event.get("label", None)
-            if event_label == "kill" and not self.first_kill_processed:
-                killer = rtcw_event.get("agent", "no guid")
-                victim = rtcw_event.get("other", "no guid")
-                self.players_values[killer] = self.players_values.get(killer, 0) + 2  # points
-                self.players_values[victim] = self.players_values.get(victim, 0) + 1  # points
+            if not self.first_kill_processed:
+                self.players_values[kill.agent] = self.players_values.get(kill.agent, 0) + 2  # points
+                self.players_values[kill.other] = self.players_values.get(kill.other, 0) + 1  # points
                 self.first_kill_processed = True
-            if event_label == "round_start":
-                self.first_kill_processed = False
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
+                print("error at " + type(self).__name__ + " process event\n")
                 print(error_msg)
+
+    def process_columns(self, columns):
+        """Find the first kill of every round in gamelog_columns.GamelogColumns."""
+        round_starts = columns.label_rows("round_start").tolist()
+        boundaries = [-1] + round_starts + [len(columns)]
+        for segment in range(len(boundaries) - 1):
+            if segment > 0:
+                self.process_round_start()
+            first = int(np.searchsorted(columns.kill_rows, boundaries[segment], side="right"))
+            if first < len(columns.kill_rows) and columns.kill_rows[first] < boundaries[segment + 1] and not self.first_kill_processed:
+                killer = columns.guids[columns.agents[first]]
+                victim = columns.guids[columns.others[first]]
+                self.players_values[killer] = self.players_values.get(killer, 0) + 2  # points
+                self.players_values[victim] = self.players_values.get(victim, 0) + 1  # points
+                self.first_kill_processed = True
@@ -1,7 +1,6 @@
 import logging
 from botocore.exceptions import ClientError
 import json
-import boto3
 from boto3.dynamodb.conditions import Key
 import math
 from datetime import datetime
@@ -14,18 +13,35 @@ from gamelog_process.top_feuds import TopFeuds
 from gamelog_process.view_angles import ViewAngles
 from gamelog_process.kills_per_game import KillsPerGame
 from gamelog_process.notify_discord import post_custom_bus_event
+from gamelog_process.award_engine import AwardEngine
+from data_codec import decode_data, fetch_data_parts
+import ddb_access
+from ddb_access import batch_write_items
+import ref_cache
+from leaderboards import update_boards
+from match_context import load_match_context
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger("gamelog_calc")
 logger.setLevel(log_level)
 import time
-
-
-def process_gamelog(ddb_table, ddb_client, event_client, match_or_group_id, log_stream_name, CUSTOM_BUS):
-    """Main logic for processing a collection of gamelogs."""
-    # Put individual award calculator classes into an array 
-    award_classes = [
+import resource
+
+# group awards merge per match partials (pk awardpartials) instead of replaying every gamelog
+use_award_partials = True
+award_partials_version = 2  # bump when award state changes, older partials get recalculated
+award_partials_ttl = 60 * 60 * 24 * 90  # groups older than 3 months replay their gamelogs
+# replayed group gamelogs are fetched a page at a time and processed one round at a time
+stream_gamelogs = True
+gamelog_page_size = 10
+gamelog_page_sleep = 1  # seconds between pages to stay under the table read capacity
+real_name_cache = ref_cache.get_cache("real_names")
+
+
+def make_award_classes():
+    """Put individual award calculator classes into an array."""
+    return [
         LongestKill(),
         Frontliner(),
         MegaKill(),
@@ -33,19 +49,52 @@ def process_gamelog(ddb_table, ddb_client, event_client, match_or_group_id, log_
         ViewAngles(),
         KillsPerGame()
         ]
+
+
+def process_gamelog(ddb_table, ddb_client, event_client, match_or_group_id, log_stream_name, CUSTOM_BUS, match_context=None):
+    """Main logic for processing a collection of gamelogs.
+
+    match_context is the shared match_context.load_match_context result when a
+    single match runs in the fused post-processing lambda, otherwise a single
+    match loads it here.
+    """
+    award_classes = make_award_classes()
     achievment_award_names = ["Longest Kill", "MegaKill", "Kills Per Game"]
     no_group_awards = ["Kills Per Game"]
     
     is_single_match = isinstance(match_or_group_id, int)
     is_group = not is_single_match
 
-    gamelog_all, match_region_type = get_multi_round_gamelog_array(ddb_table, match_or_group_id,log_stream_name, is_single_match)
-    
-    # Loop through all events in the match or a group
-    for rtcw_event in gamelog_all:
-        # feed each event to a different award calculator class
-        for class_ in award_classes:
-            class_.process_event(rtcw_event)
+    standalone = match_context is None
+    if is_single_match and standalone:
+        match_context = load_match_context(ddb_table, match_or_group_id, log_stream_name)
+        if "error" in match_context:
+            logger.error(match_context["error"])
+            return
+
+    if is_group and use_award_partials:
+        matches, match_region_type = get_group_matches(ddb_table, match_or_group_id)
+        merge_award_partials(ddb_table, matches, award_classes, log_stream_name)
+    elif is_group and stream_gamelogs:
+        matches, match_region_type = get_group_matches(ddb_table, match_or_group_id)
+        process_streamed_gamelogs(ddb_table, matches, award_classes, log_stream_name)
+    else:
+        if is_single_match:
+            gamelog_all = match_context["gamelogs"]
+            match_region_type = match_context["match_region_type"]
+        else:
+            gamelog_all, match_region_type = get_multi_round_gamelog_array(ddb_table, match_or_group_id, log_stream_name)
+
+        # Loop through all events in the match or a group once
+        # and feed each event to the award calculator classes that want it
+        award_engine = AwardEngine(award_classes)
+        award_engine.process_events(gamelog_all)
+        award_engine.log_counters()
+        logger.info(f"Peak RSS {get_peak_rss_mb()} MB")
+
+    if is_single_match:
+        # before results are taken, update_achievements trims players_values
+        save_award_partials(ddb_table, match_or_group_id, get_award_partials(award_classes))
 
     
     potential_achievements = {}
@@ -73,9 +122,13 @@ def process_gamelog(ddb_table, ddb_client, event_client, match_or_group_id, log_
     # by the time group is created, all personal achievements had been processed
     if is_single_match:
         logger.info("Updating achievements for a single match.")
-        real_names = get_real_names(potential_achievements, [],  ddb_table)
+        real_names = match_context["real_names"]
         match_id = match_or_group_id
-        update_achievements(ddb_table, ddb_client, event_client, potential_achievements, log_stream_name, real_names, match_region_type, CUSTOM_BUS, match_id)
+        achievement_items = update_achievements(ddb_table, ddb_client, event_client, potential_achievements, log_stream_name, real_names, match_region_type, CUSTOM_BUS, match_id)
+        # leaderboards are merged once all calculators are done with the match
+        match_context.setdefault("leader_items", []).extend(achievement_items)
+        if standalone:
+            update_boards(ddb_table, achievement_items)
     
     if is_group:
         logger.info("Saving cache for a group of matches.")
@@ -114,21 +167,128 @@ def cache_group_awards(ddb_table, awards, top_feuds, match_or_group_id, real_nam
     logger.info("Cached group awards under " + "pk: groupawards"+ " sk: " + match_or_group_id)
 
 
-def get_multi_round_gamelog_array(ddb_table, match_or_group_id, log_stream_name, is_single_match):
-    """Based on the list of matches get their gamelogs for both rounds."""
+def get_award_partials(award_classes):
+    """Mergeable state of every award for one match."""
+    return {class_.award_name: class_.get_partial() for class_ in award_classes}
+
+
+def save_award_partials(ddb_table, match_id, partials):
+    item = {
+        'pk': "awardpartials",
+        'sk': str(match_id),
+        'data': json.dumps({"version": award_partials_version, "awards": partials}),
+        'ExpirationTime': int(match_id) + award_partials_ttl
+    }
+    try:
+        ddb_put_item(item, ddb_table)
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.warning("Failed to save award partials for " + str(match_id) + ". Group awards will replay its gamelog.\n" + error_msg)
+
+
+def merge_award_partials(ddb_table, matches, award_classes, log_stream_name):
+    """Merge per match award partials into award_classes, replay gamelogs of matches without them."""
+    t1 = _time.time()
+    # a match listed twice in a group would be a duplicate key in the batch get
+    matches = list(dict.fromkeys(str(match_id) for match_id in matches))
+    item_list = [{"pk": "awardpartials", "sk": match_id} for match_id in matches]
+    partial_items = get_big_batch_items(item_list, ddb_table, log_stream_name)
+    partials = {}
+    for partial_item in partial_items:
+        partial_data = json.loads(partial_item["data"])
+        if partial_data.get("version") == award_partials_version:
+            partials[partial_item["sk"]] = partial_data["awards"]
+
+    missing = [match_id for match_id in matches if match_id not in partials]
+    if len(missing) > 0:
+        logger.info(f"Replaying gamelogs of {len(missing)} matches without award partials.")
+    for match_id in missing:
+        match_award_classes = make_award_classes()
+        award_engine = AwardEngine(match_award_classes)
+        for round_gamelog in iter_round_gamelogs(ddb_table, [match_id], log_stream_name):
+            award_engine.process_events(round_gamelog)
+        partials[match_id] = get_award_partials(match_award_classes)
+        save_award_partials(ddb_table, match_id, partials[match_id])
+
+    for match_id in matches:
+        partial = partials.pop(match_id)
+        for class_ in award_classes:
+            class_.merge_partial(partial.get(class_.award_name, {}))
+
+    time_to_merge = str(round((_time.time() - t1), 3))
+    logger.info(f"Merged award partials of {len(matches)} matches ({len(missing)} replayed) in {time_to_merge} s. Peak RSS {get_peak_rss_mb()} MB")
+
+
+def iter_round_gamelogs(ddb_table, matches, log_stream_name, page_size=None):
+    """Yield decoded gamelogs one round at a time, fetching gamelog items a page at a time.
+
+    Only one page of raw items and one decoded round are alive at once, the
+    caller should drop each round before asking for the next one.
+    """
+    if page_size is None:
+        page_size = gamelog_page_size
+    item_list = []
+    for match_id in matches:
+        item_list.append({"pk": "gamelogs", "sk": str(match_id) + "1"})
+        item_list.append({"pk": "gamelogs", "sk": str(match_id) + "2"})
+
+    pages = math.ceil(len(item_list) / page_size)
+    for page_num, start in enumerate(range(0, len(item_list), page_size)):
+        if page_num > 0:
+            time.sleep(gamelog_page_sleep)
+        logger.info(f'Getting gamelog page {page_num + 1} of {pages}.')
+        page = get_batch_items(item_list[start: start + page_size], ddb_table, log_stream_name)
+        if "error" in page:
+            continue
+        page = get_gamelog_parts(page, ddb_table, log_stream_name)
+        # batch_get_item does not keep the order of keys
+        page.sort(key=lambda gamelog_item: gamelog_item["sk"], reverse=True)
+        while len(page) > 0:
+            yield decode_data(page.pop())
+
+
+def get_gamelog_parts(gamelog_items, ddb_table, log_stream_name):
+    """Attach the parts of split gamelogs, dropping rounds whose parts cannot be read."""
+    missing_parts = fetch_data_parts(gamelog_items, lambda keys: get_big_batch_items(keys, ddb_table, log_stream_name))
+    if len(missing_parts) > 0:
+        logger.warning("Skipping gamelogs with missing parts: " + ", ".join([key["sk"] for key in missing_parts]))
+        gamelog_items = [item for item in gamelog_items if "data_parts" not in item or "data_part_items" in item]
+    return gamelog_items
+
+
+def process_streamed_gamelogs(ddb_table, matches, award_classes, log_stream_name):
+    """Feed group gamelogs to the award classes round by round."""
+    award_engine = AwardEngine(award_classes)
+    rounds = 0
+    for round_gamelog in iter_round_gamelogs(ddb_table, matches, log_stream_name):
+        award_engine.process_events(round_gamelog)
+        rounds += 1
+        del round_gamelog
+    award_engine.log_counters()
+    logger.info(f"Streamed {rounds} gamelog rounds of {len(matches)} matches. Peak RSS {get_peak_rss_mb()} MB")
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process, ru_maxrss is in KB on linux."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def get_group_matches(ddb_table, group_name):
+    """Get the list of matches and region#type of a group."""
     matches = []
     match_region_type = "na#6"
-    if is_single_match:
-        matches.append(match_or_group_id)
-        match_response = ddb_table.query(KeyConditionExpression=Key("pk").eq("match") & Key("sk").begins_with(str(match_or_group_id)), Limit=1, ScanIndexForward=False)
-        if len(match_response.get("Items",[])) > 0:
-            match_region_type = "#".join(match_response["Items"][0]["lsipk"].split("#")[0:2])
-    else:
-        group_response = ddb_table.query(KeyConditionExpression=Key("pk").eq("group") & Key("sk").begins_with(match_or_group_id), Limit=1, ScanIndexForward=False)
-        if len(group_response.get("Items",[])) > 0:
-            matches = json.loads(group_response["Items"][0]["data"])
-            match_region_type = "#".join(group_response["Items"][0]["lsipk"].split("#")[0:2])
-            
+    group_response = ddb_table.query(KeyConditionExpression=Key("pk").eq("group") & Key("sk").begins_with(group_name), Limit=1, ScanIndexForward=False)
+    if len(group_response.get("Items",[])) > 0:
+        matches = json.loads(group_response["Items"][0]["data"])
+        match_region_type = "#".join(group_response["Items"][0]["lsipk"].split("#")[0:2])
+    return matches, match_region_type
+
+
+def get_multi_round_gamelog_array(ddb_table, group_name, log_stream_name):
+    """Based on the list of matches in a group get their gamelogs for both rounds."""
+    matches, match_region_type = get_group_matches(ddb_table, group_name)
+
     big_item_list = []
     for match_id in matches: 
         big_item_list.append({"pk": "gamelogs", "sk": str(match_id) + "1"})
@@ -136,10 +296,11 @@ def get_multi_round_gamelog_array(ddb_table, match_or_group_id, log_stream_name,
     
     logger.info("Getting gamelogs for " + str(len(big_item_list)) + " matches.")
     gamelog_responses = get_big_batch_items(big_item_list, ddb_table, log_stream_name)
+    gamelog_responses = get_gamelog_parts(gamelog_responses, ddb_table, log_stream_name)
     
     gamelog_all = []
     for gamelog_item in gamelog_responses:
-        gamelog_all.extend(json.loads(gamelog_item["data"]))
+        gamelog_all.extend(decode_data(gamelog_item))
     
     return gamelog_all, match_region_type
 
@@ -183,10 +344,12 @@ def update_achievements(ddb_table, ddb_client, event_client, potential_achieveme
     # submit updated summaries
     items = []
     items.extend(update_achievement_items)
+    written_items = []
     
     if len(items) > 0:
         try:
-            ddb_batch_write(ddb_client, ddb_table.name, items)
+            batch_write_items(ddb_table.name, items)
+            written_items = items
 
             events = announce_new_achievements(update_achievement_items, match_region_type, CUSTOM_BUS)
             post_custom_bus_event(event_client, events)
@@ -199,6 +362,7 @@ def update_achievements(ddb_table, ddb_client, event_client, potential_achieveme
     else:
         message = "No achievements to insert this time."
     logger.info(message)
+    return written_items
 
 def announce_new_achievements(update_achievement_items, match_region_type, CUSTOM_BUS):
     """Prepare an event about new group for discord announcement."""
@@ -230,51 +394,15 @@ def make_error_dict(message, item_info):
 
 def get_batch_items(item_list, ddb_table, log_stream_name):
     """Get items in a batch."""
-    dynamodb = boto3.resource('dynamodb')
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={ddb_table.name: {'Keys': item_list, 'ProjectionExpression': 'pk, sk, #data_value, gsi1pk, gsi1sk', 'ExpressionAttributeNames': {'#data_value': 'data'} }}, ReturnConsumedCapacity='NONE')
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            result = make_error_dict("[x] Items do not exist: ", item_info)
-        
-        if len(response['UnprocessedKeys']) > 0:
-            logger.warning("gamelog_calc:get_batch_items:response:UnprocessedKeys is greated than zero")
-    return result
+    return ddb_access.get_batch_items(item_list, ddb_table, log_stream_name, 'pk, sk, #data_value, data_enc, data_parts, gsi1pk, gsi1sk')
 
 
 def get_big_batch_items(big_item_list, ddb_table, log_stream_name):
-    """Get over 100 batch items."""
-    
-    num_items = len(big_item_list)
-    
-    start = 0
-    batch_size = 10
-    batch_num = 1
-    
-    batches = math.ceil(num_items/batch_size) 
-    
-    item_list_list = []
-    for i in range(1, batches+1):
-        item_list_list.append(big_item_list[start: start + batch_size])
-        start += batch_size
-    
-    big_response = []
-    for item_list in item_list_list:
-        logger.info(f'Performing get_batch_items from dynamo with {num_items} in batch {batch_num} of {batches} batches.')
-        response = get_batch_items(item_list, ddb_table, log_stream_name)
-        time.sleep(1)
-        batch_num +=1
-        
-        if "error" not in response:
-            big_response.extend(response)
-    
-    return big_response
+    """Get over 100 batch items, leaving out the ones that do not exist."""
+    response = get_batch_items(big_item_list, ddb_table, log_stream_name)
+    if "error" in response:
+        return []
+    return response
 
 
 def ddb_prepare_achievement_items(potential_achievements, achievments_old, real_names, match_region_type, match_id):
@@ -302,12 +430,29 @@ def ddb_prepare_achievement_items(potential_achievements, achievments_old, real_
 
 def get_real_names(potential_achievements, top_feuds, ddb_table):
     real_name_item_list = prepare_playerinfo_list(potential_achievements, top_feuds, "realname")
-    response = get_batch_items(real_name_item_list, ddb_table, "real_names")
+    guids = [item["pk"].split("#")[1] for item in real_name_item_list]
+    try:
+        real_names = real_name_cache.get_many(guids, lambda missing: load_real_names(missing, ddb_table))
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.warning(error_msg)
+        real_names = {}
+    return real_names
+
+
+def load_real_names(guids, ddb_table):
+    """Real names by guid. Raises when ddb could not be read, so nothing is cached."""
+    item_list = [{"pk": "player#" + guid, "sk": "realname"} for guid in guids]
+    response = get_batch_items(item_list, ddb_table, "real_names")
     real_names = {}
-    if "error" not in response:
-        for result in response:
-            guid = result["pk"].split("#")[1]
-            real_names[guid] = result["data"]
+    if "error" in response:
+        if "Items do not exist" not in response["error"]:
+            raise Exception(response["error"])
+        return real_names
+    for result in response:
+        guid = result["pk"].split("#")[1]
+        real_names[guid] = result["data"]
     return real_names
 
             
@@ -331,78 +476,6 @@ def prepare_playerinfo_list(potential_achievements, top_feuds, sk):
     return item_list
 
 
-def create_batch_write_structure(table_name, items, start_num, batch_size):
-    """
-    Create item structure for passing to batch_write_item
-    :param table_name: DynamoDB table name
-    :param items: large collection of items
-    :param start_num: Start index
-    :param num_items: Number of items
-    :return: dictionary of tables to write to
-    """
-    
-    serializer = boto3.dynamodb.types.TypeSerializer()
-    item_batch = { table_name: []}
-    item_batch_list = items[start_num : start_num + batch_size]
-    if len(item_batch_list) < 1:
-        return None
-    for item in item_batch_list:
-        item_serialized = {k: serializer.serialize(v) for k,v in item.items()}
-        item_batch[table_name].append({'PutRequest': {'Item': item_serialized}})
-                
-    return item_batch
-
-
-def ddb_batch_write(client, table_name, items):
-        messages = ""
-        num_items = len(items)
-        logger.info(f'Performing ddb_batch_write to dynamo with {num_items} items.')
-        start = 0
-        batch_size = 25
-        while True:
-            # Loop adding 25 items to dynamo at a time
-            request_items = create_batch_write_structure(table_name,items, start, batch_size)
-            if not request_items:
-                break
-            try: 
-                response = client.batch_write_item(RequestItems=request_items)
-            except ClientError as err:
-                logger.error(err.response['Error']['Message'])
-                logger.error("Failed to run full batch_write_item")
-                raise
-            if len(response['UnprocessedItems']) == 0:
-                logger.info(f'Wrote a batch of about {batch_size} items to dynamo')
-            else:
-                # Hit the provisioned write limit
-                logger.warning('Hit write limit, backing off then retrying')
-                sleep_time = 5 #seconds
-                logger.warning(f"Sleeping for {sleep_time} seconds")
-                _time.sleep(sleep_time)
-
-                # Items left over that haven't been inserted
-                unprocessed_items = response['UnprocessedItems']
-                logger.warning('Resubmitting items')
-                # Loop until unprocessed items are written
-                while len(unprocessed_items) > 0:
-                    response = client.batch_write_item(RequestItems=unprocessed_items)
-                    # If any items are still left over, add them to the
-                    # list to be written
-                    unprocessed_items = response['UnprocessedItems']
-
-                    # If there are items left over, we could do with
-                    # sleeping some more
-                    if len(unprocessed_items) > 0:
-                        sleep_time = 5 #seconds
-                        logger.warning(f"Sleeping for {sleep_time} seconds")
-                        _time.sleep(sleep_time)
-
-                # Inserted all the unprocessed items, exit loop
-                logger.warning('Unprocessed items successfully inserted')
-                break
-            if response["ResponseMetadata"]['HTTPStatusCode'] != 200:
-                messages += f"\nBatch {start} returned non 200 code"
-            start += 25
-            
 def ddb_put_item(Item, table):
     """Put a single item in ddb."""
     try:
@@ -424,4 +497,4 @@ def ddb_put_item(Item, table):
 
         if http_code != 200:
             logger.error("Unhandled HTTP Code " + str(http_code) + " while submitting item " + pk + ":" + sk + "\n" + str(response))
-    return response
\ No newline at end of file
+    return response
@@ -0,0 +1,101 @@
+try:
+    import numpy as np
+except ImportError:  # numpy is not bundled with every deployment of this lambda
+    np = None
+
+from gamelog_process.award_class import parse_coordinates, parse_angles
+
+
+class GamelogColumns:
+    """
+    Gamelog events decoded once into numpy columns.
+
+    Row level columns (labels) cover every event, kill level columns cover
+    only kill events in the original order, kill_rows has their row numbers. Guids, labels and weapons are int-coded, the code is the index
+    in guids/label_names/weapon_names.
+    """
+
+    def __init__(self, events):
+        guid_codes = {}
+        label_codes = {}
+        weapon_codes = {}
+
+        labels = [rtcw_event.get("label", None) for rtcw_event in events]
+        self.labels = np.array([label_codes.setdefault(label, len(label_codes)) for label in labels], dtype=np.int16)
+        self.kill_rows = np.array([row for row, label in enumerate(labels) if label == "kill"], dtype=np.int64)
+
+        kills = [events[row] for row in self.kill_rows.tolist()]
+        self.agents = np.array([guid_codes.setdefault(kill.get("agent", "no guid"), len(guid_codes)) for kill in kills], dtype=np.int32)
+        self.others = np.array([guid_codes.setdefault(kill.get("other", "no guid"), len(guid_codes)) for kill in kills], dtype=np.int32)
+        self.weapons = np.array([weapon_codes.setdefault(kill.get("weapon", None), len(weapon_codes)) for kill in kills], dtype=np.int16)
+        self.kill_unixtime = decode_unixtime(kills)
+        self.agent_pos, self.other_pos = decode_positions(kills)
+        self.agent_angle, self.other_angle = decode_angles(kills)
+
+        self.guids = list(guid_codes.keys())
+        self.label_names = list(label_codes.keys())
+        self.weapon_names = list(weapon_codes.keys())
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label_rows(self, label):
+        """Row numbers of all events with this label."""
+        if label not in self.label_names:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.labels == self.label_names.index(label))
+
+    def weapon_mask(self, weapons):
+        """Boolean mask over kills made with any of the weapons, all kills if weapons is None."""
+        if weapons is None:
+            return np.ones(len(self.kill_rows), dtype=bool)
+        codes = [code for code, weapon in enumerate(self.weapon_names) if weapon in weapons]
+        return np.isin(self.weapons, codes)
+
+
+def decode_unixtime(kills):
+    """Unixtime of every kill, -1 where it is not numeric."""
+    unixtime = [kill.get("unixtime", "") for kill in kills]
+    if all(isinstance(value, str) for value in unixtime):
+        strings = np.array(unixtime, dtype=str)
+        numeric = np.char.isnumeric(strings)
+        if numeric.all():
+            return strings.astype(np.int64)
+        return np.where(numeric, np.where(numeric, strings, "0").astype(np.int64), -1)
+    return np.array([int(str(value)) if str(value).isnumeric() else -1 for value in unixtime], dtype=np.int64)
+
+
+def decode_positions(kills):
+    """Agent and other xyz as (n, 3) arrays, bad rows are parsed like award_class.parse_coordinates."""
+    agent_pos = [kill.get("agent_pos", None) for kill in kills]
+    other_pos = [kill.get("other_pos", None) for kill in kills]
+    try:
+        # one C level conversion for the whole column when every row is well formed
+        if all(isinstance(pos, str) and pos.count(",") == 2 for pos in agent_pos + other_pos):
+            return (np.array(",".join(agent_pos).split(","), dtype=np.float64).reshape(-1, 3),
+                    np.array(",".join(other_pos).split(","), dtype=np.float64).reshape(-1, 3))
+    except ValueError:
+        pass
+
+    agent_xyz = np.zeros((len(kills), 3), dtype=np.float64)
+    other_xyz = np.zeros((len(kills), 3), dtype=np.float64)
+    for row, kill in enumerate(kills):
+        agent_xyz[row], other_xyz[row] = parse_coordinates(kill)
+    return agent_xyz, other_xyz
+
+
+def decode_angles(kills):
+    """Agent and other view angles, bad rows are parsed like award_class.parse_angles."""
+    agent_angle = [kill.get("agent_angle", None) for kill in kills]
+    other_angle = [kill.get("other_angle", None) for kill in kills]
+    try:
+        if all(isinstance(angle, str) for angle in agent_angle + other_angle):
+            return np.array(agent_angle, dtype=np.float64), np.array(other_angle, dtype=np.float64)
+    except ValueError:
+        pass
+
+    agent = np.zeros(len(kills), dtype=np.float64)
+    other = np.full(len(kills), 180, dtype=np.float64)
+    for row, kill in enumerate(kills):
+        agent[row], other[row] = parse_angles(kill)
+    return agent, other
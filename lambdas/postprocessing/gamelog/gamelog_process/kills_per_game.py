@@ -1,4 +1,5 @@
 from gamelog_process.award_class import AwardClass
+from gamelog_process.gamelog_columns import np
 
 """
 relevant json element
@@ -30,17 +31,23 @@ class KillsPerGame(AwardClass):
     def __init__(self):
         super().__init__(self.award_name)
 
-    def process_event(self, rtcw_event):
+    def process_kill(self, kill):
         """Take incoming kill and add it to a killer."""
         try:
-            if rtcw_event.get("label", None) == "kill":
-                killer = rtcw_event.get("agent", "no guid")
-                self.players_values[killer] = self.players_values.get(killer, 0) + 1
+            self.players_values[kill.agent] = self.players_values.get(kill.agent, 0) + 1
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
+                print("error at " + type(self).__name__ + " process event\n")
                 print(error_msg)
 
+    def merge_partial(self, partial):
+        self.merge_sum(partial)
 
+    def process_columns(self, columns):
+        """Vectorized process_kill over all kills in gamelog_columns.GamelogColumns."""
+        kills = np.bincount(columns.agents, minlength=len(columns.guids))
+        for code in np.flatnonzero(kills).tolist():
+            killer = columns.guids[code]
+            self.players_values[killer] = self.players_values.get(killer, 0) + int(kills[code])
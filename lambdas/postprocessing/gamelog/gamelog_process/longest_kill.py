@@ -1,5 +1,6 @@
 import math
 from gamelog_process.award_class import AwardClass
+from gamelog_process.gamelog_columns import np
 
 """
 relevant json element
@@ -27,41 +28,39 @@ class LongestKill(AwardClass):
     """Calculate the longest kill in the game."""
 
     award_name = "Longest Kill"
+    weapons = {"MP-40", "Thompson", "Sten", "Colt", "Luger"}
+    positions = True
 
     def __init__(self):
         super().__init__(self.award_name)
 
-    def process_event(self, rtcw_event):
+    def process_kill(self, kill):
         """Take incoming kill with SMG or Pistol and see if it's a longest one for the killer."""
         try:
-            if rtcw_event.get("label", None) == "kill" and rtcw_event.get("weapon", None) in ["MP-40", "Thompson", "Sten", "Colt", "Luger"]:
-                killer = rtcw_event.get("agent", "no guid")
-                x1, x2, y1, y2, z1, z2 = self.get_coordinates(rtcw_event)
-                dist = int(math.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2))
-                if self.players_values.get(killer, 0) < dist:
-                    self.players_values[killer] = dist
+            x1, y1, z1 = kill.agent_pos
+            x2, y2, z2 = kill.other_pos
+            dist = int(math.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2))
+            if self.players_values.get(kill.agent, 0) < dist:
+                self.players_values[kill.agent] = dist
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
+                print("error at " + type(self).__name__ + " process event\n")
                 print(error_msg)
 
-    def get_coordinates(self, rtcw_event):
-        """Extract coorinates from the position string."""
-        x1 = x2 = y1 = y2 = z1 = z2 = 0
-        try:
-            agent_coord = rtcw_event["agent_pos"].split(",")
-            other_coord = rtcw_event["other_pos"].split(",")
-            x1 = float(agent_coord[0])
-            y1 = float(agent_coord[1])
-            z1 = float(agent_coord[2])
-            x2 = float(other_coord[0])
-            y2 = float(other_coord[1])
-            z2 = float(other_coord[2])
-        except Exception as ex:
-            if self.debug:
-                print("error at " + rtcw_event.get("unixtime", "no_unixtime") + ": could not split coordinates." + ex.args)
-            # exception handling and reporting is not desired here because of data volumes and who receives them
+    def merge_partial(self, partial):
+        self.merge_max(partial)
 
-        return x1, x2, y1, y2, z1, z2
+    def process_columns(self, columns):
+        """Vectorized process_kill over all kills in gamelog_columns.GamelogColumns."""
+        mask = columns.weapon_mask(self.weapons)
+        diff = columns.other_pos[mask] - columns.agent_pos[mask]
+        dist = np.sqrt(diff[:, 0]**2 + diff[:, 1]**2 + diff[:, 2]**2)
+        finite = np.isfinite(dist)
+        longest = np.zeros(len(columns.guids), dtype=np.int64)
+        np.maximum.at(longest, columns.agents[mask][finite], dist[finite].astype(np.int64))
+        for code in np.flatnonzero(longest).tolist():
+            killer = columns.guids[code]
+            if self.players_values.get(killer, 0) < longest[code]:
+                self.players_values[killer] = int(longest[code])
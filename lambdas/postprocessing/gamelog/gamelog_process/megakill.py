@@ -1,3 +1,5 @@
+from collections import deque
+
 from gamelog_process.award_class import AwardClass
 
 """
@@ -23,65 +25,86 @@ relevant json element
 
 
 class MegaKill(AwardClass):
-    """Calculate the biggest kill streak ove y kills  in x seconds."""
+    """Calculate the biggest kill streak ove y kills  in x seconds.
+
+    windows is a list of (minimum kills, seconds) tiers evaluated in the same
+    pass. The first one is the MegaKill award in players_values, the others
+    are kept in window_values under "kills/seconds".
+    """
 
     award_name = "MegaKill"
+    labels = ["kill", "round_start"]
 
-    def __init__(self):
+    def __init__(self, windows=None):
         super().__init__(self.award_name)
-        self.current_kills = {}
-        self.minimum_seconds = 6
-        self.minimum_kills = 3
+        if windows is None:
+            windows = [(3, 6)]
+        self.windows = windows
+        self.minimum_kills, self.minimum_seconds = windows[0]
+        self.window_names = [str(kills) + "/" + str(seconds) for kills, seconds in windows]
+        # one time stamp deque per window and killer, oldest kill on the left
+        self.current_kills = [{} for window in windows]
+        self.window_values = {window_name: {} for window_name in self.window_names[1:]}
         self.local_debug = False
         self.debug_killer = "b3465bff43fe40ea76f9e522d3314809"
         self.current_time = 0
-        
-    def process_event(self, rtcw_event):
-        """Take incoming kill with SMG or Pistol and see if it's a longest one for the killer."""
+
+    def get_partial(self):
+        return {"players_values": self.players_values, "window_values": self.window_values}
+
+    def merge_partial(self, partial):
+        """Streams never cross rounds so the longest one of a group is the longest of its matches."""
+        self.merge_max(partial.get("players_values", {}))
+        for window_name, values in partial.get("window_values", {}).items():
+            if window_name in self.window_values:
+                window_values = self.window_values[window_name]
+                for player, value in values.items():
+                    window_values[player] = max(window_values.get(player, 0), value)
+
+    def get_window_results(self):
+        """Longest streaks of the extra tiers."""
+        return self.window_values
+
+    def process_round_start(self):
+        self.current_kills = [{} for window in self.windows]
+        if self.local_debug:
+            print("reset all")
+
+    def process_kill(self, kill):
+        """Take incoming kill and see if the killer's recent kills make a streak."""
         try:
-            if rtcw_event.get("label", None) == "round_start":
-                self.current_kills = {}
-                if self.local_debug:
-                    print("reset all")
-            
-            if rtcw_event.get("label", None) == "kill" and rtcw_event.get("unixtime", "").isnumeric():
-                killer = rtcw_event["agent"]
-                self.current_time = int(rtcw_event.get("unixtime", "0"))
-                                
-                # append current kill time stamp to kill time stamp array
-                if self.local_debug and killer == self.debug_killer:
-                    print(str(self.current_kills.get(killer,[])) + " + " + str(self.current_time))
-                if killer in self.current_kills:
-                    self.current_kills[killer].append(self.current_time)
-                else:
-                    self.current_kills[killer] = [self.current_time]
-         
-                # remove time stamps older than x seconds or once from other matches
-                removals = []  # because removing during iterations is a mess
-                for past_time_stamp in self.current_kills[killer]:
-                    time_since = self.current_time - past_time_stamp
-                    if time_since > self.minimum_seconds or time_since < 0:
-                        removals.append(past_time_stamp)
-                        if self.local_debug and killer == self.debug_killer:
-                            print("will remove " + str(past_time_stamp) + "( " + str(time_since) + " )")
+            if kill.unixtime is not None and "agent" in kill.event:
+                killer = kill.agent
+                self.current_time = kill.unixtime
+
+                for window_num, (minimum_kills, seconds) in enumerate(self.windows):
+                    time_stamps = self.current_kills[window_num].get(killer)
+                    if time_stamps is None:
+                        time_stamps = self.current_kills[window_num][killer] = deque()
+                    if self.local_debug and killer == self.debug_killer:
+                        print(str(list(time_stamps)) + " + " + str(self.current_time))
+
+                    # time stamps stay sorted: drop ones from the future (another match) on the right
+                    # and ones older than x seconds on the left
+                    while len(time_stamps) > 0 and time_stamps[-1] > self.current_time:
+                        time_stamps.pop()
+                    while len(time_stamps) > 0 and self.current_time - time_stamps[0] > seconds:
+                        time_stamps.popleft()
+                    time_stamps.append(self.current_time)
+
+                    # see if length of recent kills qualifies for a record
+                    current_streak = len(time_stamps)
+                    if window_num == 0:
+                        values = self.players_values
                     else:
+                        values = self.window_values[self.window_names[window_num]]
+                    if current_streak >= minimum_kills and current_streak > values.get(killer, 0):
+                        values[killer] = current_streak
                         if self.local_debug and killer == self.debug_killer:
-                            print("will keep " + str(past_time_stamp) + "( " + str(time_since) + " )")
-                
-                for r in removals:
-                    self.current_kills[killer].remove(r)
-                    if self.local_debug and killer == self.debug_killer:
-                            print("removing", str(r))
-                
-                # see if length of recent kills qualifies for a record
-                current_streak = len(self.current_kills.get(killer, []))
-                if current_streak >= self.minimum_kills and current_streak > self.players_values.get(killer, 0):
-                    self.players_values[killer] = current_streak
-                    if self.local_debug and killer == self.debug_killer:
-                            print("Record!", str(current_streak))
+                            print("Record!", self.window_names[window_num], str(current_streak))
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
-                print(error_msg)
\ No newline at end of file
+                print("error at " + type(self).__name__ + " process event\n")
+                print(error_msg)
@@ -1,3 +1,5 @@
+import heapq
+
 from gamelog_process.award_class import AwardClass
 
 """
@@ -23,61 +25,86 @@ relevant json element
 
 
 class TopFeuds(AwardClass):
-    """Calculate the biggest kill streak ove y kills  in x seconds."""
+    """Find the pairs of players who killed each other the most."""
 
     award_name = "TopFeud"
+    shared_guids = {"8e6a51baf1c7e338a118d9e32472954e", "58e419de5a8b2655f6d48eab68275db5"}
 
     def __init__(self):
         super().__init__(self.award_name)
-        self.a_b = {}
         self.top_number = 12
+        # guids are interned to int codes, pairs are keyed by (lower code, higher code)
+        self.guid_codes = {}
+        self.guids = []
+        # pair: [kills lower -> higher, kills higher -> lower, first kill was higher -> lower]
+        self.pairs = {}
 
+    def get_guid_code(self, guid):
+        code = self.guid_codes.get(guid)
+        if code is None:
+            code = self.guid_codes[guid] = len(self.guids)
+            self.guids.append(guid)
+        return code
 
-    def get_custom_results(self):
-        processed_keys = []
-        merged = {}
-        for key, value in self.a_b.items():
-            if key in processed_keys:
-                # print("seen that one")
-                continue
-            if "8e6a51baf1c7e338a118d9e32472954e" in key or "58e419de5a8b2655f6d48eab68275db5" in key:
-                # print("sharedguid")
-                continue
-            reverse_key = key.split("#")[1] + "#" + key.split("#")[0]
-            if reverse_key not in self.a_b:
-                # print("left")
-                merged[key] = [value, 0, value]
+    def add_kills(self, agent, other, kills):
+        """Count kills of agent on other into their unordered pair."""
+        agent_code = self.get_guid_code(agent)
+        other_code = self.get_guid_code(other)
+        swapped = agent_code > other_code
+        pair_key = (other_code, agent_code) if swapped else (agent_code, other_code)
+        pair = self.pairs.get(pair_key)
+        if pair is None:
+            pair = self.pairs[pair_key] = [0, 0, swapped]
+        pair[1 if swapped else 0] += kills
+
+    def get_pair_kills(self):
+        """(left guid, right guid, left kills, right kills) with left being the first killer of a pair."""
+        for (lower_code, higher_code), (lower_kills, higher_kills, swapped) in self.pairs.items():
+            if lower_code == higher_code:
+                # self kills count both ways
+                yield self.guids[lower_code], self.guids[lower_code], lower_kills, lower_kills
+            elif swapped:
+                yield self.guids[higher_code], self.guids[lower_code], higher_kills, lower_kills
             else:
-                # print("right")
-                merged[key] = [value, self.a_b[reverse_key], value + self.a_b[reverse_key]]
-            processed_keys.append(reverse_key)
-        
+                yield self.guids[lower_code], self.guids[higher_code], lower_kills, higher_kills
+
+    def get_custom_results(self):
+        """Top pairs by total kills, pairs tied with the last one are kept too."""
+        merged = [feud for feud in self.get_pair_kills()
+                  if feud[0] not in self.shared_guids and feud[1] not in self.shared_guids]
+
         top_x_marker = 0
         if len(merged) > self.top_number:
-            sums = []
-            for a_b_sum in merged.values():
-                sums.append(a_b_sum[2])  
-            top_x_marker = sorted(sums, reverse=True)[self.top_number - 1]
-        
-        result = []
-        for key, a_b_sum in merged.items():
-            if a_b_sum[2] >= top_x_marker:
-                result.append([key.split("#")[0], key.split("#")[1],a_b_sum[0], a_b_sum[1]])
-             
-        return result
+            top_x_marker = heapq.nlargest(self.top_number, (feud[2] + feud[3] for feud in merged))[-1]
+
+        return [list(feud) for feud in merged if feud[2] + feud[3] >= top_x_marker]
+
+    def get_partial(self):
+        """Same "killer#victim": kills format as the old a_b dict, in first kill order."""
+        a_b = {}
+        for agent, other, agent_kills, other_kills in self.get_pair_kills():
+            if agent == other:
+                a_b[agent + "#" + other] = agent_kills
+                continue
+            if agent_kills > 0:
+                a_b[agent + "#" + other] = agent_kills
+            if other_kills > 0:
+                a_b[other + "#" + agent] = other_kills
+        return a_b
 
+    def merge_partial(self, partial):
+        for key, kills in partial.items():
+            agent, other = key.split("#")
+            self.add_kills(agent, other, kills)
 
-    def process_event(self, rtcw_event):
-        """Take incoming kill with SMG or Pistol and see if it's a longest one for the killer."""
-        try:            
-            if rtcw_event.get("label", None) == "kill" and rtcw_event.get("unixtime", "").isnumeric():
-                killer = rtcw_event["agent"]
-                victim = rtcw_event["other"]
-                self.a_b[killer + "#" + victim] = self.a_b.get(killer + "#" + victim, 0) + 1
-                   
+    def process_kill(self, kill):
+        """Count kills of every killer and victim pair."""
+        try:
+            if kill.unixtime is not None and "agent" in kill.event and "other" in kill.event:
+                self.add_kills(kill.agent, kill.other, 1)
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
+                print("error at " + type(self).__name__ + " process event\n")
                 print(error_msg)
@@ -1,4 +1,5 @@
 from gamelog_process.award_class import AwardClass
+from gamelog_process.gamelog_columns import np
 
 """
 relevant json element
@@ -26,10 +27,12 @@ class ViewAngles(AwardClass):
     """Calculate the biggest kill streak ove y kills  in x seconds."""
 
     award_name = "ViewAngles"
+    weapons = {"MP-40", "Thompson", "Sten", "Colt", "Luger"}
+    positions = True
 
     def __init__(self):
         super().__init__(self.award_name)
-        self.kill_angle_values = {"kills":{},"deaths":{}}
+        self.kill_angle_values = {"kills":{},"deaths":{}}  # player: [sum of angle differences, kills]
         self.debug = True
 
 
@@ -46,9 +49,9 @@ class ViewAngles(AwardClass):
                 if "8e6a51baf1c7e338a118d9e32472954e" in player or "58e419de5a8b2655f6d48eab68275db5" in player:
                     # print("sharedguid")
                     continue
-                lst = self.kill_angle_values[category][player]
-                if len(lst) > 9:  # make this statistically significant
-                    means[category][player] = int(abs(sum(lst) / len(lst) - 180))
+                angle_sum, num = self.kill_angle_values[category][player]
+                if num > 9:  # make this statistically significant
+                    means[category][player] = int(abs(angle_sum / num - 180))
        
         self.players_values = means["kills"]
         backstabbers = self.get_all_top_results()[self.award_name]
@@ -60,44 +63,46 @@ class ViewAngles(AwardClass):
         return result
 
 
-    def process_event(self, rtcw_event):
-        """Take incoming kill with SMG or Pistol and see if it's a longest one for the killer."""
+    def process_kill(self, kill):
+        """Take incoming kill with SMG or Pistol and remember view angles of both players."""
         try:
-            if rtcw_event.get("label", None) == "kill" and rtcw_event.get("weapon", None) in ["MP-40", "Thompson", "Sten", "Colt", "Luger"]:
-                killer = rtcw_event.get("agent", "no guid")
-                victim = rtcw_event.get("other", "no guid")
-                
-                attacker_angle, victim_angle = self.get_angles(rtcw_event)
-                angle_diff = abs(attacker_angle - victim_angle)
-                
-                if killer in self.kill_angle_values["kills"]:
-                    self.kill_angle_values["kills"][killer].append(angle_diff)
-                else:
-                    self.kill_angle_values["kills"][killer] = [angle_diff]
-                    
-                if victim in self.kill_angle_values["deaths"]:
-                    self.kill_angle_values["deaths"][victim].append(angle_diff)
-                else:
-                    self.kill_angle_values["deaths"][victim] = [angle_diff]
+            killer = kill.agent
+            victim = kill.other
+            
+            angle_diff = abs(kill.agent_angle - kill.other_angle)
+            
+            self.add_angles("kills", killer, angle_diff, 1)
+            self.add_angles("deaths", victim, angle_diff, 1)
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
             error_msg = template.format(type(ex).__name__, ex.args)
             if self.debug:
-                print("error at " + self.__name__ + " process event\n")
+                print("error at " + type(self).__name__ + " process event\n")
                 print(error_msg)
                 
                 
-    def get_angles(self, rtcw_event):
-        """Extract view angles from the json."""
-        attacker_angle = 0
-        victim_angle = 180
-        try:
-            attacker_angle = float(rtcw_event["agent_angle"])
-            victim_angle = float(rtcw_event["other_angle"])
+    def get_partial(self):
+        return self.kill_angle_values
 
-        except Exception as ex:
-            if self.debug:
-                print("error at " + rtcw_event.get("unixtime", "no_unixtime") + ": could not split coordinates." + ex.args)
-            # exception handling and reporting is not desired here because of data volumes and who receives them
-        
-        return attacker_angle, victim_angle
+    def merge_partial(self, partial):
+        for category, players in partial.items():
+            for player, (angle_sum, num) in players.items():
+                self.add_angles(category, player, angle_sum, num)
+
+    def process_columns(self, columns):
+        """Vectorized process_kill over all kills in gamelog_columns.GamelogColumns."""
+        mask = columns.weapon_mask(self.weapons)
+        angle_diffs = np.abs(columns.agent_angle[mask] - columns.other_angle[mask])
+        for category, players in [("kills", columns.agents[mask]), ("deaths", columns.others[mask])]:
+            sums = np.bincount(players, weights=angle_diffs, minlength=len(columns.guids))
+            nums = np.bincount(players, minlength=len(columns.guids))
+            for code in np.flatnonzero(nums).tolist():
+                self.add_angles(category, columns.guids[code], float(sums[code]), int(nums[code]))
+
+    def add_angles(self, category, player, angle_sum, num):
+        totals = self.kill_angle_values[category].get(player)
+        if totals is None:
+            self.kill_angle_values[category][player] = [angle_sum, num]
+        else:
+            totals[0] += angle_sum
+            totals[1] += num
@@ -0,0 +1,175 @@
+"""
+Ready-to-serve /stats/{match_id} documents.
+
+A finished match never changes, so the /stats/{match_id} response is
+assembled once after post-processing and stored compressed:
+
+    {"pk": "statsdoc", "sk": "1609817356", "data": <zlib json bytes>, "data_enc": "zlib"}
+
+The retriever returns the decompressed json as is and only assembles the
+response itself for matches that have no document.
+
+Backfill documents for matches processed before this existed:
+    python match_document.py backfill <match_id> [match_id ...]
+    python match_document.py backfill --days 30
+"""
+import json
+import logging
+import sys
+import time as _time
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from ddb_access import batch_get_items
+from match_shards import match_pk, is_match_pk, shards_between
+from postprocess_matchinfo import build_teams, build_new_match_summary, convert_stats_to_dict
+from data_codec import encode_data, decode_data, decode_data_text, fetch_data_parts
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("match_document")
+logger.setLevel(log_level)
+
+max_document_size = 350000  # bytes, stay clear of the 400 KB item limit
+
+
+def make_error_dict(message, item_info):
+    """Make an error message for API gateway."""
+    return {"error": message + " " + item_info}
+
+
+def get_document_keys(match_id):
+    """Items the /stats/{match_id} response is assembled from."""
+    return [
+        {"pk": "statsall", "sk": match_id},
+        {"pk": "wstatsall", "sk": match_id},
+        {"pk": match_pk(match_id), "sk": match_id + "1"},
+        {"pk": match_pk(match_id), "sk": match_id + "2"},
+        {"pk": "gamelogs", "sk": match_id + "1"},
+        {"pk": "gamelogs", "sk": match_id + "2"}
+    ]
+
+
+def build_match_document(match_id, items):
+    """Assemble the /stats/{match_id} response from raw items, same as retriever.handler."""
+    data = {}
+    match_dict = {}
+    gamelog_dict = {}
+    for response in items:
+        if response["pk"] == "statsall":
+            data["statsall"] = decode_data(response)
+            data["match_id"] = response["sk"]
+            data["type"] = response["gsi1pk"].replace("statsall#", "")
+        if response["pk"] == "wstatsall":
+            data["wstatsall"] = decode_data(response)
+        if is_match_pk(response["pk"]):
+            match_dict[response["sk"]] = json.loads(response["data"])
+        if response["pk"] == "gamelogs":
+            gamelog_dict[response["sk"]] = decode_data(response)
+
+    if "statsall" not in data:
+        return make_error_dict("[x] Missing statsall for match document", match_id)
+
+    new_total_stats = {}
+    new_total_stats[match_id] = convert_stats_to_dict(data["statsall"])
+
+    teamA, teamB, aliases, team_mapping, alias_team_str = build_teams(new_total_stats)
+    match_summary = build_new_match_summary(match_dict, team_mapping)
+    data["match_summary"] = match_summary
+    data["gamelog"] = gamelog_dict
+    return data
+
+
+def encode_document(document):
+    return encode_data(document, "zlib")
+
+
+def decode_document(document_item):
+    """Json text of a stored document."""
+    return decode_data_text(document_item)
+
+
+def save_match_document(ddb_table, match_id, items):
+    """Build, compress and store the document of a match. Returns a message."""
+    t1 = _time.time()
+    match_id = str(match_id)
+    document = build_match_document(match_id, items)
+    if "error" in document:
+        logger.warning(document["error"])
+        return document["error"]
+
+    encoded = encode_document(document)
+    if len(encoded["data"]) > max_document_size:
+        message = "Match document for " + match_id + " is too big (" + str(len(encoded["data"])) + " bytes), serving it the old way."
+        logger.warning(message)
+        return message
+
+    ddb_table.put_item(Item={
+        "pk": "statsdoc",
+        "sk": match_id,
+        **encoded
+    })
+    time_to_save = str(round((_time.time() - t1), 3))
+    message = f"Saved match document for {match_id} ({len(encoded['data'])} bytes) in {time_to_save} s"
+    logger.info(message)
+    return message
+
+
+def get_match_items(ddb_table, match_id):
+    """Batch get the raw items of one match and the parts of its split gamelogs."""
+    items = batch_get_items(ddb_table.name, get_document_keys(match_id))
+    fetch_data_parts(items, lambda keys: batch_get_items(ddb_table.name, keys))
+    return items
+
+
+def get_recent_match_ids(ddb_table, days):
+    """Match ids with a round 2 in the last days."""
+    skhigh = int(_time.time())
+    sklow = skhigh - 60 * 60 * 24 * int(days)
+    match_ids = []
+    for pk in shards_between(sklow, skhigh):
+        query_args = {
+            "KeyConditionExpression": Key("pk").eq(pk) & Key("sk").between(str(sklow), str(skhigh)),
+            "ProjectionExpression": "sk"
+        }
+        while True:
+            response = ddb_table.query(**query_args)
+            for item in response["Items"]:
+                if item["sk"].endswith("2"):
+                    match_ids.append(item["sk"][:-1])
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return match_ids
+
+
+def backfill(ddb_table, match_ids):
+    """Store documents for matches that do not have one yet."""
+    saved = 0
+    for match_id in match_ids:
+        response = ddb_table.get_item(Key={"pk": "statsdoc", "sk": match_id}, ProjectionExpression="pk")
+        if "Item" in response:
+            continue
+        try:
+            save_match_document(ddb_table, match_id, get_match_items(ddb_table, match_id))
+            saved += 1
+        except ClientError as err:
+            logger.error("Failed to backfill " + match_id + ": " + err.response['Error']['Message'])
+        except ValueError as err:
+            # gamelog parts that could not be read
+            logger.error("Failed to backfill " + match_id + ": " + str(err))
+    logger.info(f"Backfilled {saved} of {len(match_ids)} match documents")
+
+
+if __name__ == "__main__":
+    import boto3
+    TABLE_NAME = "rtcwprostats-database-DDBTable2F2A2F95-1BCIOU7IE3DSE"
+    if len(sys.argv) < 3 or sys.argv[1] != "backfill":
+        print(__doc__)
+        sys.exit(1)
+    table = boto3.resource('dynamodb').Table(TABLE_NAME)
+    if sys.argv[2] == "--days":
+        backfill(table, get_recent_match_ids(table, sys.argv[3]))
+    else:
+        backfill(table, sys.argv[2:])
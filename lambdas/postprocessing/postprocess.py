@@ -0,0 +1,106 @@
+import boto3
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# calculators live in their own lambda folders, this lambda is packaged from lambdas/postprocessing
+lambda_dir = os.path.dirname(os.path.abspath(__file__))
+for calculator_dir in ["elo", "summary", "gamelog"]:
+    sys.path.insert(0, os.path.join(lambda_dir, calculator_dir))
+
+from match_context import load_match_context
+from leaderboards import update_boards
+from match_document import save_match_document
+from elo_calc import process_rtcwpro_elo
+from summary_calc import process_rtcwpro_summary
+from gamelog_process.gamelog_calc import process_gamelog
+
+# for local testing use actual table
+# for lambda execution runtime use dynamic reference
+if __name__ == "__main__":
+    TABLE_NAME = "rtcwprostats-database-DDBTable2F2A2F95-1BCIOU7IE3DSE"
+    CUSTOM_BUS = "fake"
+else:
+    TABLE_NAME = os.environ['RTCWPROSTATS_TABLE_NAME']
+    CUSTOM_BUS = os.environ['RTCWPROSTATS_CUSTOM_BUS_ARN']
+
+# clients are thread safe, resources are not: every calculator gets its own table resource
+ddb_client = boto3.client('dynamodb')
+event_client = boto3.client('events')
+ddb_tables = {}
+for calculator in ["context", "elo", "summary", "gamelog", "leaderboards", "document"]:
+    ddb_tables[calculator] = boto3.session.Session().resource('dynamodb').Table(TABLE_NAME)
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('postprocess')
+logger.setLevel(log_level)
+
+
+def handler(event, context):
+    """Load a match once and run elo, summary and gamelog calculations on it."""
+    if __name__ == "__main__":
+        log_stream_name = "local"
+    else:
+        log_stream_name = context.log_stream_name
+
+    if not isinstance(event, int):
+        logger.warning("Received unexpected input for match_id " + str(event))
+        return {"error": "Exiting function due to bad input."}
+    else:
+        match_id = str(event)
+
+    logger.info("Processing match id " + match_id)
+
+    match_context = load_match_context(ddb_tables["context"], match_id, log_stream_name)
+    if "error" in match_context:
+        logger.error(match_context["error"])
+        raise Exception("Failed to load match context for " + match_id)
+
+    failures = run_calculators(match_id, match_context, log_stream_name)
+    if len(failures) > 0:
+        raise Exception("Post-processing failed for " + match_id + ": " + ", ".join(failures))
+
+    update_boards(ddb_tables["leaderboards"], match_context.get("leader_items", []))
+
+    try:
+        save_match_document(ddb_tables["document"], match_id, match_context["items"])
+    except Exception as ex:
+        # the retriever assembles matches without a document itself
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        logger.error("Failed to save match document for " + match_id + ".\n" + error_msg)
+
+    return {"matchid": int(match_id)}
+
+
+def run_calculators(match_id, match_context, log_stream_name):
+    """Run all calculators in threads and return names of the ones that raised."""
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {
+            "elo": executor.submit(process_rtcwpro_elo, ddb_tables["elo"], ddb_client, match_id,
+                                   log_stream_name, match_context),
+            "summary": executor.submit(process_rtcwpro_summary, ddb_tables["summary"], ddb_client, event_client,
+                                       match_id, log_stream_name, CUSTOM_BUS, match_context),
+            "gamelog": executor.submit(process_gamelog, ddb_tables["gamelog"], ddb_client, event_client,
+                                       int(match_id), log_stream_name, CUSTOM_BUS, match_context)
+        }
+
+    failures = []
+    for calculator, future in futures.items():
+        try:
+            message = future.result()
+        except Exception as ex:
+            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+            error_msg = template.format(type(ex).__name__, ex.args)
+            logger.error("Failed " + calculator + " for " + match_id + ".\n" + error_msg)
+            failures.append(calculator)
+        else:
+            logger.info(calculator + ": " + str(message))
+    return failures
+
+
+if __name__ == "__main__":
+    event = 1673935466
+    handler(event, None)
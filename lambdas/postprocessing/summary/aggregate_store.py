@@ -0,0 +1,290 @@
+"""
+Player aggregates kept as numeric counters.
+
+aggstats#<region#type> and aggwstats#<region#type> items carry one top level
+number per metric ("s#kills", "w#MP-40#hits") next to the usual data map.
+A match is added with a blind ADD update, so nothing is read first and two
+matches of the same player cannot overwrite each other.
+
+The data map and the kdr/accuracy sort keys (gsi1sk) that readers use are
+derived from the counters returned by the update and written in a follow-up
+that only applies if no newer match was added in between.
+
+killpeak does not add up, it sits in its own top level attribute that a
+conditional SET only ever raises, so concurrent matches cannot lower it.
+
+Items written before counters existed are seeded from their data map the
+first time a match is added to them.
+
+Write cost: the old path read each item in a batch get and wrote it back with
+one put. Now each aggstats and aggwstats item takes two updates (the ADD and
+the view) with no read, plus a third update on aggstats when the player beats
+their killpeak. Updates are billed on the larger of the old and new item and
+the counters roughly double the item. Measured on test/gamestats4 with
+python test/test_aggregate_store.py:
+
+    aggstats   0.44 KB -> 0.75 KB   1 WCU + 0.5 RCU -> 2 WCU (3 on a new peak)
+    aggwstats  0.70 KB -> 1.66 KB   1 WCU + 0.5 RCU -> 4 WCU
+
+so a player in a match costs 6 WCU instead of 2 WCU and 1 RCU. That buys
+lost-update free aggregates without a read before the write.
+"""
+import logging
+import time as _time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("aggregate_store")
+logger.setLevel(log_level)
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+max_workers = 8
+derived_stats = ["accuracy", "efficiency", "killpeak"]  # ratios and peaks do not add up
+acc_weapons = ['MP-40', 'Thompson', 'Sten', 'Colt', 'Luger']
+
+
+def add_match_aggregates(ddb_client, table_name, stats, wstats, match_region_type, real_names):
+    """Add one match to every player's aggregates and return the new stats and wstats like build_new_*_summary did."""
+    t1 = _time.time()
+    ts = datetime.now().isoformat()
+    updates = []
+    for guid, player_stats in stats.items():
+        updates.append((guid, "stats", stats_counters(player_stats["categories"]), player_stats["categories"].get("killpeak", 0)))
+    for guid, player_wstats in wstats.items():
+        updates.append((guid, "wstats", wstats_counters(player_wstats), 0))
+
+    stats_dict_updated = {}
+    wstats_dict_updated = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(add_player_aggregate, ddb_client, table_name, guid, stat_type, counters, killpeak,
+                                   match_region_type, real_names.get(guid, "no_name#"), ts)
+                   for guid, stat_type, counters, killpeak in updates]
+        for (guid, stat_type, counters, killpeak), future in zip(updates, futures):
+            view = future.result()
+            if stat_type == "stats":
+                stats_dict_updated[guid] = view
+            else:
+                wstats_dict_updated[guid] = view
+
+    time_to_add = str(round((_time.time() - t1), 3))
+    logger.info(f"Added {len(updates)} player aggregates in {time_to_add} s")
+    return stats_dict_updated, wstats_dict_updated
+
+
+def stats_counters(categories):
+    return {"s#" + metric: int(value) for metric, value in categories.items() if metric not in derived_stats}
+
+
+def wstats_counters(player_wstats):
+    counters = {}
+    for weapon, metrics in player_wstats.items():
+        for metric, value in metrics.items():
+            if metric != "weapon":
+                counters["w#" + weapon + "#" + metric] = int(value)
+        counters["w#" + weapon + "#games"] = 1
+    return counters
+
+
+def get_key(guid, stat_type, match_region_type):
+    sk = ("aggstats#" if stat_type == "stats" else "aggwstats#") + match_region_type
+    return {"pk": "player#" + guid, "sk": sk}
+
+
+def add_player_aggregate(ddb_client, table_name, guid, stat_type, counters, killpeak, match_region_type, real_name, ts):
+    """ADD counters to one item, then write its derived view. Returns the view."""
+    key = get_key(guid, stat_type, match_region_type)
+    gsi1pk = ("leaderkdr#" if stat_type == "stats" else "leaderacc#") + match_region_type
+    try:
+        item = add_counters(ddb_client, table_name, key, counters, gsi1pk, real_name, ts)
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Seeding counters for " + key["pk"] + ":" + key["sk"])
+        seed_counters(ddb_client, table_name, key)
+        item = add_counters(ddb_client, table_name, key, counters, gsi1pk, real_name, ts)
+
+    if stat_type == "stats":
+        item["killpeak"] = raise_killpeak(ddb_client, table_name, key, item, killpeak)
+        view = stats_view(item)
+        gsi1sk = kdr_sort_key(view)
+    else:
+        view = wstats_view(item)
+        gsi1sk = acc_sort_key(view)
+    write_view(ddb_client, table_name, key, view, gsi1sk, item["games"])
+    return view
+
+
+def add_counters(ddb_client, table_name, key, counters, gsi1pk, real_name, ts):
+    """Blind ADD of match counters. Fails on items that have a data map but no counters yet."""
+    names = {"#games": "games", "#counters": "counters", "#real_name": "real_name", "#updated": "updated", "#gsi1pk": "gsi1pk"}
+    values = {":one": 1, ":real_name": real_name, ":updated": ts, ":gsi1pk": gsi1pk}
+    add_actions = ["#games :one"]
+    for num, (counter, value) in enumerate(counters.items()):
+        names["#c" + str(num)] = counter
+        values[":c" + str(num)] = value
+        add_actions.append("#c" + str(num) + " :c" + str(num))
+
+    response = ddb_client.update_item(
+        TableName=table_name,
+        Key=serialize(key),
+        UpdateExpression="ADD " + ", ".join(add_actions) +
+                         " SET #counters = :one, #real_name = :real_name, #updated = :updated, #gsi1pk = :gsi1pk",
+        ConditionExpression="attribute_exists(#counters) OR attribute_not_exists(pk)",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=serialize(values),
+        ReturnValues="ALL_NEW")
+    return deserialize(response["Attributes"])
+
+
+def seed_counters(ddb_client, table_name, key):
+    """Turn the data map of an item written before counters into counters."""
+    response = ddb_client.get_item(TableName=table_name, Key=serialize(key), ConsistentRead=True)
+    item = deserialize(response.get("Item", {}))
+    data = item.get("data", {})
+    if key["sk"].startswith("aggstats#"):
+        counters = {"s#" + metric: int(value) for metric, value in data.items() if metric not in derived_stats + ["games"]}
+    else:
+        counters = {}
+        for weapon, metrics in data.items():
+            for metric, value in metrics.items():
+                counters["w#" + weapon + "#" + metric] = int(value)
+
+    names = {"#counters": "counters"}
+    values = {":one": 1}
+    set_actions = ["#counters = :one"]
+    for num, (counter, value) in enumerate(counters.items()):
+        names["#c" + str(num)] = counter
+        values[":c" + str(num)] = value
+        set_actions.append("#c" + str(num) + " = :c" + str(num))
+    try:
+        ddb_client.update_item(
+            TableName=table_name,
+            Key=serialize(key),
+            UpdateExpression="SET " + ", ".join(set_actions),
+            ConditionExpression="attribute_not_exists(#counters)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=serialize(values))
+    except ClientError as err:
+        # another match seeded it first
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def raise_killpeak(ddb_client, table_name, key, item, killpeak):
+    """SET the killpeak attribute if this match beat it. Returns the peak after the match."""
+    if "killpeak" in item:
+        if int(item["killpeak"]) >= int(killpeak):
+            return int(item["killpeak"])
+        peak = int(killpeak)
+    else:
+        # items from before the killpeak attribute keep their peak in the data map
+        peak = max(int(killpeak), int(item.get("data", {}).get("killpeak", 0)))
+    try:
+        ddb_client.update_item(
+            TableName=table_name,
+            Key=serialize(key),
+            UpdateExpression="SET #killpeak = :kp",
+            ConditionExpression="attribute_not_exists(#killpeak) OR #killpeak < :kp",
+            ExpressionAttributeNames={"#killpeak": "killpeak"},
+            ExpressionAttributeValues=serialize({":kp": peak}))
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # another match raised it higher in between
+        response = ddb_client.get_item(TableName=table_name, Key=serialize(key), ConsistentRead=True,
+                                       ProjectionExpression="#killpeak", ExpressionAttributeNames={"#killpeak": "killpeak"})
+        peak = int(deserialize(response.get("Item", {})).get("killpeak", peak))
+    return peak
+
+
+def write_view(ddb_client, table_name, key, view, gsi1sk, games):
+    """Write the derived data map unless a newer match already got added."""
+    try:
+        ddb_client.update_item(
+            TableName=table_name,
+            Key=serialize(key),
+            UpdateExpression="SET #data = :data, #gsi1sk = :gsi1sk",
+            ConditionExpression="#games = :games",
+            ExpressionAttributeNames={"#data": "data", "#gsi1sk": "gsi1sk", "#games": "games"},
+            ExpressionAttributeValues=serialize({":data": view, ":gsi1sk": gsi1sk, ":games": games}))
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Newer match will write the view of " + key["pk"] + ":" + key["sk"])
+
+
+def stats_view(item):
+    """Data map of an aggstats item computed from its counters."""
+    view = {}
+    for attribute, value in item.items():
+        if attribute.startswith("s#"):
+            view[attribute[2:]] = int(value)
+    view["games"] = int(item["games"])
+
+    shots = view.get("shots", 0) if view.get("shots", 0) > 0 else 1
+    view["accuracy"] = int(100 * view.get("hits", 0) / shots)
+    kills_and_deaths = view.get("kills", 0) + view.get("deaths", 0)
+    view["efficiency"] = 0 if kills_and_deaths == 0 else int(100 * view.get("kills", 0) / kills_and_deaths)
+    view["killpeak"] = int(item.get("killpeak", 0))
+    return view
+
+
+def wstats_view(item):
+    """Data map of an aggwstats item computed from its counters."""
+    view = {}
+    for attribute, value in item.items():
+        if attribute.startswith("w#"):
+            weapon, metric = attribute[2:].rsplit("#", 1)
+            view.setdefault(weapon, {})[metric] = int(value)
+    return view
+
+
+def get_leader_items(stats_dict_updated, wstats_dict_updated, match_region_type, real_names):
+    """leaderkdr and leaderacc lines of the updated aggregates, for leaderboards."""
+    ts = datetime.now().isoformat()
+    items = []
+    for guid, view in stats_dict_updated.items():
+        items.append({"pk": "player#" + guid, "gsi1pk": "leaderkdr#" + match_region_type, "gsi1sk": kdr_sort_key(view),
+                      "games": view["games"], "real_name": real_names.get(guid, "no_name#"), "updated": ts})
+    for guid, view in wstats_dict_updated.items():
+        games = stats_dict_updated.get(guid, {}).get("games", 0)
+        items.append({"pk": "player#" + guid, "gsi1pk": "leaderacc#" + match_region_type, "gsi1sk": acc_sort_key(view),
+                      "games": games, "real_name": real_names.get(guid, "no_name#"), "updated": ts})
+    return items
+
+
+def kdr_sort_key(stats_view):
+    return str(round(get_kdr(stats_view), 1)).zfill(3)
+
+
+def acc_sort_key(wstats_view):
+    return str(round(get_accuracy(wstats_view), 1)).zfill(4)
+
+
+def get_kdr(stats_view):
+    deaths = stats_view.get("deaths", 0) if stats_view.get("deaths", 0) > 0 else 1
+    return stats_view.get("kills", 0) / deaths
+
+
+def get_accuracy(wstats_view):
+    hits = shots = 0
+    for weapon, wstat in wstats_view.items():
+        if weapon in acc_weapons:
+            hits += wstat.get("hits", 0)
+            shots += wstat.get("shots", 0) if wstat.get("shots", 0) > 0 else 1
+    return round(hits / shots * 100, 1) if shots > 0 else 0.0
+
+
+def serialize(item):
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item):
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
@@ -0,0 +1,114 @@
+"""
+Move match rounds from the old single partition to monthly shards.
+
+read_match writes match and log items under pk "match#YYYYMM" (see
+match_shards in the ddb_access layer). This job copies every item still
+under pk "match" to its shard, gsi1pk included, one query page at a time.
+Puts are idempotent, so it can be stopped and run again.
+
+Rollout:
+    1. deploy, new rounds go to the shards from then on
+    2. python migrate_match_shards.py --table <table>
+       copies the old items and reports the oldest month found, which must
+       not be older than match_shards.first_month
+    3. python migrate_match_shards.py --table <table> --delete
+       copies again (rounds that were written during step 1) and deletes
+       the old items once their copies are written
+
+Local example against DynamoDB Local:
+    python migrate_match_shards.py --table rtcwprostats --endpoint-url http://localhost:8000 --dry-run
+"""
+import argparse
+import logging
+import time as _time
+from collections import Counter
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+import ddb_access
+from ddb_access import batch_write_items, batch_delete_items
+from match_shards import match_pk, legacy_pk, first_month
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger("migrate_match_shards")
+logger.setLevel(log_level)
+
+
+def get_match_id(sk):
+    """Match id of a match round (match_id + round) or log (log#match_id + round#file) sort key."""
+    if sk.startswith("log#"):
+        sk = sk.split("#")[1]
+    if not sk.isnumeric() or len(sk) < 2:
+        return None
+    return sk[0:-1]
+
+
+def shard_item(item):
+    """Copy of an old match item under its shard, None if its sort key has no match id."""
+    match_id = get_match_id(item["sk"])
+    if match_id is None:
+        return None
+    new_item = dict(item, pk=match_pk(match_id))
+    if item.get("gsi1pk") == legacy_pk:
+        new_item["gsi1pk"] = new_item["pk"]
+    return new_item
+
+
+def migrate(ddb_table, delete=False, dry_run=False):
+    """Copy (and delete) every item of the old partition. Returns the number of items per shard."""
+    t1 = _time.time()
+    shard_counts = Counter()
+    skipped = []
+    query_args = {"KeyConditionExpression": Key("pk").eq(legacy_pk)}
+    while True:
+        response = ddb_table.query(**query_args)
+        new_items = []
+        moved_keys = []
+        for item in response["Items"]:
+            new_item = shard_item(item)
+            if new_item is None:
+                skipped.append(item["sk"])
+                continue
+            new_items.append(new_item)
+            moved_keys.append({"pk": item["pk"], "sk": item["sk"]})
+            shard_counts[new_item["pk"]] += 1
+
+        if not dry_run and len(new_items) > 0:
+            batch_write_items(ddb_table.name, new_items)
+            if delete:
+                batch_delete_items(ddb_table.name, moved_keys)
+        logger.info(f"{sum(shard_counts.values())} items in {len(shard_counts)} shards so far")
+
+        if "LastEvaluatedKey" not in response:
+            break
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    time_to_migrate = str(round((_time.time() - t1), 3))
+    logger.info(f"Moved {sum(shard_counts.values())} items to {len(shard_counts)} shards in {time_to_migrate} s")
+    if len(skipped) > 0:
+        logger.warning(f"Left {len(skipped)} items without a match id in {legacy_pk}: " + ", ".join(skipped[0:20]))
+    if len(shard_counts) > 0:
+        oldest_month = min(shard_counts.keys()).split("#")[1]
+        logger.info("Oldest month: " + oldest_month)
+        if oldest_month < first_month:
+            logger.warning(f"Oldest month {oldest_month} is older than match_shards.first_month {first_month}, "
+                           "lists would not read it.")
+    return shard_counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move match rounds from pk match to monthly shards.")
+    parser.add_argument("--table", required=True, help="DynamoDB table name")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, ex. http://localhost:8000 for DynamoDB Local")
+    parser.add_argument("--delete", action="store_true", help="delete old items once their copies are written")
+    parser.add_argument("--dry-run", action="store_true", help="only count the items per shard")
+    args = parser.parse_args()
+    if args.endpoint_url:
+        ddb_access.set_client(boto3.client('dynamodb', endpoint_url=args.endpoint_url))
+
+    dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+    shard_counts = migrate(dynamodb.Table(args.table), args.delete, args.dry_run)
+    for shard, count in sorted(shard_counts.items()):
+        print(f"{shard}: {count}")
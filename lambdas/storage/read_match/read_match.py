@@ -6,13 +6,16 @@ import os
 import datetime
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
+from ddb_access import get_batch_items
+import ref_cache
+from match_shards import all_shards, query_shards
 from read_match_matchinfo import build_teams, convert_stats_to_dict, build_new_match_summary
 
 from reader_writeddb import (
     ddb_prepare_match_item,
     ddb_prepare_stats_items,
     ddb_prepare_statsall_item,
-    ddb_prepare_gamelog_item,
+    ddb_prepare_gamelog_items,
     ddb_prepare_wstat_items,
     ddb_prepare_wstatsall_item,
     ddb_prepare_log_item,
@@ -49,11 +52,12 @@ else:
     CUSTOM_BUS = os.environ['RTCWPROSTATS_CUSTOM_BUS_ARN']
 
 dynamodb = boto3.resource('dynamodb')
-ddb_client = boto3.client('dynamodb')
 event_client = boto3.client('events')
 
 
 table = dynamodb.Table(TABLE_NAME)
+server_cache = ref_cache.get_cache("servers")
+real_name_cache = ref_cache.get_cache("real_names")
 
 s3 = boto3.client('s3')
 sf_client = boto3.client('stepfunctions')
@@ -67,8 +71,66 @@ event_template = {
 
 
 def handler(event, context):
-    """Read new incoming json and submit it to the DB."""
-    s3_request_from_sqs = json.loads(event['Records'][0]["body"])
+    """Read a batch of new incoming json files and submit them to the DB.
+
+    Servers and real names are looked up once for the whole batch and the
+    items of all files are written together. Files that fail in a way a
+    retry can fix are reported in batchItemFailures, so SQS returns only
+    those to the queue (and eventually to the DLQ read by read_match_dlq).
+    """
+    t1 = _time.time()
+    failed_records = []
+    matches = []
+    for record in event['Records']:
+        try:
+            match = read_record(record)
+        except Exception as ex:
+            log_exception("Failed to read content of message " + record.get("messageId", ""), ex)
+            failed_records.append(record)
+            continue
+        if match is not None:
+            matches.append(match)
+
+    # round 2 goes after round 1 so its items win where both rounds share keys
+    matches.sort(key=lambda match: (match["gamestats"]["gameinfo"]["match_id"], match["gamestats"]["gameinfo"]["round"]))
+    servers = get_servers(matches)
+    real_names = get_real_names(matches)
+
+    prepared = []
+    new_servers = {}
+    for match in matches:
+        try:
+            prepare_match(match, servers, new_servers, real_names)
+        except Exception as ex:
+            log_exception("Failed to prepare items for " + match["file_key"], ex)
+            failed_records.append(match["record"])
+        else:
+            prepared.append(match)
+
+    written = write_matches(prepared)
+    announced_guids = set()
+    for match in prepared:
+        if match in written:
+            cache_new_items(match)
+            finish_match(match, real_names, announced_guids)
+        else:
+            failed_records.append(match["record"])
+
+    time_to_write = str(round((_time.time() - t1), 3))
+    logger.info(f"Processed {len(written)} of {len(event['Records'])} files in {time_to_write} s")
+    ref_cache.log_stats()
+    return {"batchItemFailures": [{"itemIdentifier": record.get("messageId", "")} for record in failed_records]}
+
+
+def log_exception(message, ex):
+    template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+    error_msg = template.format(type(ex).__name__, ex.args)
+    logger.error(message + "\n" + error_msg)
+
+
+def read_record(record):
+    """Get and check the file of one SQS record. None if there is nothing a retry could fix."""
+    s3_request_from_sqs = json.loads(record["body"])
     bucket_name = s3_request_from_sqs["Records"][0]['s3']['bucket']['name']
     file_key    = s3_request_from_sqs["Records"][0]['s3']['object']['key']
 
@@ -77,35 +139,80 @@ def handler(event, context):
     try:
         obj = s3.get_object(Bucket=bucket_name, Key=file_key)
     except s3.exceptions.ClientError as err:
-        if err.response['Error']['Code'] == 'EndpointConnectionError':
+        if err.response['Error']['Code'] == 'NoSuchKey':
+            logger.error("File was not found: " + file_key)
+            return None
+        elif err.response['Error']['Code'] == 'EndpointConnectionError':
             logger.error("Connection could not be established to AWS. Possible firewall or proxy issue. " + str(err))
         elif err.response['Error']['Code'] == 'ExpiredToken':
             logger.error("Credentials for AWS S3 are not valid. " + str(err))
         elif err.response['Error']['Code'] == 'AccessDenied':
             logger.error("Current credentials to not provide access to read the file. " + str(err))
-        elif err.response['Error']['Code'] == 'NoSuchKey':
-            logger.error("File was not found: " + file_key)
         else:
             logger.error("[x] Unexpected error: " + str(err))
+        raise
+
+    content = obj['Body'].read().decode('UTF-8')
+    gamestats = json.loads(content)
+    logger.debug("Number of keys in the file: " + str(len(gamestats.keys())))
+
+    integrity, message = integrity_checks(gamestats)
+    if not integrity:
+        logger.error("Failed integrity check of " + file_key + ":" + message)
         return None
 
-    message = "Nothing was processed"
+    return {"record": record, "file_key": file_key, "gamestats": gamestats}
+
+
+def get_servers(matches):
+    """Look up each server of the batch once, servers seen by this container come from its cache."""
+    servers = {}
+    for match in matches:
+        server_name = match["gamestats"]['serverinfo']['serverName']
+        if server_name not in servers:
+            servers[server_name] = server_cache.get(server_name, lambda name: ddb_get_server(name, table))
+    return servers
+
+
+def get_real_names(matches):
+    """Real names of every player of the batch."""
+    players = {}
+    for match in matches:
+        players.update(convert_stats_to_dict(match["gamestats"]["stats"]))
     try:
-        content = obj['Body'].read().decode('UTF-8')
-        gamestats = json.loads(content)
-        logger.debug("Number of keys in the file: " + str(len(gamestats.keys())))
+        return real_name_cache.get_many(list(players.keys()),
+                                        lambda guids: load_real_names(guids, str(len(matches)) + " files"))
     except Exception as ex:
-        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        error_msg = template.format(type(ex).__name__, ex.args)
-        # Todo expand these
-        message = "Failed to read content from " + file_key + "\n" + error_msg
-        logger.error(message)
-        raise
+        log_exception("Failed to get real names", ex)
+        return {}
 
-    integrity, message = integrity_checks(gamestats)
-    if not integrity:
-        logger.error("Failed integrity check:" + message)
-        return message
+
+def load_real_names(guids, log_info):
+    real_name_item_list = [{"pk": "player#" + guid, "sk": "realname"} for guid in guids]
+    real_names = {}
+    response = get_batch_items(real_name_item_list, table, "real_names for " + log_info, 'pk, sk, #data_value')
+    if "error" not in response:
+        for result in response:
+            guid = result["pk"].split("#")[1]
+            real_names[guid] = result["data"]
+    elif "Items do not exist" not in response["error"]:
+        raise Exception(response["error"])  # do not cache players as missing
+    return real_names
+
+
+def cache_new_items(match):
+    """Servers and players a written file created are no longer missing from the caches."""
+    for item in match["items"]:
+        if item["pk"] == "server":
+            server_cache.put(item["sk"], item)
+        elif item["sk"] == "realname":
+            real_name_cache.put(item["pk"].split("#")[1], item["data"])
+
+
+def prepare_match(match, servers, new_servers, real_names):
+    """Add everything needed to write one file to match."""
+    gamestats = match["gamestats"]
+    file_key = match["file_key"]
 
     date_time_human = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
@@ -115,7 +222,8 @@ def handler(event, context):
 
     gamestats["gameinfo"]["date_time_human"] = date_time_human
 
-    server = ddb_get_server(gamestats['serverinfo']['serverName'], table)
+    server_name = gamestats['serverinfo']['serverName']
+    server = servers.get(server_name)
     region = ""
     server_item = None
     if server:
@@ -125,8 +233,13 @@ def handler(event, context):
             logger.info("Skipped update_server_record due to dry run")
         else:
             ddb_update_server_record(gamestats, table, region, date_time_human)
+    elif server_name in new_servers:
+        # added by an earlier file of this batch
+        new_servers[server_name]["submissions"] += 1
+        region = new_servers[server_name]["region"]
     else:
         server_item = ddb_prepare_server_item(gamestats)
+        new_servers[server_name] = server_item
 
     if region == "":
         region = "unk"
@@ -184,16 +297,6 @@ def handler(event, context):
 
     submitter_ip = gamestats.get("submitter_ip", "no.ip.in.file")
 
-    stats = convert_stats_to_dict(gamestats["stats"])
-
-    real_name_item_list = prepare_playerinfo_list(stats, "realname")
-    response = get_batch_items(real_name_item_list, table, dynamodb, "real_names for match in file " + file_key)
-    real_names = {}
-    if "error" not in response:
-        for result in response:
-            guid = result["pk"].split("#")[1]
-            real_names[guid] = result["data"]
-
     items = []
     match_item = ddb_prepare_match_item(gamestats)
     tmp_stats_unnested = fix_stats_nesting(gamestats)
@@ -203,7 +306,7 @@ def handler(event, context):
 
     statsall_item = ddb_prepare_statsall_item(gamestats)
     
-    gamelog_item = ddb_prepare_gamelog_item(gamestats)
+    gamelog_items = ddb_prepare_gamelog_items(gamestats)
     wstats_items = ddb_prepare_wstat_items(gamestats)
     wstatsall_item = ddb_prepare_wstatsall_item(gamestats)
     aliasv2_items = ddb_prepare_alias_items_v2(gamestats, real_names)
@@ -212,7 +315,7 @@ def handler(event, context):
                                     len(match_item["data"]),
                                     len(stats_items),
                                     len(statsall_item["data"]),
-                                    len(gamelog_item["data"]),
+                                    sum([len(gamelog_item.get("data", "")) for gamelog_item in gamelog_items]),
                                     len(wstats_items),
                                     len(wstatsall_item["data"]),
                                     len(aliasv2_items),
@@ -222,7 +325,7 @@ def handler(event, context):
     items.append(match_item)
     items.extend(stats_items)
     items.append(statsall_item)
-    items.append(gamelog_item)
+    items.extend(gamelog_items)
     items.extend(wstats_items)
     items.append(wstatsall_item)
     items.extend(aliasv2_items)
@@ -231,28 +334,81 @@ def handler(event, context):
     if server_item:
         items.append(server_item)
 
-    total_items = str(len(items))
-    message = ""
-    
-    t1 = _time.time()
+    match.update({
+        "match_id": match_id,
+        "match_type": match_type,
+        "round2": round2,
+        "items": items,
+        "server_item": server_item,
+        "old_player_items": old_player_items,
+        "tmp_stats_unnested": tmp_stats_unnested,
+        "win_loss_dict": win_loss_dict
+    })
+
+
+def merge_items(matches):
+    """Items of all matches in order, a later item replaces an earlier one with the same key."""
+    merged = {}
+    for match in matches:
+        for item in match["items"]:
+            merged.pop((item["pk"], item["sk"]), None)
+            merged[(item["pk"], item["sk"])] = item
+    return list(merged.values())
+
+
+def write_matches(matches):
+    """Write the items of all matches in shared batches. Returns the matches that got written.
+
+    batch_write_item calls cannot hold the same key twice, so rounds of the
+    same match are merged first. If the shared write fails every match is
+    written on its own to find the ones that need a retry.
+    """
+    if len(matches) == 0:
+        return []
     if dry_run_batch_load:
         logger.info("Skipped ddb_batch_write due to dry run")
-    else:
+        return matches
+
+    items = merge_items(matches)
+    try:
+        ddb_batch_write(table.name, items)
+        logger.info(f"Sent {len(matches)} files to database with {len(items)} items.")
+        return matches
+    except Exception as ex:
+        log_exception("Failed to load all records for " + str(len(matches)) + " files, writing them one by one", ex)
+
+    written = []
+    for match in matches:
         try:
-            ddb_batch_write(ddb_client, table.name, items)
-            message = f"Sent {file_key} to database with {total_items} items. pk = match, sk = {match_id}"
+            ddb_batch_write(table.name, match["items"])
         except Exception as ex:
-            template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-            error_msg = template.format(type(ex).__name__, ex.args)
-            message = "Failed to load all records for a match " + file_key + "\n" + error_msg
-            logger.error(message)
-            return message
+            log_exception("Failed to load all records for a match " + match["file_key"], ex)
+        else:
+            logger.info(f"Sent {match['file_key']} to database with {len(match['items'])} items. pk = match, sk = {match['match_id']}")
+            written.append(match)
+    return written
+
+
+def finish_match(match, real_names, announced_guids):
+    """Update records and start post-processing of a match that is in the database.
+
+    Nothing here is retried: the match items are written and a second run
+    would add the same match to server, player and map records again.
+    """
+    gamestats = match["gamestats"]
+    match_id = match["match_id"]
+    message = f"Sent {match['file_key']} to database. pk = match, sk = {match_id}"
+    timings = []
 
     if dry_run_user_records:
         logger.info("Skipped user_records due to dry run")
     else:
         try:
-            ddb_update_user_records(old_player_items, table)
+            t1 = _time.time()
+            failed = ddb_update_user_records(match["old_player_items"], table)
+            timings.append(f"{len(match['old_player_items'])} player dates in {round(_time.time() - t1, 3)} s")
+            if len(failed) > 0:
+                logger.warning(f"Failed to update {len(failed)} player dates for {match_id}: " + str(failed))
             logger.info(f"Updated player dates for {match_id}")  
         except Exception as ex:
             template = "An exception of type {0} occurred. Arguments:\n{1!r}"
@@ -263,9 +419,13 @@ def handler(event, context):
     if dry_run_map_records:
         logger.info("Skipped map_records due to dry run")
     else:
-        if round2: 
+        if match["round2"]: 
             try:
-                ddb_update_map_records(gamestats, tmp_stats_unnested, real_names, win_loss_dict, table)
+                t1 = _time.time()
+                failed = ddb_update_map_records(gamestats, match["tmp_stats_unnested"], real_names, match["win_loss_dict"], table)
+                timings.append(f"{len(match['tmp_stats_unnested'])} map records in {round(_time.time() - t1, 3)} s")
+                if len(failed) > 0:
+                    logger.warning(f"Failed to update {len(failed)} map records for {match_id}: " + str(failed))
                 logger.info(f"Added mapstats for {match_id}")
             except Exception as ex:
                 template = "An exception of type {0} occurred. Arguments:\n{1!r}"
@@ -273,6 +433,9 @@ def handler(event, context):
                 message = "Failed to update map records for a match " + match_id + "\n" + error_msg
                 logger.warning(message)
 
+    if len(timings) > 0:
+        logger.info(f"Record updates for {match['file_key']}: " + ", ".join(timings))
+
     if dry_run_step_functions:
         logger.info("Skipped step functions due to dry run")
     else:
@@ -300,11 +463,12 @@ def handler(event, context):
     else:
         try:
             events = []
-            new_player_events = announce_new_players(gamestats, real_names, match_type)
-            new_server_events = announce_new_server(server_item)
+            new_player_events = announce_new_players(gamestats, real_names, match["match_type"], announced_guids)
+            new_server_events = announce_new_server(match["server_item"])
             events.extend(new_player_events)
             events.extend(new_server_events)
 
+            response = None
             if len(events) > 0:
                 response = event_client.put_events(Entries=events)
         except Exception as ex:
@@ -313,7 +477,9 @@ def handler(event, context):
             message = "Failed to announce new players via event bridge in " + match_id + "\n" + error_msg
             logger.error(message)
         else:
-            if response and response['ResponseMetadata']['HTTPStatusCode'] == 200:
+            if response is None:
+                pass
+            elif response['ResponseMetadata']['HTTPStatusCode'] == 200:
                 logger.info("Submitted new player event(s)")
             else:
                 logger.warning("Bad response from event bridge " + str(response))
@@ -321,18 +487,17 @@ def handler(event, context):
                 logger.error(message)
 
         logger.info(message)
-        time_to_write = str(round((_time.time() - t1), 3))
-        logger.info(f"Time to write {total_items} items is {time_to_write} s")
         
     return message
 
 
-def announce_new_players(gamestats, real_names, match_type):
-    """Put event about new players for discord announcement."""
+def announce_new_players(gamestats, real_names, match_type, announced_guids):
+    """Put event about new players for discord announcement, once per batch."""
     events = []
     for player_wrapper in gamestats["stats"]:
         for playerguid, stat in player_wrapper.items():
-            if playerguid not in real_names:
+            if playerguid not in real_names and playerguid not in announced_guids:
+                announced_guids.add(playerguid)
                 logger.info("New guid event: " + playerguid + " as " + stat["alias"])
                 tmp_event = event_template.copy()
                 tmp_event["Detail"] = json.dumps({"notification_type": "new player",
@@ -357,29 +522,6 @@ def announce_new_server(server_item):
     return events
 
 
-def prepare_playerinfo_list(stats, sk):
-    """Make a list of guids to retrieve from ddb."""
-    item_list = []
-    for guid, player_stats in stats.items():
-        item_list.append({"pk": "player#" + guid, "sk": sk})
-    return item_list
-
-
-def get_batch_items(item_list, ddb_table, dynamodb, log_stream_name):
-    """Get items in a batch."""
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={ddb_table.name: {'Keys': item_list, 'ProjectionExpression': 'pk, sk, #data_value', 'ExpressionAttributeNames': {'#data_value': 'data'}}})
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            logger.warning("Items do not exist" + item_info)
-    return result
-
-
 def integrity_checks(gamestats):
     """Check if gamestats valid for any known things."""
     message = "Started integrity checks"
@@ -470,24 +612,26 @@ def make_win_loss_dict(match_id, tmp_stats_unnested, match_summary, teamA, teamB
             
 
 def test_get_log_records(num_of_files, more_recent_sk):
-    """Test function to retrieve DynamoDB records with pk='match' and sk beginning with specified prefix."""
+    """Test function to retrieve log records of the match shards with sk between two log# keys."""
     try:
         # Create range for between operation - from prefix to next lexicographic value
         start_key = 'log#00000000000#intake/20250516-005744-1747356459.txt'
         # Increment the last character to create upper bound
         end_key = more_recent_sk
         
-        # Query DynamoDB for records with pk="match" and sk between the range
-        response = table.query(
-            KeyConditionExpression=Key('pk').eq('match') & Key('sk').between(start_key, end_key),
-            ProjectionExpression='sk',
-            Limit=num_of_files,
-            ScanIndexForward=False  # Get most recent records first
-        )
-        
+        # Query every match shard for log records with sk between the range
+        def query_shard(pk):
+            response = table.query(
+                KeyConditionExpression=Key('pk').eq(pk) & Key('sk').between(start_key, end_key),
+                ProjectionExpression='sk',
+                Limit=num_of_files,
+                ScanIndexForward=False  # Get most recent records first
+            )
+            return response.get('Items', [])
+
         # Extract sk values into test_files array
         test_files = []
-        for item in response.get('Items', []):
+        for item in query_shards(all_shards(), query_shard, "sk", limit=num_of_files):
             test_files.append(item["sk"].split("#")[2])
         
         logger.info(f"Retrieved {len(test_files)} records")        
@@ -1,18 +1,21 @@
-import boto3
 import logging
 import json
-import time
 from datetime import datetime
 import botocore
 from botocore.exceptions import ClientError
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from reader_country_detector import guess_server_country
+from data_codec import encode_data, encode_data_parts
+from ddb_access import batch_write_items
+from match_shards import match_pk
 
-ddb_client = boto3.client('dynamodb')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)  # set to DEBUG for verbose boto output
 logging.basicConfig(level = logging.INFO)
 
+update_workers = 8  # concurrent UpdateItem calls for player and map records
+
 def ddb_get_item(pk, sk, table):
     result = None
     try:
@@ -50,14 +53,18 @@ def ddb_get_server(sk, table):
     return result
 
 def ddb_update_item(key, expression, values, table):
+    """Update one item. Returns False if the update failed."""
+    # the resource client is thread safe and (de)serializes dynamodb types on its own
+    client = table.meta.client
     try:
         if '#data_value' in expression:
-            response = table.update_item(Key=key, UpdateExpression=expression,ExpressionAttributeValues=values, ExpressionAttributeNames={"#data_value": "data"})
+            response = client.update_item(TableName=table.name, Key=key, UpdateExpression=expression,ExpressionAttributeValues=values, ExpressionAttributeNames={"#data_value": "data"})
         else:
-            response = table.update_item(Key=key, UpdateExpression=expression, ExpressionAttributeValues=values)
+            response = client.update_item(TableName=table.name, Key=key, UpdateExpression=expression, ExpressionAttributeValues=values)
     except botocore.exceptions.ClientError as err:
         logger.error(err.response['Error']['Message'])
         logger.error("Item was: " + str(key))
+        return False
         #raise
     else:
         http_code = "No http code"
@@ -70,6 +77,29 @@ def ddb_update_item(key, expression, values, table):
 
         if http_code != 200:
             logger.error(f"Erroneous HTTP Code ({http_code}) while updating an item \n" + str(key) + "\n" + str(response))
+            return False
+    return True
+
+
+def ddb_update_items(updates, table):
+    """Run (key, expression, values) updates concurrently. Returns the keys of failed updates.
+
+    Each update stands on its own, a failed one does not undo or stop the rest.
+    """
+    if len(updates) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(update_workers, len(updates))) as executor:
+        futures = [executor.submit(ddb_update_item, key, expression, values, table) for key, expression, values in updates]
+        failed = []
+        for (key, expression, values), future in zip(updates, futures):
+            try:
+                if not future.result():
+                    failed.append(key)
+            except Exception as ex:
+                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+                logger.error(template.format(type(ex).__name__, ex.args) + "\nItem was: " + str(key))
+                failed.append(key)
+    return failed
 
 def ddb_update_server_record(gamestats, table, region, date_time_human):
     key = {
@@ -81,7 +111,9 @@ def ddb_update_server_record(gamestats, table, region, date_time_human):
     ddb_update_item(key, expression, values, table)
 
 def ddb_update_user_records(guids, table):
+    """Stamp returning players. Returns the keys that failed to update."""
     ts = datetime.now().isoformat()
+    updates = []
     for guid in guids:
         key = {
             'pk'    : "player#" + guid,
@@ -89,10 +121,11 @@ def ddb_update_user_records(guids, table):
             }
         expression = 'SET updated = :val1'
         values = {':val1': ts}
-        ddb_update_item(key, expression, values, table)
+        updates.append((key, expression, values))
+    return ddb_update_items(updates, table)
 
 def ddb_update_map_records(gamestats, tmp_stats_unnested, real_names, win_loss_dict, table):
-    """Update map statistics for each player."""
+    """Update map statistics for each player. Returns the keys that failed to update."""
     match_type = gamestats.get("match_type", "unk#unk")
     map_name = gamestats.get("gameinfo", {}).get("map", "unknown")
     
@@ -104,6 +137,7 @@ def ddb_update_map_records(gamestats, tmp_stats_unnested, real_names, win_loss_d
     duration_r2 = round_end - round_start if round_end > round_start else 0
     duration = duration_r1 + duration_r2
     
+    updates = []
     for player_item in tmp_stats_unnested:
         for player_guid, stat in player_item.items():
             real_name = real_names.get(player_guid, stat.get("alias", "unknown"))
@@ -140,7 +174,8 @@ def ddb_update_map_records(gamestats, tmp_stats_unnested, real_names, win_loss_d
                 ':gsi1sk': f"{match_type}#all"
             }
             
-            ddb_update_item(key, expression, values, table)
+            updates.append((key, expression, values))
+    return ddb_update_items(updates, table)
 
 def ddb_prepare_server_item(gamestats):
 
@@ -187,10 +222,10 @@ def ddb_put_item(Item, table):
 def ddb_prepare_match_item(gamestats):
     inject_json_version(gamestats["gameinfo"], gamestats)
     match_item = {
-        'pk'    : 'match',
+        'pk'    : match_pk(gamestats["gameinfo"]["match_id"]),
         'sk'    : gamestats["gameinfo"]["match_id"] + gamestats["gameinfo"]["round"],
         'lsipk' : gamestats["match_type"] + "#" + gamestats["gameinfo"]["match_id"] + gamestats["gameinfo"]["round"],
-        'gsi1pk': "match",
+        'gsi1pk': match_pk(gamestats["gameinfo"]["match_id"]),
         'gsi1sk': gamestats['serverinfo']['serverName'] + "#" + gamestats["gameinfo"]["match_id"] + gamestats["gameinfo"]["round"],
         'data'  : json.dumps(gamestats["gameinfo"])
         }
@@ -234,17 +269,36 @@ def ddb_prepare_statsall_item(gamestats):
         'sk'    : gamestats["gameinfo"]["match_id"],
         'gsi1pk': "statsall#" + gamestats["match_type"],
         'gsi1sk': gamestats["gameinfo"]["match_id"],
-        'data'  : json.dumps(gamestats["stats"])
+        **encode_data(gamestats["stats"])
         }
     return statsall_item
 
-def ddb_prepare_gamelog_item(gamestats):
-    gamelog_item = {
-        'pk'    : 'gamelogs',
-        'sk'    : gamestats["gameinfo"]["match_id"] + gamestats["gameinfo"]["round"],
-        'data'  : json.dumps(gamestats["gamelog"])
-        }
-    return gamelog_item
+def ddb_prepare_gamelog_items(gamestats):
+    """Gamelog of a round, split in ordered parts when it does not fit in one item."""
+    match_round_id = gamestats["gameinfo"]["match_id"] + gamestats["gameinfo"]["round"]
+    parts = encode_data_parts(gamestats["gamelog"])
+    if len(parts) == 1:
+        return [{
+            'pk'    : 'gamelogs',
+            'sk'    : match_round_id,
+            **parts[0]
+            }]
+
+    logger.info("Splitting gamelog of " + match_round_id + " in " + str(len(parts)) + " parts")
+    gamelog_items = []
+    for num, part in enumerate(parts, 1):
+        gamelog_items.append({
+            'pk'    : 'gamelogs',
+            'sk'    : match_round_id + "#part" + str(num),
+            **part
+            })
+    # written last so readers never see it without its parts
+    gamelog_items.append({
+        'pk'        : 'gamelogs',
+        'sk'        : match_round_id,
+        'data_parts': len(parts)
+        })
+    return gamelog_items
 
 def ddb_prepare_wstat_items_obsolete(gamestats):
     player_guids = Counter()
@@ -290,7 +344,7 @@ def ddb_prepare_wstatsall_item(gamestats):
     wstatsall_item ={
             'pk'    : "wstatsall",
             'sk'    : gamestats["gameinfo"]["match_id"],
-            'data'  : json.dumps(gamestats['wstats']),
+            **encode_data(gamestats['wstats']),
             'ExpirationTime': int(matchid) + 60 * 60 * 24 * 90  # expire after 3 months
         }
     return wstatsall_item
@@ -354,7 +408,7 @@ def ddb_prepare_log_item(match_id_rnd,file_key,
                          #timestamp,
                          submitter_ip):
     log_item ={
-            'pk'            : "match",
+            'pk'            : match_pk(match_id_rnd[0:-1]),
             'sk'            : "log#" + match_id_rnd + "#" + file_key,
             'lsipk'         : "log#" + file_key + "#" + match_id_rnd,
             'match_size'    : match_item_size,
@@ -370,78 +424,22 @@ def ddb_prepare_log_item(match_id_rnd,file_key,
     return log_item
 
 
-def create_batch_write_structure(table_name, items, start_num, batch_size):
-    """
-    Create item structure for passing to batch_write_item
-    :param table_name: DynamoDB table name
-    :param items: large collection of items
-    :param start_num: Start index
-    :param num_items: Number of items
-    :return: dictionary of tables to write to
-    """
+def ddb_batch_write(table_name, items):
+    """Write items in parallel batches, heads of split items after their parts.
 
-    serializer = boto3.dynamodb.types.TypeSerializer()
-    item_batch = { table_name: []}
-    item_batch_list = items[start_num : start_num + batch_size]
-    if len(item_batch_list) < 1:
-        return None
-    for item in item_batch_list:
-        item_serialized = {k: serializer.serialize(v) for k,v in item.items()}
-        item_batch[table_name].append({'PutRequest': {'Item': item_serialized}})
-
-    return item_batch
-    
+    A head without its parts would read as a broken item.
+    Returns the write stats of ddb_access.batch_write_items.
+    """
+    heads = [item for item in items if "data_parts" in item]
+    write_stats = batch_write_items(table_name, [item for item in items if "data_parts" not in item])
+    if len(heads) > 0:
+        head_stats = batch_write_items(table_name, heads)
+        for key in ["items", "batches", "retries", "throttles", "seconds"]:
+            write_stats[key] += head_stats[key]
+        if write_stats["seconds"] > 0:
+            write_stats["items_per_second"] = round(write_stats["items"] / write_stats["seconds"], 1)
+    return write_stats
 
-def ddb_batch_write(client, table_name, items):
-        message = ""
-        num_items = len(items)
-        logger.info(f'Performing ddb_batch_write to dynamo with {num_items} items.')
-        start = 0
-        batch_size = 25
-        while True:
-            # Loop adding 25 items to dynamo at a time
-            request_items = create_batch_write_structure(table_name,items, start, batch_size)
-            if not request_items:
-                break
-            try:
-                response = client.batch_write_item(RequestItems=request_items)
-            except botocore.exceptions.ClientError as err:
-                logger.error(err.response['Error']['Message'])
-                logger.error("Failed to run full batch_write_item")
-                raise
-            if len(response['UnprocessedItems']) == 0:
-                logger.info(f'Wrote a batch of about {batch_size} items to dynamo')
-            else:
-                # Hit the provisioned write limit
-                logger.warning('Hit write limit, backing off then retrying')
-                sleep_time = 5 #seconds
-                logger.warning(f"Sleeping for {sleep_time} seconds")
-                time.sleep(sleep_time)
-
-                # Items left over that haven't been inserted
-                unprocessed_items = response['UnprocessedItems']
-                logger.warning('Resubmitting items')
-                # Loop until unprocessed items are written
-                while len(unprocessed_items) > 0:
-                    response = client.batch_write_item(RequestItems=unprocessed_items)
-                    # If any items are still left over, add them to the
-                    # list to be written
-                    unprocessed_items = response['UnprocessedItems']
-
-                    # If there are items left over, we could do with
-                    # sleeping some more
-                    if len(unprocessed_items) > 0:
-                        sleep_time = 5 #seconds
-                        logger.warning(f"Sleeping for {sleep_time} seconds")
-                        time.sleep(sleep_time)
-
-                # Inserted all the unprocessed items, exit loop
-                logger.warning('Unprocessed items successfully inserted')
-                break
-            if response["ResponseMetadata"]['HTTPStatusCode'] != 200:
-                message += f"\nBatch {start} returned non 200 code"
-                logger.warning(message)
-            start += 25
 
 def inject_json_version(obj, gamestats):
     if isinstance(obj, list):
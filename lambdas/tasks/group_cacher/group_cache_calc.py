@@ -1,12 +1,14 @@
 import logging
 from botocore.exceptions import ClientError
 import json
-import boto3
 import time as _time
 from boto3.dynamodb.conditions import Key
-import math
 
 from group_cache_matchinfo import build_teams, build_new_match_summary, convert_stats_to_dict
+from data_codec import decode_data
+import ddb_access
+from ddb_access import batch_write_items
+from match_shards import match_pk, is_match_pk
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
@@ -40,11 +42,11 @@ def process_rtcwpro_summary(ddb_table, ddb_client, group_name, log_stream_name):
     if "error" not in responses and len(responses) > 0:
         for response in responses:
             if response["pk"] == "wstatsall":
-                wstats_dict[response["sk"]] = json.loads(response["data"])
+                wstats_dict[response["sk"]] = decode_data(response)
             if response["pk"] == "statsall":
                 match_region_type = response["gsi1pk"].replace("statsall#", "")
-                stats_dict[response["sk"]] = json.loads(response["data"])
-            if response["pk"] == "match":
+                stats_dict[response["sk"]] = decode_data(response)
+            if is_match_pk(response["pk"]):
                 match_dict[response["sk"]] = json.loads(response["data"])
         logger.info("Got basic stats for number of items: " + str(len(responses)))
     else:
@@ -102,7 +104,7 @@ def process_rtcwpro_summary(ddb_table, ddb_client, group_name, log_stream_name):
     items.append(group_item)
 
     try:
-        ddb_batch_write(ddb_client, ddb_table.name, items)
+        batch_write_items(ddb_table.name, items)
     except Exception as ex:
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
         error_msg = template.format(type(ex).__name__, ex.args)
@@ -118,28 +120,11 @@ def process_rtcwpro_summary(ddb_table, ddb_client, group_name, log_stream_name):
 
 
 def get_big_batch_items(big_item_list, ddb_table, log_stream_name):
-    """Get over 100 batch items."""
-
-    num_items = len(big_item_list)
-
-    start = 0
-    batch_size = 100
-
-    batches = math.ceil(num_items / batch_size)
-    logger.info(f'Performing get_batch_items from dynamo with {num_items} items in {batches} batches.')
-
-    item_list_list = []
-    for i in range(1, batches + 1):
-        item_list_list.append(big_item_list[start: start + batch_size])
-        start += batch_size
-
-    big_response = []
-    for item_list in item_list_list:
-        response = get_batch_items(item_list, ddb_table, log_stream_name)
-        if "error" not in response:
-            big_response.extend(response)
-
-    return big_response
+    """Get over 100 batch items, leaving out the ones that do not exist."""
+    response = get_batch_items(big_item_list, ddb_table, log_stream_name)
+    if "error" in response:
+        return []
+    return response
 
 
 def derive_classes(stats_dict_updated, wstats_dict_updated):
@@ -342,22 +327,7 @@ def make_error_dict(message, item_info):
 
 def get_batch_items(item_list, ddb_table, log_stream_name):
     """Get items in a batch."""
-    dynamodb = boto3.resource('dynamodb')
-    item_info = "get_batch_items. Logstream: " + log_stream_name
-    try:
-        response = dynamodb.batch_get_item(RequestItems={
-            ddb_table.name: {'Keys': item_list, 'ProjectionExpression': 'pk, sk, #data_value, gsi1pk, real_name',
-                             'ExpressionAttributeNames': {'#data_value': 'data'}}},
-                                           ReturnConsumedCapacity='NONE')  # 10 RCU
-    except ClientError as e:
-        logger.warning("Exception occurred: " + e.response['Error']['Message'])
-        result = make_error_dict("[x] Client error calling database: ", item_info)
-    else:
-        if len(response["Responses"][ddb_table.name]) > 0:
-            result = response["Responses"][ddb_table.name]
-        else:
-            result = make_error_dict("[x] Items do not exist: ", item_info)
-    return result
+    return ddb_access.get_batch_items(item_list, ddb_table, log_stream_name, 'pk, sk, #data_value, data_enc, gsi1pk, real_name')
 
 
 def ddb_prepare_stat_item(stat_type, stats, match_region_type, group_name):
@@ -381,34 +351,12 @@ def ddb_prepare_group_item(group_response, alias_team_str, match_summary):
     return item
 
 
-def create_batch_write_structure(table_name, items, start_num, batch_size):
-    """
-    Create item structure for passing to batch_write_item
-    :param table_name: DynamoDB table name
-    :param items: large collection of items
-    :param start_num: Start index
-    :param num_items: Number of items
-    :return: dictionary of tables to write to
-    """
-
-    serializer = boto3.dynamodb.types.TypeSerializer()
-    item_batch = {table_name: []}
-    item_batch_list = items[start_num: start_num + batch_size]
-    if len(item_batch_list) < 1:
-        return None
-    for item in item_batch_list:
-        item_serialized = {k: serializer.serialize(v) for k, v in item.items()}
-        item_batch[table_name].append({'PutRequest': {'Item': item_serialized}})
-
-    return item_batch
-
-
 def prepare_matches_item_list(matches):
     """Make a list of matches to retrieve from ddb."""
     item_list = []
     for match in matches:
-        item_list.append({"pk": "match", "sk": str(match) + "1"})
-        item_list.append({"pk": "match", "sk": str(match) + "2"})
+        item_list.append({"pk": match_pk(match), "sk": str(match) + "1"})
+        item_list.append({"pk": match_pk(match), "sk": str(match) + "2"})
     return item_list
 
 
@@ -432,61 +380,6 @@ def prepare_elo_item_list(new_total_stats, match_region_type):
     return item_list
 
 
-def ddb_batch_write(client, table_name, items):
-    messages = ""
-    num_items = len(items)
-    logger.info(f'Performing ddb_batch_write to dynamo with {num_items} items.')
-    start = 0
-    batch_size = 25
-    while True:
-        # Loop adding 25 items to dynamo at a time
-        request_items = create_batch_write_structure(table_name, items, start, batch_size)
-        if not request_items:
-            break
-        try:
-            response = client.batch_write_item(RequestItems=request_items)
-        except ClientError as err:
-            logger.error(err.response['Error']['Message'])
-            logger.error("Failed to run full batch_write_item")
-            raise
-        if len(response['UnprocessedItems']) == 0:
-            logger.info(f'Wrote a batch of about {batch_size} items to dynamo')
-        else:
-            # Hit the provisioned write limit
-            logger.warning('Hit write limit, backing off then retrying')
-            sleep_time = 5  # seconds
-            logger.warning(f"Sleeping for {sleep_time} seconds")
-            _time.sleep(sleep_time)
-
-            # Items left over that haven't been inserted
-            unprocessed_items = response['UnprocessedItems']
-            logger.warning('Resubmitting items')
-            # Loop until unprocessed items are written
-            while len(unprocessed_items) > 0:
-                response = client.batch_write_item(RequestItems=unprocessed_items)
-                # If any items are still left over, add them to the
-                # list to be written
-                unprocessed_items = response['UnprocessedItems']
-
-                # If there are items left over, we could do with
-                # sleeping some more
-                if len(unprocessed_items) > 0:
-                    sleep_time = 5  # seconds
-                    logger.warning(f"Sleeping for {sleep_time} seconds")
-                    _time.sleep(sleep_time)
-
-            # Inserted all the unprocessed items, exit loop
-            logger.warning('Unprocessed items successfully inserted')
-            break
-        if response["ResponseMetadata"]['HTTPStatusCode'] != 200:
-            messages += f"\nBatch {start} returned non 200 code"
-        start += 25
-
-
-# print(matchinfo["match_id"].ljust(12) + matchinfo["round"].ljust(2) + matchinfo["map"].ljust(20) + matchinfo["winner"].ljust(10))
-
-
-# not used
 def get_elo_progress(ddb_table, match_id, log_stream_name):
     """Get several items by pk and range of sk."""
     item_info = "pk: eloprogressmatch, sk: " + match_id + ". Logstream: " + log_stream_name
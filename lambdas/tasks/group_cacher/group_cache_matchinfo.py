@@ -1,4 +1,4 @@
-"""ANYTHING IN THIS FILE WILL BE SHARED WITH RETRIEVER.PY"""
+"""ANYTHING IN THIS FILE WILL BE SHARED WITH RETRIEVER.PY AND POSTPROCESS_MATCHINFO.PY"""
 
 import logging
 log_level = logging.INFO
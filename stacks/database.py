@@ -1,6 +1,8 @@
-from aws_cdk import Stack, Duration, RemovalPolicy
+from aws_cdk import Stack, Duration, RemovalPolicy, BundlingOptions
 from constructs import Construct
 
+import aws_cdk.aws_lambda as _lambda
+
 from aws_cdk.aws_dynamodb import (
     Table,
     Attribute,
@@ -54,4 +56,28 @@ class DatabaseStack(Stack):
             # projection_type = ProjectionType.ALL
         )
 
+        # batch reads and writes shared by every lambda using the table
+        ddb_access_layer = _lambda.LayerVersion(
+            self, 'DDBAccessLayer',
+            code=_lambda.Code.from_asset('lambdas/layers/ddb_access'),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_8, _lambda.Runtime.PYTHON_3_9],
+            description="ddb_access.py batch get and write helpers"
+        )
+
+        # vectorized awards and elo, see gamelog_process/gamelog_columns.py and elo_calc.py
+        numpy_layer = _lambda.LayerVersion(
+            self, 'NumpyLayer',
+            code=_lambda.Code.from_asset(
+                'lambdas/layers/numpy',
+                bundling=BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_8.bundling_image,
+                    command=["bash", "-c", "pip install -r requirements.txt -t /asset-output/python"]
+                )
+            ),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_8],
+            description="numpy for the gamelog award columns and vectorized elo"
+        )
+
         self.ddb_table = ddb_table
+        self.ddb_access_layer = ddb_access_layer
+        self.numpy_layer = numpy_layer
@@ -3,6 +3,7 @@ from constructs import Construct
 
 import aws_cdk.aws_lambda as _lambda
 import aws_cdk.aws_iam as iam
+import aws_cdk.aws_secretsmanager as secretsmanager
 
 
 from aws_cdk.aws_dynamodb import Table
@@ -11,7 +12,8 @@ from aws_cdk.aws_dynamodb import Table
 class DeliveryRetrieverStack(Stack):
     """Public API for retrieving match and player data."""
 
-    def __init__(self, scope: Construct, id: str, ddb_table: Table, lambda_tracing, **kwargs) -> None:
+    def __init__(self, scope: Construct, id: str, ddb_table: Table, ddb_access_layer: _lambda.ILayerVersion,
+                 lambda_tracing, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
         retriever_role = iam.Role(self, "RtcwproRetriever",
@@ -33,6 +35,13 @@ class DeliveryRetrieverStack(Stack):
             ],
         ))
 
+        # signs the ?cursor= and ?since= tokens of the retriever, see get_cursor_key
+        cursor_secret = secretsmanager.Secret(self, "RetrieverCursorKey",
+                                              description="rtcwpro-retriever pagination cursor signing key",
+                                              generate_secret_string=secretsmanager.SecretStringGenerator(
+                                                  password_length=64,
+                                                  exclude_punctuation=True))
+
         retriever = _lambda.Function(
             self, 'retriever',
             function_name='rtcwpro-retriever',
@@ -40,11 +49,15 @@ class DeliveryRetrieverStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_8,
             code=_lambda.Code.from_asset('lambdas/delivery/retriever'),
             role=retriever_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             environment={
                 'RTCWPROSTATS_TABLE_NAME': ddb_table.table_name,
+                'RTCWPROSTATS_SHARED_CACHE': 'table',  # remove to turn the shared response cache off
+                'RTCWPROSTATS_CURSOR_SECRET_ARN': cursor_secret.secret_arn,
             }
         )
+        cursor_secret.grant_read(retriever)
 
         server_query = _lambda.Function(
             self, 'server_query',
@@ -53,6 +66,7 @@ class DeliveryRetrieverStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_8,
             code=_lambda.Code.from_asset('lambdas/delivery/server_query'),
             role=retriever_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             environment={
                 'RTCWPROSTATS_TABLE_NAME': ddb_table.table_name,
@@ -60,5 +74,11 @@ class DeliveryRetrieverStack(Stack):
         )
 
         ddb_table.grant_read_data(retriever_role)
+        # shared response cache items only, see lambdas/delivery/retriever/response_cache.py
+        retriever_role.add_to_policy(iam.PolicyStatement(
+            resources=[ddb_table.table_arn],
+            actions=["dynamodb:PutItem", "dynamodb:UpdateItem"],
+            conditions={"ForAllValues:StringLike": {"dynamodb:LeadingKeys": ["responsecache#*"]}}
+        ))
         self.retriever_lambda = retriever
         self.server_query_lambda = server_query
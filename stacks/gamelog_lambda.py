@@ -14,6 +14,8 @@ class GamelogLambdaStack(Stack):
     def __init__(self, scope: Construct, id: str,
                  lambda_tracing,
                  ddb_table: Table,
+                 ddb_access_layer: _lambda.ILayerVersion,
+                 numpy_layer: _lambda.ILayerVersion,
                  custom_event_bus: events.IEventBus,
                  **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
@@ -32,6 +34,7 @@ class GamelogLambdaStack(Stack):
             handler='gamelog.handler',
             runtime=_lambda.Runtime.PYTHON_3_8,
             role=ddb_lambda_role,
+            layers=[ddb_access_layer, numpy_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(90),
             environment={
@@ -15,6 +15,7 @@ class PeriodicalStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, 
                  ddb_table: Table, 
+                 ddb_access_layer: _lambda.ILayerVersion,
                  funnel_sf: sfn.StateMachine,
                  custom_event_bus: events.IEventBus,
                  lambda_tracing, **kwargs) -> None:
@@ -66,6 +67,7 @@ class PeriodicalStack(Stack):
             handler='period_grouper.handler',
             runtime=_lambda.Runtime.PYTHON_3_8,
             role=period_grouper_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(60),
             environment={
@@ -90,6 +92,7 @@ class PeriodicalStack(Stack):
             handler='season_maker.handler',
             runtime=_lambda.Runtime.PYTHON_3_9,
             role=season_maker_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(60),
             environment={
@@ -10,6 +10,9 @@ import aws_cdk.aws_events as events
 
 from aws_cdk.aws_dynamodb import Table
 
+# one lambda loads the match once and runs elo, summary and gamelog in threads
+# set to False to go back to three lambdas in a Parallel state
+fused_postprocessing = True
 
 class PostProcessStack(Stack):
     """Make a step function state machine with lambdas doing the work."""
@@ -17,6 +20,8 @@ class PostProcessStack(Stack):
     def __init__(self, scope: Construct, id: str, 
                  lambda_tracing, 
                  ddb_table: Table, 
+                 ddb_access_layer: _lambda.ILayerVersion,
+                 numpy_layer: _lambda.ILayerVersion,
                  gamelog_lambda: _lambda.Function,
                  custom_event_bus: events.IEventBus,
                  **kwargs) -> None:
@@ -39,6 +44,7 @@ class PostProcessStack(Stack):
             handler='elo.handler',
             runtime=_lambda.Runtime.PYTHON_3_8,
             role=ddb_lambda_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(30),
             environment={
@@ -53,6 +59,7 @@ class PostProcessStack(Stack):
             handler='summary.handler',
             runtime=_lambda.Runtime.PYTHON_3_8,
             role=ddb_lambda_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(30),
             environment={
@@ -62,6 +69,25 @@ class PostProcessStack(Stack):
         )
         custom_event_bus.grant_put_events_to(summary_lambda)
 
+        # elo, summary and gamelog calculators running on one shared match context
+        postprocess_lambda = _lambda.Function(
+            self, 'postprocess-lambda',
+            function_name='rtcwpro-postprocess',
+            code=_lambda.Code.from_asset('lambdas/postprocessing'),
+            handler='postprocess.handler',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            role=ddb_lambda_role,
+            layers=[ddb_access_layer, numpy_layer],
+            tracing=lambda_tracing,
+            timeout=Duration.seconds(90),
+            memory_size=512,
+            environment={
+                'RTCWPROSTATS_TABLE_NAME': ddb_table.table_name,
+                'RTCWPROSTATS_CUSTOM_BUS_ARN': custom_event_bus.event_bus_arn
+            }
+        )
+        custom_event_bus.grant_put_events_to(postprocess_lambda)
+
         discord_match_notify_lambda = _lambda.Function(
             self, 'discord-match-notify-lambda',
             function_name='rtcwpro-discord-match-notify',
@@ -69,6 +95,7 @@ class PostProcessStack(Stack):
             handler='discord-match-notify.handler',
             runtime=_lambda.Runtime.PYTHON_3_8,
             role=ddb_lambda_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(10),
             environment={
@@ -103,16 +130,22 @@ class PostProcessStack(Stack):
         Round1Processing = tasks.LambdaInvoke(self, "Discord round1 notify", lambda_function=discord_match_notify_lambda)
 
         Discordmatch = tasks.LambdaInvoke(self, "Discord match notify", input_path="$.matchid", lambda_function=discord_match_notify_lambda)
-        ELO = tasks.LambdaInvoke(self, "Calculate Elo", input_path="$.matchid", result_path="$.Payload", lambda_function=elo_lambda).next(Discordmatch)
-        Summary = tasks.LambdaInvoke(self, "Summarize stats", input_path="$.matchid", lambda_function=summary_lambda)
-        Gamelog = tasks.LambdaInvoke(self, "Process gamelog", input_path="$.matchid", lambda_function=gamelog_lambda)
-
-        Round2Processing = sfn.Parallel(self, "Do the work in parallel")
-        Round2Processing.branch(ELO)
-        Round2Processing.branch(Summary)
-        Round2Processing.branch(Gamelog)
 
-        Round2Processing.add_catch(send_failure_notification)
+        if fused_postprocessing:
+            Round2Processing = tasks.LambdaInvoke(self, "Process match", input_path="$.matchid", result_path="$.Payload", lambda_function=postprocess_lambda)
+            Round2Processing.add_catch(send_failure_notification)
+            Round2Processing.next(Discordmatch)
+        else:
+            ELO = tasks.LambdaInvoke(self, "Calculate Elo", input_path="$.matchid", result_path="$.Payload", lambda_function=elo_lambda).next(Discordmatch)
+            Summary = tasks.LambdaInvoke(self, "Summarize stats", input_path="$.matchid", lambda_function=summary_lambda)
+            Gamelog = tasks.LambdaInvoke(self, "Process gamelog", input_path="$.matchid", lambda_function=gamelog_lambda)
+
+            Round2Processing = sfn.Parallel(self, "Do the work in parallel")
+            Round2Processing.branch(ELO)
+            Round2Processing.branch(Summary)
+            Round2Processing.branch(Gamelog)
+
+            Round2Processing.add_catch(send_failure_notification)
         # Round2Processing.next(success)
 
         choice = sfn.Choice(self, "Round 1 or 2")
@@ -130,3 +163,4 @@ class PostProcessStack(Stack):
         self.postproc_state_machine = postproc_state_machine
         self.elo_lambda = elo_lambda
         self.summary_lambda = summary_lambda
+        self.postprocess_lambda = postprocess_lambda
@@ -11,6 +11,10 @@ import aws_cdk.aws_events as events
 from aws_cdk.aws_dynamodb import Table
 from aws_cdk.aws_lambda_event_sources import SqsEventSource
 
+# one file used to get 30 s, a batch of 10 may fall back to writing every file on its own
+read_match_batch_size = 10
+read_match_timeout = 30 * read_match_batch_size  # seconds
+
 
 class ReadMatchStack(Stack):
     """Lambda to react to incoming files."""
@@ -18,6 +22,7 @@ class ReadMatchStack(Stack):
     def __init__(self, scope: Construct, id: str,
                  storage_bucket: s3.Bucket,
                  ddb_table: Table,
+                 ddb_access_layer: _lambda.ILayerVersion,
                  read_queue: sqs.Queue,
                  read_dlq: sqs.Queue,
                  postproc_state_machine: sfn.StateMachine,
@@ -39,8 +44,9 @@ class ReadMatchStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_8,
             code=_lambda.Code.from_asset('lambdas/storage/read_match'),
             role=read_match_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
-            timeout=Duration.seconds(30),
+            timeout=Duration.seconds(read_match_timeout),
             environment={
                 'RTCWPROSTATS_TABLE_NAME': ddb_table.table_name,
                 'RTCWPROSTATS_MATCH_STATE_MACHINE': postproc_state_machine.state_machine_arn,
@@ -55,7 +61,11 @@ class ReadMatchStack(Stack):
         postproc_state_machine.grant_start_execution(read_match)
         storage_bucket.grant_read(read_match, "intake/*")
 
-        read_match.add_event_source(SqsEventSource(read_queue, batch_size=1))
+        # only the files reported in batchItemFailures go back to the queue
+        read_match.add_event_source(SqsEventSource(read_queue,
+                                                   batch_size=read_match_batch_size,
+                                                   max_batching_window=Duration.seconds(5),
+                                                   report_batch_item_failures=True))
 
         read_dlq_role = iam.Role(self, "ReadDLQRole",
                                  role_name='rtcwpro-lambda-read-dlq-role',
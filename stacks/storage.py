@@ -7,6 +7,8 @@ import aws_cdk.aws_sns as sns
 import aws_cdk.aws_sqs as sqs
 import aws_cdk.aws_s3_notifications as s3n
 
+from stacks.read_match_lambda import read_match_timeout
+
 
 class StorageStack(Stack):
     """S3 bucket for incoming files and reader lambda."""
@@ -46,7 +48,10 @@ class StorageStack(Stack):
         
         read_dlq = sqs.Queue(self, id="ReadMatchDLQ")
         read_queue = sqs.Queue(self, "ReadMatchQueue",
-                               visibility_timeout=Duration.seconds(60),
+                               # 6 times the read_match timeout, as AWS advises for lambda event sources:
+                               # with max_receive_count=1 a message that shows up again while its batch
+                               # still runs goes to the DLQ, which moves an already ingested file
+                               visibility_timeout=Duration.seconds(6 * read_match_timeout),
                                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=1, queue=read_dlq))
         sqs_notification = s3n.SqsDestination(read_queue)
         storage_bucket.add_event_notification(s3.EventType.OBJECT_CREATED, sqs_notification, s3.NotificationKeyFilter(prefix="intake/"))
@@ -19,6 +19,7 @@ class TaskFunnelStack(Stack):
     def __init__(self, scope: Construct, id: str, 
         lambda_tracing, 
         ddb_table: Table, 
+        ddb_access_layer: _lambda.ILayerVersion,
         gamelog_lambda: _lambda.Function, 
         custom_event_bus: events.IEventBus,
         prompt_id: str,
@@ -42,6 +43,7 @@ class TaskFunnelStack(Stack):
             handler='group_cacher.handler',
             runtime=_lambda.Runtime.PYTHON_3_9,
             role=funnel_lambda_role,
+            layers=[ddb_access_layer],
             tracing=lambda_tracing,
             timeout=Duration.seconds(90),
             environment={
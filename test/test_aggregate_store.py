@@ -0,0 +1,202 @@
+"""
+Checks for the counter based player aggregates in summary/aggregate_store.py.
+
+DynamoDB is replaced with a small in-memory client that understands the
+update expressions aggregate_store writes.
+    python -m pytest test/test_aggregate_store.py
+"""
+import glob
+import json
+import logging
+import os
+import re
+import sys
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "summary"))
+
+import aggregate_store
+from aggregate_store import add_match_aggregates, get_kdr
+
+aggregate_store.logger.setLevel(logging.WARNING)
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+match_region_type = "na#6"
+
+
+class MemoryClient:
+    """Just enough of update_item and get_item for aggregate_store."""
+
+    def __init__(self):
+        self.items = {}
+        self.calls = []
+
+    def get_item(self, TableName, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None):
+        self.calls.append("get_item")
+        item = self.items.get(self.key(Key))
+        if item is not None and ProjectionExpression is not None:
+            projected = [ExpressionAttributeNames.get(name, name) for name in ProjectionExpression.split(", ")]
+            item = {k: v for k, v in item.items() if k in projected}
+        return {} if item is None else {"Item": {k: serializer.serialize(v) for k, v in item.items()}}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None, ReturnValues=None):
+        self.calls.append("update_item")
+        names = ExpressionAttributeNames
+        values = {k: deserializer.deserialize(v) for k, v in ExpressionAttributeValues.items()}
+        item = self.items.get(self.key(Key))
+        if ConditionExpression is not None and not self.check(ConditionExpression, item, names, values):
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}}, "UpdateItem")
+        if item is None:
+            item = {k: deserializer.deserialize(v) for k, v in Key.items()}
+        for action, body in re.findall(r"(ADD|SET) (.*?)(?= SET | ADD |$)", UpdateExpression):
+            for clause in body.split(", "):
+                if action == "ADD":
+                    name, value = clause.split(" ")
+                    item[names[name]] = item.get(names[name], 0) + values[value]
+                else:
+                    name, value = clause.split(" = ")
+                    item[names[name]] = values[value]
+        self.items[self.key(Key)] = item
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": {k: serializer.serialize(v) for k, v in item.items()}}
+        return {}
+
+    def check(self, condition, item, names, values):
+        if condition == "attribute_exists(#counters) OR attribute_not_exists(pk)":
+            return item is None or "counters" in item
+        if condition == "attribute_not_exists(#counters)":
+            return item is None or "counters" not in item
+        if condition == "attribute_not_exists(#killpeak) OR #killpeak < :kp":
+            return item is None or "killpeak" not in item or item["killpeak"] < values[":kp"]
+        if condition == "#games = :games":
+            return item is not None and item["games"] == values[":games"]
+        raise ValueError(condition)
+
+    def key(self, Key):
+        return Key["pk"]["S"] + ":" + Key["sk"]["S"]
+
+
+def read_match(match_num):
+    file_name = sorted(glob.glob(os.path.join(test_dir, "gamestats4", "*_round_2_*.json")))[match_num]
+    with open(file_name) as file:
+        round2 = json.load(file)
+    stats = {}
+    for team in round2["stats"]:
+        stats.update(team)
+    wstats = {}
+    for wplayer_wrap in round2["wstats"]:
+        for guid, wplayer in wplayer_wrap.items():
+            wstats[guid] = {weapon["weapon"]: weapon for weapon in wplayer}
+    return stats, wstats
+
+
+def test_two_matches_add_up():
+    client = MemoryClient()
+    matches = [read_match(0), read_match(1)]
+    for stats, wstats in matches:
+        stats_updated, wstats_updated = add_match_aggregates(client, "table", stats, wstats, match_region_type, {})
+    assert "get_item" not in client.calls
+
+    for guid in set(matches[0][0]) | set(matches[1][0]):
+        item = client.items["player#" + guid + ":aggstats#" + match_region_type]
+        played = [stats[guid]["categories"] for stats, wstats in matches if guid in stats]
+        assert item["games"] == len(played)
+        assert item["data"]["kills"] == sum(categories["kills"] for categories in played)
+        assert item["data"]["killpeak"] == max(categories["killpeak"] for categories in played)
+        assert item["gsi1sk"] == str(round(get_kdr({k: int(v) for k, v in item["data"].items()}), 1)).zfill(3)
+        assert item["gsi1pk"] == "leaderkdr#" + match_region_type
+    for guid, view in stats_updated.items():
+        assert view == client.items["player#" + guid + ":aggstats#" + match_region_type]["data"]
+
+
+def test_legacy_item_is_seeded():
+    client = MemoryClient()
+    stats, wstats = read_match(0)
+    guid = sorted(stats)[0]
+    weapon = sorted(wstats[guid])[0]
+    client.items["player#" + guid + ":aggstats#" + match_region_type] = {
+        "pk": "player#" + guid, "sk": "aggstats#" + match_region_type, "games": 10,
+        "data": {"kills": 100, "deaths": 50, "accuracy": 0, "efficiency": 66, "killpeak": 30, "games": 10}}
+    client.items["player#" + guid + ":aggwstats#" + match_region_type] = {
+        "pk": "player#" + guid, "sk": "aggwstats#" + match_region_type, "games": 10,
+        "data": {weapon: {"kills": 7, "shots": 70, "games": 10}}}
+
+    stats_updated, wstats_updated = add_match_aggregates(client, "table", {guid: stats[guid]}, {guid: wstats[guid]}, match_region_type, {})
+    assert stats_updated[guid]["kills"] == 100 + stats[guid]["categories"]["kills"]
+    assert stats_updated[guid]["games"] == 11
+    assert stats_updated[guid]["killpeak"] == 30
+    assert wstats_updated[guid][weapon]["kills"] == 7 + wstats[guid][weapon]["kills"]
+    assert wstats_updated[guid][weapon]["games"] == 11
+
+
+def test_stale_view_is_not_written():
+    client = MemoryClient()
+    stats, wstats = read_match(0)
+    guid = sorted(stats)[0]
+    key = {"pk": "player#" + guid, "sk": "aggstats#" + match_region_type}
+    aggregate_store.write_view(client, "table", key, {"kills": 1}, "1.0", 1)
+    assert key["pk"] + ":" + key["sk"] not in client.items
+
+    add_match_aggregates(client, "table", {guid: stats[guid]}, {}, match_region_type, {})
+    view = client.items[key["pk"] + ":" + key["sk"]]["data"]
+    aggregate_store.write_view(client, "table", key, {"kills": 1}, "1.0", 0)
+    assert client.items[key["pk"] + ":" + key["sk"]]["data"] == view
+
+
+def test_killpeak_only_goes_up():
+    client = MemoryClient()
+    stats, wstats = read_match(0)
+    guid = sorted(stats)[0]
+    key = "player#" + guid + ":aggstats#" + match_region_type
+    player_stats = json.loads(json.dumps(stats[guid]))
+    for killpeak, expected in [(3, 3), (1, 3), (5, 5)]:
+        player_stats["categories"]["killpeak"] = killpeak
+        stats_updated, wstats_updated = add_match_aggregates(client, "table", {guid: player_stats}, {}, match_region_type, {})
+        assert stats_updated[guid]["killpeak"] == expected
+        assert client.items[key]["killpeak"] == expected
+        assert client.items[key]["data"]["killpeak"] == expected
+
+
+def test_killpeak_raised_in_between():
+    """A concurrent match that set a higher peak after our ADD wins."""
+    client = MemoryClient()
+    stats, wstats = read_match(0)
+    guid = sorted(stats)[0]
+    key = {"pk": "player#" + guid, "sk": "aggstats#" + match_region_type}
+    client.items[key["pk"] + ":" + key["sk"]] = {**key, "counters": 1, "games": 1, "killpeak": 9}
+    item = {**key, "counters": 1, "games": 1, "killpeak": 2}  # what our ADD returned
+    assert aggregate_store.raise_killpeak(client, "table", key, item, 4) == 9
+    assert client.items[key["pk"] + ":" + key["sk"]]["killpeak"] == 9
+
+
+def item_size(value):
+    """Approximate DynamoDB size of an attribute value in bytes."""
+    if isinstance(value, dict):
+        return 3 + sum(len(k) + item_size(v) + 1 for k, v in value.items())
+    if isinstance(value, str):
+        return len(value.encode())
+    return 1 + (len(str(value).lstrip("-").replace(".", "")) + 1) // 2
+
+
+def measure_item_sizes(matches=3):
+    """Average aggstats/aggwstats item size written by the old put and by the counters."""
+    client = MemoryClient()
+    for match_num in range(matches):
+        stats, wstats = read_match(match_num)
+        add_match_aggregates(client, "table", stats, wstats, match_region_type, {})
+    for sk in ["aggstats#", "aggwstats#"]:
+        items = [item for key, item in client.items.items() if key.endswith(":" + sk + match_region_type)]
+        old_fields = ["pk", "sk", "data", "gsi1pk", "gsi1sk", "games", "real_name", "updated"]
+        old = sum(sum(len(k) + item_size(v) for k, v in item.items() if k in old_fields) for item in items) / len(items)
+        new = sum(sum(len(k) + item_size(v) for k, v in item.items()) for item in items) / len(items)
+        print(f"{sk:>10} old {old / 1024:.2f} KB, counters {new / 1024:.2f} KB over {len(items)} items")
+
+
+if __name__ == "__main__":
+    test_two_matches_add_up()
+    test_killpeak_only_goes_up()
+    measure_item_sizes()
@@ -0,0 +1,372 @@
+"""
+Parity and speed checks for gamelog_process.award_engine.AwardEngine and
+the numpy columns in gamelog_process.gamelog_columns.
+
+The reference is the original award classes in test/gamelog_process, fed
+every event one class at a time like gamelog_calc used to.
+
+Run with pytest for the parity checks or directly for the benchmark:
+    python test/test_award_engine.py
+"""
+import glob
+import json
+import os
+import random
+import sys
+import timeit
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "gamelog"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+sys.path.append(os.path.join(test_dir, "gamelog_process"))  # original classes, flat imports
+
+from gamelog_process.award_class import AwardClass
+from gamelog_process.award_engine import AwardEngine
+from gamelog_process.longest_kill import LongestKill
+from gamelog_process.frontliner import Frontliner
+from gamelog_process.megakill import MegaKill
+from gamelog_process.top_feuds import TopFeuds
+from gamelog_process.view_angles import ViewAngles
+from gamelog_process.kills_per_game import KillsPerGame
+from gamelog_process import gamelog_calc
+import frontliner as original_frontliner
+import kills_per_game as original_kills_per_game
+import longest_kill as original_longest_kill
+import megakill as original_megakill
+import top_feuds as original_top_feuds
+import view_angles as original_view_angles
+
+
+def make_award_classes():
+    return [LongestKill(), Frontliner(), MegaKill(), TopFeuds(), ViewAngles(), KillsPerGame()]
+
+
+def get_gamelog(folder):
+    gamelog = []
+    for file_name in sorted(glob.glob(os.path.join(test_dir, folder, "*.json"))):
+        with open(file_name) as file:
+            gamelog.extend(json.load(file).get("gamelog", []))
+    return gamelog
+
+
+def make_original_classes():
+    award_classes = [original_longest_kill.LongestKill(), original_frontliner.Frontliner(),
+                     original_megakill.MegaKill(), original_top_feuds.TopFeuds(),
+                     original_view_angles.ViewAngles(), original_kills_per_game.KillsPerGame()]
+    for class_ in award_classes:
+        class_.debug = False  # its error print fails on self.__name__, the results are the same
+    return award_classes
+
+
+def get_results(award_classes):
+    results = {}
+    for class_ in award_classes:
+        if class_.award_name == TopFeuds.award_name:
+            results["feuds"] = sorted(class_.get_custom_results())
+        elif class_.award_name == ViewAngles.award_name:
+            results.update(class_.get_custom_results())
+        else:
+            results.update(class_.get_full_results())
+    return results
+
+
+def get_original_results(award_classes):
+    results = get_results(award_classes)
+    for award in ["Backstabber", "Chicken"]:  # the lambda rounds these, the copy in test/gamelog_process does not
+        results[award] = {player: int(value) for player, value in results[award].items()}
+    return results
+
+
+def process_per_class(gamelog):
+    """Every event to every original class, the way gamelog_calc used to do it."""
+    award_classes = make_original_classes()
+    for rtcw_event in gamelog:
+        for class_ in award_classes:
+            class_.process_event(rtcw_event)
+    return award_classes
+
+
+def process_engine(gamelog, columnar=False):
+    award_classes = make_award_classes()
+    AwardEngine(award_classes, columnar).process_events(gamelog)
+    return award_classes
+
+
+def process_columnar(gamelog):
+    return process_engine(gamelog, columnar=True)
+
+
+def test_engine_matches_per_class_dispatch():
+    for folder in ["gamestats4", "gamestats5"]:
+        gamelog = get_gamelog(folder)
+        assert len(gamelog) > 0
+        expected = get_original_results(process_per_class(gamelog))
+        assert get_results(process_engine(gamelog)) == expected
+        assert get_results(process_columnar(gamelog)) == expected
+
+
+def test_columnar_bad_fields():
+    """Malformed positions and angles end up like in the per event code."""
+    gamelog = get_gamelog("gamestats4")[0:3000]
+    kills = [rtcw_event for rtcw_event in gamelog if rtcw_event.get("label") == "kill"]
+    kills[0] = dict(kills[0], agent_pos="1.0,2.0")
+    kills[1] = dict(kills[1], other_pos="oops,2,3")
+    kills[2] = dict(kills[2], agent_angle=None)
+    kills[3] = dict(kills[3], unixtime="")
+    del kills[4]["other_pos"]
+    gamelog = [{"label": "round_start"}] + kills[0:5] + gamelog
+    expected = get_original_results(process_per_class(gamelog))
+    assert get_results(process_engine(gamelog)) == expected
+    assert get_results(process_columnar(gamelog)) == expected
+
+
+def test_columnar_split_gamelog():
+    """Awards keep their state between several process_events calls."""
+    gamelog = get_gamelog("gamestats4")
+    award_classes = make_award_classes()
+    engine = AwardEngine(award_classes, columnar=True)
+    for start in range(0, len(gamelog), 1000):
+        engine.process_events(gamelog[start: start + 1000])
+    results = get_results(award_classes)
+    expected = get_original_results(process_per_class(gamelog))
+    del results["Backstabber"], results["Chicken"], expected["Backstabber"], expected["Chicken"]  # float sums in another order
+    assert results == expected
+
+
+def test_engine_counters():
+    gamelog = get_gamelog("gamestats4")
+    award_classes = make_award_classes()
+    engine = AwardEngine(award_classes)
+    engine.process_events(gamelog)
+    kills = [rtcw_event for rtcw_event in gamelog if rtcw_event.get("label") == "kill"]
+    assert engine.events_processed == len(gamelog)
+    assert engine.kills_processed == len(kills)
+    assert sum(award_classes[-1].players_values.values()) == len(kills)
+
+
+def test_positions_parsed_once_for_awards_reading_them():
+    """Kills get positions and angles only for weapons of an award that reads them."""
+    class Recorder(AwardClass):
+        def __init__(self, weapons, positions):
+            super().__init__("recorder")
+            self.weapons = weapons
+            self.positions = positions
+            self.kills = []
+
+        def process_kill(self, kill):
+            self.kills.append(kill)
+
+    smg_kill = {"label": "kill", "unixtime": "100", "agent": "a", "other": "b", "weapon": "MP-40",
+                "agent_pos": "1.0,2.0,3.0", "other_pos": "4.0,6.0,3.0", "agent_angle": "10", "other_angle": "-80"}
+    panzer_kill = dict(smg_kill, weapon="Panzerfaust")
+    smg_recorder = Recorder({"MP-40"}, True)
+    all_recorder = Recorder(None, False)
+    AwardEngine([smg_recorder, all_recorder]).process_events([smg_kill, panzer_kill])
+    assert [kill.agent_pos for kill in all_recorder.kills] == [[1.0, 2.0, 3.0], None]
+    assert [kill.other_angle for kill in all_recorder.kills] == [-80.0, None]
+    assert smg_recorder.kills == all_recorder.kills[0:1]
+
+    for columnar in [False, True]:
+        longest_kill = LongestKill()
+        view_angles = ViewAngles()
+        AwardEngine([longest_kill, view_angles], columnar).process_events([smg_kill, panzer_kill])
+        assert longest_kill.players_values == {"a": 5}
+        assert view_angles.kill_angle_values["kills"] == {"a": [90.0, 1]}
+
+
+def test_round_start_resets_streaks():
+    megakill = MegaKill()
+    kill = {"label": "kill", "unixtime": "100", "agent": "a", "other": "b", "weapon": "MP-40"}
+    engine = AwardEngine([megakill])
+    engine.process_events([kill, kill, {"label": "round_start"}, kill])
+    assert megakill.players_values == {}
+    engine.process_events([kill, kill])
+    assert megakill.players_values == {"a": 3}
+
+
+def test_megakill_windows():
+    """Extra streak tiers are the same as separate single window MegaKills."""
+    gamelog = get_gamelog("gamestats4") + get_gamelog("gamestats5")
+    megakill = MegaKill(windows=[(3, 6), (5, 10), (2, 2)])
+    AwardEngine([megakill]).process_events(gamelog)
+    assert megakill.players_values == process_engine(gamelog)[2].players_values
+    for window_name, window in [("5/10", (5, 10)), ("2/2", (2, 2))]:
+        single = MegaKill(windows=[window])
+        AwardEngine([single]).process_events(gamelog)
+        assert megakill.get_window_results()[window_name] == single.players_values
+
+    # time stamps from the future are dropped, the window restarts
+    megakill = MegaKill(windows=[(3, 6), (2, 1)])
+    kills = [{"label": "kill", "unixtime": str(unixtime), "agent": "a", "other": "b", "weapon": "Panzerfaust"} for unixtime in [100, 101, 103, 50, 51, 60]]
+    AwardEngine([megakill]).process_events(kills)
+    assert megakill.players_values == {"a": 3}
+    assert megakill.window_values == {"2/1": {"a": 2}}
+
+
+def test_top_feuds():
+    """Pairs keep the orientation of their first kill, ties with the last place stay in."""
+    def kill(agent, other):
+        return {"label": "kill", "unixtime": "100", "agent": agent, "other": other, "weapon": "MP-40"}
+    shared_guid = sorted(TopFeuds.shared_guids)[0]
+    gamelog = [kill("b", "a"), kill("a", "b"), kill("a", "b"), kill("c", "d"), kill("d", "c"),
+               kill("e", "e"), kill("a", shared_guid), kill("a", shared_guid), kill("a", shared_guid)]
+    top_feuds = TopFeuds()
+    top_feuds.top_number = 2
+    AwardEngine([top_feuds]).process_events(gamelog)
+    assert top_feuds.get_custom_results() == [["b", "a", 1, 2], ["c", "d", 1, 1], ["e", "e", 1, 1]]
+
+    merged = TopFeuds()
+    merged.merge_partial(json.loads(json.dumps(top_feuds.get_partial())))
+    merged.merge_partial({"d#c": 5})
+    assert merged.get_custom_results()[0:2] == [["b", "a", 1, 2], ["c", "d", 1, 6]]
+
+
+def get_match_gamelogs(folder):
+    """Gamelogs of every match in a folder, both rounds in order."""
+    match_gamelogs = {}
+    for file_name in sorted(glob.glob(os.path.join(test_dir, folder, "*.json"))):
+        match_id = os.path.basename(file_name).split("_")[2]
+        with open(file_name) as file:
+            match_gamelogs.setdefault(match_id, []).extend(json.load(file).get("gamelog", []))
+    return match_gamelogs
+
+
+def test_merged_partials_match_group_replay():
+    """Group awards from stored per match partials equal a replay of all group gamelogs."""
+    match_gamelogs = get_match_gamelogs("gamestats4")
+    assert len(match_gamelogs) > 1
+    partials = {}
+    for match_id, gamelog in match_gamelogs.items():
+        award_classes = process_engine(gamelog)
+        # stored as json in the awardpartials item
+        partials[match_id] = json.loads(json.dumps({class_.award_name: class_.get_partial() for class_ in award_classes}))
+
+    award_classes = make_award_classes()
+    for match_id in match_gamelogs:
+        for class_ in award_classes:
+            class_.merge_partial(partials[match_id].get(class_.award_name, {}))
+
+    group_gamelog = [rtcw_event for gamelog in match_gamelogs.values() for rtcw_event in gamelog]
+    results = get_results(award_classes)
+    expected = get_original_results(process_per_class(group_gamelog))
+    for award in ["Backstabber", "Chicken"]:  # float sums in another order
+        assert results[award].keys() == expected[award].keys()
+        for player, value in results[award].items():
+            assert abs(value - expected[award][player]) < 1e-9
+        del results[award], expected[award]
+    assert results == expected
+
+
+def test_streamed_group_gamelogs():
+    """Paged round by round processing gives the same awards as one big gamelog."""
+    match_gamelogs = get_match_gamelogs("gamestats4")
+    gamelog_items = {}
+    for match_id, gamelog in match_gamelogs.items():
+        rounds = [[]]
+        for rtcw_event in gamelog:
+            if rtcw_event.get("label") == "round_start" and len(rounds[-1]) > 0:
+                rounds.append([])
+            rounds[-1].append(rtcw_event)
+        for round_num, round_gamelog in enumerate(rounds, 1):
+            gamelog_items[match_id + str(round_num)] = json.dumps(round_gamelog)
+
+    pages = []
+    def get_batch_items(item_list, ddb_table, log_stream_name):
+        pages.append(len(item_list))
+        items = [{"pk": "gamelogs", "sk": key["sk"], "data": gamelog_items[key["sk"]]} for key in item_list if key["sk"] in gamelog_items]
+        return list(reversed(items))  # batch_get_item does not keep the order of keys
+
+    original = gamelog_calc.get_batch_items, gamelog_calc.gamelog_page_sleep
+    gamelog_calc.get_batch_items, gamelog_calc.gamelog_page_sleep = get_batch_items, 0
+    try:
+        rounds = list(gamelog_calc.iter_round_gamelogs(None, list(match_gamelogs), "local", page_size=4))
+        assert max(pages) == 4
+        award_classes = make_award_classes()
+        gamelog_calc.process_streamed_gamelogs(None, list(match_gamelogs), award_classes, "local")
+    finally:
+        gamelog_calc.get_batch_items, gamelog_calc.gamelog_page_sleep = original
+
+    assert [rtcw_event for round_gamelog in rounds for rtcw_event in round_gamelog] == [rtcw_event for gamelog in match_gamelogs.values() for rtcw_event in gamelog]
+    results = get_results(award_classes)
+    expected = get_original_results(process_per_class(get_gamelog("gamestats4")))
+    del results["Backstabber"], results["Chicken"], expected["Backstabber"], expected["Chicken"]  # float sums in another order
+    assert results == expected
+
+
+def test_merge_partials_of_repeated_matches(monkeypatch):
+    """A match listed twice in a group is read and merged once, saved partials expire."""
+    match_gamelogs = get_match_gamelogs("gamestats4")
+    match_ids = list(match_gamelogs)
+    stored = {}
+    for match_id in match_ids[1:]:
+        award_classes = process_engine(match_gamelogs[match_id])
+        stored[match_id] = json.dumps({"version": gamelog_calc.award_partials_version, "awards": gamelog_calc.get_award_partials(award_classes)})
+
+    requested = []
+    def get_big_batch_items(item_list, ddb_table, log_stream_name):
+        requested.extend(key["sk"] for key in item_list)
+        return [{"pk": "awardpartials", "sk": key["sk"], "data": stored[key["sk"]]} for key in item_list if key["sk"] in stored]
+
+    def iter_round_gamelogs(ddb_table, matches, log_stream_name):
+        for match_id in matches:
+            yield match_gamelogs[match_id]
+
+    saved = []
+    monkeypatch.setattr(gamelog_calc, "get_big_batch_items", get_big_batch_items)
+    monkeypatch.setattr(gamelog_calc, "iter_round_gamelogs", iter_round_gamelogs)
+    monkeypatch.setattr(gamelog_calc, "ddb_put_item", lambda item, ddb_table: saved.append(item))
+
+    award_classes = make_award_classes()
+    gamelog_calc.merge_award_partials(None, match_ids + [int(match_ids[1]), match_ids[0]], award_classes, "local")
+
+    assert requested == match_ids
+    assert [item["sk"] for item in saved] == [match_ids[0]]
+    assert saved[0]["ExpirationTime"] == int(match_ids[0]) + gamelog_calc.award_partials_ttl
+    results = get_results(award_classes)
+    expected = get_results(process_engine(get_gamelog("gamestats4")))
+    del results["Backstabber"], results["Chicken"], expected["Backstabber"], expected["Chicken"]  # float sums in another order
+    assert results == expected
+
+
+def benchmark(matches=300, number=3):
+    """A monthly group is a few hundred matches, repeat the sample gamelogs to that size."""
+    sample = get_gamelog("gamestats4")
+    sample_matches = len(glob.glob(os.path.join(test_dir, "gamestats4", "*_round_2_*.json")))
+    gamelog = sample * max(1, matches // sample_matches)
+    for name, function in [("per class", process_per_class), ("engine", process_engine), ("columnar", process_columnar)]:
+        seconds = timeit.timeit(lambda: function(gamelog), number=number) / number
+        print(f"{name:>10}: {len(gamelog)} events in {seconds:.3f} s, {int(len(gamelog) / seconds)} events/s")
+
+
+def benchmark_feuds(matches=300, players=3000):
+    """Monthly group with tens of thousands of distinct killer/victim pairs."""
+    rng = random.Random(3)
+    guids = ["%032x" % rng.getrandbits(128) for num in range(players)]
+    gamelog = []
+    for match in range(matches):
+        match_players = rng.sample(guids, 12)
+        gamelog.append({"label": "round_start"})
+        for num in range(240):
+            gamelog.append({"label": "kill", "unixtime": "100", "agent": rng.choice(match_players),
+                            "other": rng.choice(match_players), "weapon": "MP-40"})
+    top_feuds = TopFeuds()
+    seconds = timeit.timeit(lambda: AwardEngine([top_feuds]).process_events(gamelog), number=1)
+    print(f"  feuds: {len(gamelog)} events in {seconds:.3f} s, {len(top_feuds.pairs)} pairs")
+    seconds = timeit.timeit(top_feuds.get_custom_results, number=10) / 10
+    print(f"  feuds: top {top_feuds.top_number} in {seconds:.4f} s")
+
+
+if __name__ == "__main__":
+    test_engine_matches_per_class_dispatch()
+    test_engine_counters()
+    test_columnar_bad_fields()
+    test_positions_parsed_once_for_awards_reading_them()
+    test_columnar_split_gamelog()
+    test_round_start_resets_streaks()
+    test_megakill_windows()
+    test_top_feuds()
+    test_merged_partials_match_group_replay()
+    test_streamed_group_gamelogs()
+    print("Parity OK")
+    benchmark()
+    benchmark_feuds()
@@ -0,0 +1,118 @@
+"""
+Checks for the data attribute encoding shared by the writer and the readers
+(data_codec.py in the ddb_access layer).
+
+Run with pytest for the checks or directly for the benchmark:
+    python test/test_data_codec.py
+"""
+import glob
+import json
+import os
+import sys
+import timeit
+
+import pytest
+from boto3.dynamodb.types import Binary
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+lambdas_dir = os.path.join(test_dir, "..", "lambdas")
+sys.path.insert(0, os.path.join(lambdas_dir, "storage", "read_match"))
+sys.path.insert(0, os.path.join(lambdas_dir, "layers", "ddb_access", "python"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import data_codec
+from data_codec import encode_data, decode_data, fetch_data_parts
+from reader_writeddb import ddb_prepare_gamelog_items
+
+
+def get_attributes():
+    """statsall, wstatsall and gamelogs content of every gamestats4 round."""
+    for file_name in sorted(glob.glob(os.path.join(test_dir, "gamestats4", "*.json"))):
+        with open(file_name) as file:
+            content = json.load(file)
+        for key in ["stats", "wstats", "gamelog"]:
+            if key in content:
+                yield os.path.basename(file_name), key, content[key]
+
+
+def as_stored(item):
+    """What boto3 returns for an item it wrote."""
+    if isinstance(item.get("data"), bytes):
+        return dict(item, data=Binary(item["data"]))
+    return item
+
+
+def test_round_trip():
+    for file_name, key, obj in get_attributes():
+        item = as_stored(encode_data(obj))
+        assert item["data_enc"] == "zlib"
+        assert decode_data(item) == obj, file_name + " " + key
+
+
+def test_items_without_marker_still_read():
+    obj = {"guid": {"kills": 3}}
+    assert encode_data(obj, None) == {"data": json.dumps(obj)}
+    assert decode_data({"pk": "statsall", "sk": "1", "data": json.dumps(obj)}) == obj
+
+
+def test_unknown_encoding_fails_loudly():
+    with pytest.raises(ValueError):
+        decode_data({"data": b"", "data_enc": "zstd"})
+
+
+def test_split_gamelog_is_put_back_together(monkeypatch):
+    file_name = glob.glob(os.path.join(test_dir, "gamestats4", "gameStats_match_1609817356_round_2_*.json"))[0]
+    with open(file_name) as file:
+        gamestats = json.load(file)
+    assert len(ddb_prepare_gamelog_items(gamestats)) == 1
+
+    monkeypatch.setattr(data_codec, "max_data_size", 2000)
+    gamelog_items = [as_stored(item) for item in ddb_prepare_gamelog_items(gamestats)]
+    head = gamelog_items[-1]
+    assert head == {"pk": "gamelogs", "sk": "16098173562", "data_parts": len(gamelog_items) - 1}
+    assert len(gamelog_items) > 3
+    for num, part in enumerate(gamelog_items[0:-1], 1):
+        assert part["sk"] == "16098173562#part" + str(num)
+        assert len(part["data"].value) <= 2000
+
+    calls = []
+
+    def get_items(keys):
+        calls.append(keys)
+        return [item for item in reversed(gamelog_items) if {"pk": item["pk"], "sk": item["sk"]} in keys]
+
+    with pytest.raises(ValueError):
+        decode_data(head)
+    assert fetch_data_parts([head], get_items) == []
+    assert len(calls) == 1
+    assert decode_data(head) == gamestats["gamelog"]
+
+    lost_part = {"pk": "gamelogs", "sk": "16098173561", "data_parts": 2}
+    assert fetch_data_parts([lost_part], lambda keys: {"error": "[x] Items do not exist: "}) == \
+        [{"pk": "gamelogs", "sk": "16098173561#part1"}, {"pk": "gamelogs", "sk": "16098173561#part2"}]
+
+
+def benchmark(number=20):
+    sizes = {}
+    for file_name, key, obj in get_attributes():
+        text = json.dumps(obj)
+        item = as_stored(encode_data(obj))
+        encode_time = timeit.timeit(lambda: encode_data(obj), number=number) / number
+        decode_time = timeit.timeit(lambda: decode_data(item), number=number) / number
+        plain_decode_time = timeit.timeit(lambda: json.loads(text), number=number) / number
+        total = sizes.setdefault(key, [0, 0, 0, 0, 0])
+        total[0] += len(text)
+        total[1] += len(item["data"].value)
+        total[2] += encode_time
+        total[3] += decode_time
+        total[4] += plain_decode_time
+    for key, (plain, encoded, encode_time, decode_time, plain_decode_time) in sizes.items():
+        print(f"{key:>8}: {plain / 1024:8.1f} KB -> {encoded / 1024:7.1f} KB ({100 * (1 - encoded / plain):.0f}% smaller), "
+              f"encode {encode_time * 1000:.2f} ms, decode {decode_time * 1000:.2f} ms (json only {plain_decode_time * 1000:.2f} ms)")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_items_without_marker_still_read()
+    print("Round trip OK")
+    benchmark()
@@ -0,0 +1,211 @@
+"""
+Checks for the shared DynamoDB batch layer (lambdas/layers/ddb_access).
+
+Run with pytest for the checks or directly for the write benchmark against
+a throttling stand-in:
+    python test/test_ddb_access.py
+"""
+import os
+import sys
+import threading
+import time
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import ddb_access
+
+table_name = "rtcwprostats-test"
+serializer = TypeSerializer()
+
+
+class Table:
+    name = table_name
+
+
+class ThrottlingClient:
+    """Leaves the last key or item of every first request unprocessed."""
+
+    def __init__(self, items=None):
+        self.items = items or {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity):
+        request = RequestItems[table_name]
+        with self.lock:
+            self.requests.append(request)
+        keys = request["Keys"]
+        unprocessed = {}
+        if len(keys) > 1:
+            unprocessed = {table_name: dict(request, Keys=keys[-1:])}
+            keys = keys[0:-1]
+        found = [self.items[key["sk"]["S"]] for key in keys if key["sk"]["S"] in self.items]
+        return {"Responses": {table_name: found}, "UnprocessedKeys": unprocessed,
+                "ConsumedCapacity": [{"TableName": table_name, "CapacityUnits": len(keys) / 2}]}
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+        requests = RequestItems[table_name]
+        with self.lock:
+            self.requests.append(requests)
+        unprocessed = {}
+        if len(requests) > 1:
+            unprocessed = {table_name: requests[-1:]}
+            requests = requests[0:-1]
+        with self.lock:
+            for request in requests:
+                item = request["PutRequest"]["Item"]
+                self.items[item["sk"]["S"]] = item
+        return {"UnprocessedItems": unprocessed,
+                "ConsumedCapacity": [{"TableName": table_name, "CapacityUnits": len(requests)}]}
+
+
+def use_client(monkeypatch, client):
+    monkeypatch.setattr(ddb_access, "_client", client)
+    monkeypatch.setattr(ddb_access, "backoff_base", 0)
+    ddb_access.reset_consumed_capacity()
+
+
+def test_batch_get_retries_unprocessed_keys(monkeypatch):
+    items = {str(num): {"pk": {"S": "match"}, "sk": {"S": str(num)}, "data": {"S": "x" * num}} for num in range(0, 250, 2)}
+    client = ThrottlingClient(items)
+    use_client(monkeypatch, client)
+
+    keys = [{"pk": "match", "sk": str(num)} for num in range(250)]
+    found = ddb_access.get_batch_items(keys, Table(), "local", "pk, sk, #data_value")
+    assert sorted([int(item["sk"]) for item in found]) == list(range(0, 250, 2))
+    assert found[0] == {"pk": "match", "sk": found[0]["sk"], "data": "x" * int(found[0]["sk"])}
+
+    first_requests = [request for request in client.requests if len(request["Keys"]) > 1]
+    assert sorted([len(request["Keys"]) for request in first_requests]) == [50, 100, 100]
+    assert len(client.requests) == 6
+    assert all(request["ExpressionAttributeNames"] == {"#data_value": "data"} for request in client.requests)
+    assert ddb_access.get_consumed_capacity()["read"] == 125
+
+
+def test_missing_items_and_errors_are_error_dicts(monkeypatch):
+    use_client(monkeypatch, ThrottlingClient())
+    assert "error" in ddb_access.get_batch_items([{"pk": "match", "sk": "1"}], Table(), "local")
+
+    class BrokenClient:
+        def batch_get_item(self, **kwargs):
+            raise Exception("no connection")
+
+    use_client(monkeypatch, BrokenClient())
+    assert "error" in ddb_access.get_batch_items([{"pk": "match", "sk": "1"}], Table(), "local")
+
+
+def test_batch_write_retries_unprocessed_items(monkeypatch):
+    client = ThrottlingClient()
+    use_client(monkeypatch, client)
+
+    items = [{"pk": "eloprogress", "sk": str(num), "data": num} for num in range(60)]
+    ddb_access.batch_write_items(table_name, items)
+    assert sorted(client.items.keys()) == sorted([str(num) for num in range(60)])
+    assert client.items["7"] == {k: serializer.serialize(v) for k, v in items[7].items()}
+    assert ddb_access.get_consumed_capacity()["write"] == 60
+
+
+def test_batch_write_gives_up(monkeypatch):
+    class StuckClient(ThrottlingClient):
+        def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+            return {"UnprocessedItems": RequestItems}
+
+    use_client(monkeypatch, StuckClient())
+    try:
+        ddb_access.batch_write_items(table_name, [{"pk": "match", "sk": "1"}])
+    except Exception as ex:
+        assert "unprocessed" in str(ex)
+    else:
+        assert False, "batch_write_items did not raise"
+
+
+class CapacityClient:
+    """DynamoDB stand-in with write capacity per second and latency per call.
+
+    Items over the capacity left in the current second come back in
+    UnprocessedItems, a call with no capacity left at all is throttled.
+    """
+
+    def __init__(self, capacity, latency=0.02):
+        self.capacity = capacity
+        self.latency = latency
+        self.items = {}
+        self.window = 0
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+        time.sleep(self.latency)
+        requests = RequestItems[table_name]
+        with self.lock:
+            window = int(time.time())
+            if window != self.window:
+                self.window, self.used = window, 0
+            accepted = min(len(requests), self.capacity - self.used)
+            if accepted == 0:
+                raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "throttled"}},
+                                  "BatchWriteItem")
+            self.used += accepted
+            for request in requests[0:accepted]:
+                item = request["PutRequest"]["Item"]
+                self.items[item["sk"]["S"]] = item
+        unprocessed = {table_name: requests[accepted:]} if accepted < len(requests) else {}
+        return {"UnprocessedItems": unprocessed}
+
+
+def test_aimd_limit_halves_once_per_round():
+    limiter = ddb_access.AimdLimiter(4, 8)
+    tickets = [limiter.acquire() for num in range(4)]
+    for ticket in tickets:
+        limiter.release(ticket, True)
+    assert limiter.limit == 2
+    for num in range(10):
+        limiter.release(limiter.acquire(), False)
+    assert 2 + 1 < limiter.limit < 8
+    limiter.release(limiter.acquire(), True)
+    assert 1.5 < limiter.limit < 4
+
+
+def test_batch_write_backs_off_under_throttling(monkeypatch):
+    client = CapacityClient(capacity=300, latency=0.005)
+    use_client(monkeypatch, client)
+    # the stand-in needs the next second for the last 200 items
+    monkeypatch.setattr(ddb_access, "backoff_base", 0.05)
+    monkeypatch.setattr(ddb_access, "backoff_cap", 0.5)
+    monkeypatch.setattr(ddb_access, "max_attempts", 30)
+
+    items = [{"pk": "eloprogress", "sk": str(num), "data": num} for num in range(500)]
+    write_stats = ddb_access.batch_write_items(table_name, items)
+    assert len(client.items) == 500
+    assert write_stats["items"] == 500 and write_stats["batches"] == 20
+    assert write_stats["retries"] > 0
+    assert write_stats["concurrency"] < ddb_access.max_workers
+
+
+def benchmark(num_items=10000, capacity=2000, latency=0.05):
+    """Serial writes (the old reader_writeddb loop), fixed parallel and AIMD against the same capacity."""
+    items = [{"pk": "eloprogress", "sk": str(num), "data": "x" * 100} for num in range(num_items)]
+    ddb_access.backoff_cap = 1
+    ddb_access.max_attempts = 50
+    ddb_access.logger.setLevel("ERROR")
+    original_workers = ddb_access.max_workers
+    for name, workers, adaptive in [("serial", 1, False), ("fixed x" + str(original_workers), original_workers, False),
+                                    ("aimd", original_workers, True)]:
+        ddb_access.max_workers = workers
+        ddb_access.adaptive_concurrency = adaptive
+        ddb_access.set_client(CapacityClient(capacity, latency))
+        time.sleep(1 - time.time() % 1)  # start on a fresh capacity second
+        write_stats = ddb_access.batch_write_items(table_name, items)
+        print(f"{name:>9}: {write_stats['items_per_second']:7.1f} items/s in {write_stats['seconds']:6.2f} s, "
+              f"{write_stats['retries']:4d} retries, {write_stats['throttles']:4d} throttles, "
+              f"final concurrency {write_stats['concurrency']}")
+    ddb_access.max_workers = original_workers
+    ddb_access.adaptive_concurrency = True
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,78 @@
+"""
+Checks for the ELO parameter backtesting harness using test/gamestats4.
+
+    python -m pytest test/test_elo_backtest.py
+"""
+import math
+import os
+import sys
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "elo"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import elo_backtest
+from elo_backtest import BacktestCorpus, backtest, make_parameter_sets, run_grid
+from elo_replay import DirectoryMatchSource, EloReplay
+
+match_region_type = "unk#6"
+production_parameters = {"global_K": 200, "floor": 1200, "logdistancefactor": math.log(10) / 400,
+                         "kreduction": [900, 75, 0.5, 3, 20, 0.2]}
+
+
+def get_records():
+    return DirectoryMatchSource(os.path.join(test_dir, "gamestats4"), match_region_type).matches()
+
+
+def test_corpus_layout():
+    records = get_records()
+    corpus = BacktestCorpus.from_records(records)
+    assert len(corpus) == len(records)
+    assert corpus.offsets[-1] == len(corpus.players)
+    assert len(corpus.guids) == len(set(corpus.guids))
+    for m, record in enumerate(records):
+        assert corpus.offsets[m + 1] - corpus.offsets[m] == len(record["stats"])
+
+
+def test_production_parameters_replay_like_replay_engine(monkeypatch):
+    records = get_records()
+    elo_replay = EloReplay(match_region_type)
+    elo_replay.run(records)
+
+    final_elos = {}
+    original = elo_backtest.process_elos
+
+    def recording_process_elos(player_scores, elo_dict, ep, kreduction):
+        result = original(player_scores, elo_dict, ep, kreduction)
+        for p, elo in result[1].items():
+            final_elos[p] = elo.elo
+        return result
+
+    monkeypatch.setattr(elo_backtest, "process_elos", recording_process_elos)
+    corpus = BacktestCorpus.from_records(records)
+    result = backtest(corpus, production_parameters)
+
+    assert result["matches_scored"] > 0
+    assert len(final_elos) == len(elo_replay.elos)
+    for code, elo in final_elos.items():
+        assert abs(elo_replay.elos[corpus.guids[code]] - elo) < 1e-9
+
+
+def test_grid_is_ranked():
+    corpus = BacktestCorpus.from_records(get_records())
+    parameter_sets = make_parameter_sets({"global_K": [50, 200], "floor": [1200],
+                                          "logdistancefactor": [math.log(10) / 400],
+                                          "kreduction": [[900, 75, 0.5, 3, 20, 0.2]]})
+    assert len(parameter_sets) == 2
+    results = run_grid(corpus, parameter_sets, processes=2)
+    assert len(results) == 2
+    assert results[0]["log_loss"] <= results[1]["log_loss"]
+    for result in results:
+        assert 0 <= result["brier"] <= 1
+        assert 0 <= result["accuracy"] <= 1
+    assert results == run_grid(corpus, parameter_sets, processes=1)
+
+
+if __name__ == "__main__":
+    corpus = BacktestCorpus.from_records(get_records())
+    print(elo_backtest.format_report(run_grid(corpus, make_parameter_sets(elo_backtest.DEFAULT_GRID))))
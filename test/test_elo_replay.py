@@ -0,0 +1,75 @@
+"""
+Checks for the offline ELO replay engine using test/gamestats4 as the match history.
+
+    python -m pytest test/test_elo_replay.py
+"""
+import os
+import sys
+import tempfile
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "elo"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+from elo_replay import DirectoryMatchSource, EloReplay
+
+match_region_type = "unk#6"
+
+
+def get_records():
+    return DirectoryMatchSource(os.path.join(test_dir, "gamestats4"), match_region_type).matches()
+
+
+def test_replay_is_chronological():
+    records = get_records()
+    assert len(records) > 5
+    match_ids = [record["match_id"] for record in records]
+    assert match_ids == sorted(match_ids)
+
+    elo_replay = EloReplay(match_region_type)
+    elo_replay.run(records)
+    assert elo_replay.matches_processed == len(records)
+    assert elo_replay.last_match_id == match_ids[-1]
+    assert max(elo_replay.games.values()) > 1
+
+
+def test_resume_from_checkpoint_matches_full_run():
+    records = get_records()
+
+    full_run = EloReplay(match_region_type)
+    full_run.run(records)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint_file = os.path.join(tmp_dir, "checkpoint.json")
+        interrupted = EloReplay(match_region_type, checkpoint_file, checkpoint_every=2)
+        interrupted.run(records[0:5])
+
+        resumed = EloReplay(match_region_type, checkpoint_file, checkpoint_every=2)
+        resumed.run(records)
+
+    assert resumed.matches_processed == full_run.matches_processed
+    assert resumed.games == full_run.games
+    for guid, elo in full_run.elos.items():
+        assert abs(resumed.elos[guid] - elo) < 1e-9
+    assert len(resumed.eloprogress_items) == len(full_run.eloprogress_items)
+
+
+def test_prepare_items():
+    elo_replay = EloReplay(match_region_type)
+    elo_replay.run(get_records())
+
+    items = elo_replay.prepare_items(include_expired_progress=True)
+    player_items = [item for item in items if item["sk"] == "elo#" + match_region_type]
+    progress_items = [item for item in items if item["pk"].startswith("eloprogress#")]
+    assert len(player_items) == len(elo_replay.elos)
+    assert len(progress_items) == len(elo_replay.eloprogress_items)
+
+    # 2021 matches are long past their 3 month ExpirationTime
+    assert len(elo_replay.prepare_items()) == len(player_items)
+
+
+if __name__ == "__main__":
+    test_replay_is_chronological()
+    test_resume_from_checkpoint_matches_full_run()
+    test_prepare_items()
+    print("Replay OK")
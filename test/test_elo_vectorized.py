@@ -0,0 +1,123 @@
+"""
+Parity and speed checks for elo_calc.update_elos_vectorized.
+
+Run with pytest for the parity checks or directly for the benchmark:
+    python test/test_elo_vectorized.py
+"""
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import timeit
+
+import pytest
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "elo"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import elo_calc
+from elo_calc import Player, process_elos
+from match_context import convert_stats_to_dict
+
+elo_calc.logger.setLevel(logging.WARNING)
+tolerance = 1e-9
+
+
+@pytest.fixture(autouse=True)
+def both_paths_at_every_size(monkeypatch):
+    monkeypatch.setattr(elo_calc, "vectorized_min_players", 0)  # compare both paths at every match size
+    monkeypatch.setattr(elo_calc, "vectorized", elo_calc.vectorized)  # run_both_paths switches it
+
+
+def run_both_paths(player_scores, elo_dict):
+    """Return elo deltas calculated by the loop and by the vectorized path."""
+    elo_calc.vectorized = False
+    loop_deltas, loop_elos = process_elos(player_scores, elo_dict)
+    elo_calc.vectorized = True
+    vector_deltas, vector_elos = process_elos(player_scores, elo_dict)
+    return loop_deltas, loop_elos, vector_deltas, vector_elos
+
+
+def assert_parity(player_scores, elo_dict):
+    loop_deltas, loop_elos, vector_deltas, vector_elos = run_both_paths(player_scores, elo_dict)
+    assert loop_deltas.keys() == vector_deltas.keys()
+    for guid in loop_deltas:
+        assert abs(loop_deltas[guid] - vector_deltas[guid]) < tolerance, guid
+        assert abs(loop_elos[guid].elo - vector_elos[guid].elo) < tolerance, guid
+        assert loop_elos[guid].games == vector_elos[guid].games
+
+
+def gamestats4_matches():
+    """Make (player_scores, elo_dict) pairs out of every round 2 file in gamestats4."""
+    rnd = random.Random(1609817356)
+    matches = []
+    for file_name in sorted(glob.glob(os.path.join(test_dir, "gamestats4", "*_round_2_*.json"))):
+        with open(file_name) as file:
+            gamestats = json.load(file)
+        stats = convert_stats_to_dict(gamestats["stats"])
+        winner = gamestats["gameinfo"]["winner"]
+        player_scores = {}
+        elo_dict = {}
+        for guid, player_stats in stats.items():
+            win_multiplier = 1.25 if player_stats["team"] == winner else 1
+            score = int((player_stats["categories"].get("kills", 0) - player_stats["categories"].get("suicides", 0)) * win_multiplier)
+            player_scores[guid] = Player(score, 600, rnd.randint(0, 40))
+            if rnd.random() > 0.2:  # leave some players without prior elo
+                elo_dict[guid] = rnd.uniform(1200, 2200)
+        matches.append((player_scores, elo_dict))
+    return matches
+
+
+def synthetic_match(players, seed):
+    rnd = random.Random(seed)
+    player_scores = {}
+    elo_dict = {}
+    for num in range(players):
+        guid = "guid%02d" % num
+        player_scores[guid] = Player(rnd.randint(-5, 40), 600, rnd.randint(0, 30))
+        elo_dict[guid] = rnd.uniform(1200, 2600)
+    return player_scores, elo_dict
+
+
+def test_parity_gamestats4():
+    matches = gamestats4_matches()
+    assert len(matches) > 0
+    for player_scores, elo_dict in matches:
+        assert_parity(player_scores, elo_dict)
+
+
+def test_parity_edge_cases():
+    # everyone scored zero, negative scores, equal elos (scorefactor_elo == 0.5)
+    zeros = {g: Player(0, 600, 5) for g in ["a", "b", "c", "d", "e", "f"]}
+    assert_parity(zeros, {g: 1500 for g in zeros})
+    negatives = {"a": Player(-3, 600, 1), "b": Player(-1, 600, 30), "c": Player(4, 600, 10)}
+    assert_parity(negatives, {"a": 1400, "b": 1400, "c": 3000})
+    assert_parity({"a": Player(3, 600, 1)}, {"a": 1500})
+
+
+def test_parity_synthetic():
+    for players in [2, 6, 12, 24]:
+        for seed in range(20):
+            assert_parity(*synthetic_match(players, seed))
+
+
+def benchmark(number=200):
+    for players in [6, 12, 24]:
+        player_scores, elo_dict = synthetic_match(players, players)
+        results = {}
+        for path in [False, True]:
+            elo_calc.vectorized = path
+            results[path] = timeit.timeit(lambda: process_elos(player_scores, elo_dict), number=number) / number
+        print(f"{players:>3} players: loop {results[False] * 1000:.3f} ms, vectorized {results[True] * 1000:.3f} ms, speedup x{results[False] / results[True]:.1f}")
+
+
+if __name__ == "__main__":
+    elo_calc.vectorized_min_players = 0
+    test_parity_gamestats4()
+    test_parity_edge_cases()
+    test_parity_synthetic()
+    print("Parity OK")
+    benchmark()
@@ -0,0 +1,136 @@
+"""
+Checks for the materialized leaderboards in layers/ddb_access/python/leaderboards.py.
+
+    python -m pytest test/test_leaderboards.py
+"""
+import json
+import logging
+import os
+import random
+import sys
+
+from botocore.exceptions import ClientError
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import leaderboards
+
+leaderboards.logger.setLevel(logging.WARNING)
+board_name = "leaderelo#na#6"
+
+
+class MemoryTable:
+    """Board items with conditional writes and a paged gsi1 query."""
+
+    def __init__(self):
+        self.items = {}
+        self.leader_items = []  # what the gsi1 query returns
+        self.puts = 0
+        self.conflicts = 0  # number of puts to fail as if another match wrote first
+
+    def get_item(self, Key, ConsistentRead=False):
+        item = self.items.get(Key["sk"])
+        return {} if item is None else {"Item": dict(item)}
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        current = self.items.get(Item["sk"])
+        if ConditionExpression == "attribute_not_exists(pk)":
+            ok = current is None
+        else:
+            ok = current is not None and current["version"] == ExpressionAttributeValues[":version"]
+        if self.conflicts > 0:
+            self.conflicts -= 1
+            ok = False
+        if not ok:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}}, "PutItem")
+        self.puts += 1
+        self.items[Item["sk"]] = Item
+
+    def query(self, IndexName, KeyConditionExpression, ProjectionExpression, ExclusiveStartKey=0):
+        page = self.leader_items[ExclusiveStartKey: ExclusiveStartKey + 100]
+        response = {"Items": page}
+        if ExclusiveStartKey + 100 < len(self.leader_items):
+            response["LastEvaluatedKey"] = ExclusiveStartKey + 100
+        return response
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        item = self.items.setdefault(Key["sk"], dict(Key, version=0))
+        item["data"] = ExpressionAttributeValues[":data"]
+        item["size"] = ExpressionAttributeValues[":size"]
+        item["version"] += 1
+
+
+def elo_item(guid, elo):
+    return {"pk": "player#" + guid, "sk": "elo#na#6", "gsi1pk": board_name, "gsi1sk": str(elo).zfill(3),
+            "data": str(elo), "games": 10, "updated": "2023-01-01T00:00:00", "real_name": "name" + guid}
+
+
+def get_board(table):
+    return json.loads(table.items[board_name]["data"])
+
+
+def test_incremental_board_and_rebuild():
+    rng = random.Random(7)
+    table = MemoryTable()
+    elos = {}
+    for match in range(200):
+        items = []
+        for guid in rng.sample([str(num) for num in range(400)], 12):
+            elos[guid] = rng.randint(500, 2500)
+            items.append(elo_item(guid, elos[guid]))
+        leaderboards.update_boards(table, items)
+
+    board = get_board(table)
+    assert len(board) == leaderboards.board_size
+    assert [entry["value"] for entry in board] == sorted([entry["value"] for entry in board], reverse=True)
+    for entry in board:
+        assert entry["value"] == elos[entry["guid"]]
+    assert len({entry["guid"] for entry in board}) == len(board)
+
+    # players who fell off the board come back with a rebuild
+    table.leader_items = [elo_item(guid, elo) for guid, elo in elos.items()]
+    version = table.items[board_name]["version"]
+    leaderboards.rebuild_board(table, board_name)
+    expected = sorted(elos.values(), reverse=True)[0:leaderboards.board_size]
+    assert [entry["value"] for entry in get_board(table)] == expected
+    assert table.items[board_name]["version"] == version + 1
+
+    # ingest keeps working on top of a rebuilt board
+    leaderboards.update_boards(table, [elo_item("new", 9999)])
+    assert get_board(table)[0]["guid"] == "new"
+
+
+def test_player_is_replaced_not_duplicated():
+    table = MemoryTable()
+    leaderboards.update_boards(table, [elo_item("a", 1500), elo_item("b", 1400)])
+    leaderboards.update_boards(table, [elo_item("a", 1300)])
+    assert [(entry["guid"], entry["value"]) for entry in get_board(table)] == [("b", 1400.0), ("a", 1300.0)]
+    puts = table.puts
+    leaderboards.update_boards(table, [elo_item("a", 1300)])
+    assert table.puts == puts  # nothing changed, nothing written
+
+
+def test_concurrent_update_is_merged_again():
+    table = MemoryTable()
+    leaderboards.update_boards(table, [elo_item("a", 1500)])
+    table.conflicts = 2
+    leaderboards.update_boards(table, [elo_item("b", 1600)])
+    assert [entry["guid"] for entry in get_board(table)] == ["b", "a"]
+    assert table.items[board_name]["version"] == 2
+
+
+def test_non_leader_items_are_ignored():
+    items = [elo_item("a", 1500), {"pk": "eloprogress#a", "sk": "na#6#1", "gsi1pk": "eloprogressmatch", "gsi1sk": "1"}]
+    assert list(leaderboards.get_candidates(items).keys()) == [board_name]
+
+
+def test_cleared_board_starts_over():
+    table = MemoryTable()
+    leaderboards.update_boards(table, [elo_item("a", 1500), elo_item("b", 1400)])
+    version = table.items[board_name]["version"]
+    leaderboards.clear_boards(table, [board_name])
+    assert get_board(table) == []
+    assert table.items[board_name]["version"] == version + 1
+    leaderboards.update_boards(table, [elo_item("c", 1200)])
+    assert [entry["guid"] for entry in get_board(table)] == ["c"]
@@ -0,0 +1,137 @@
+"""
+Checks for the shared post-processing match context using a gamestats4 match.
+
+DynamoDB is replaced with botocore's Stubber on the ddb_access client, no AWS access is needed.
+    python -m pytest test/test_match_context.py
+"""
+import glob
+import json
+import logging
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.stub import Stubber
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing", "elo"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import ddb_access
+import elo_calc
+from match_context import convert_stats_to_dict, convert_wstats_to_dict, load_match_context
+from match_shards import match_pk
+
+elo_calc.logger.setLevel(logging.WARNING)
+match_id = "1609817356"
+match_region_type = "na#6"
+table_name = "rtcwprostats-test"
+serializer = TypeSerializer()
+
+
+def wire(item):
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+
+def read_round(round_num):
+    file_name = glob.glob(os.path.join(test_dir, "gamestats4", f"gameStats_match_{match_id}_round_{round_num}_*.json"))[0]
+    with open(file_name) as file:
+        return json.load(file)
+
+
+def make_table(elo_guids, with_gamelogs=True):
+    round1 = read_round(1)
+    round2 = read_round(2)
+    table = boto3.resource("dynamodb", region_name="us-east-1",
+                           aws_access_key_id="local", aws_secret_access_key="local").Table(table_name)
+    ddb_client = boto3.client("dynamodb", region_name="us-east-1",
+                              aws_access_key_id="local", aws_secret_access_key="local")
+    stubber = Stubber(ddb_client)
+
+    match_items = [
+        {"pk": "statsall", "sk": match_id, "data": json.dumps(round2["stats"])},
+        {"pk": "wstatsall", "sk": match_id, "data": json.dumps(round2["wstats"])},
+        {"pk": match_pk(match_id), "sk": match_id + "2", "data": json.dumps(round2["gameinfo"]),
+         "lsipk": match_region_type + "#" + match_id + "2"}
+    ]
+    if with_gamelogs:
+        # batch_get_item does not keep the order of keys
+        match_items.append({"pk": "gamelogs", "sk": match_id + "2", "data": json.dumps(round2["gamelog"])})
+        match_items.append({"pk": "gamelogs", "sk": match_id + "1", "data": json.dumps(round1["gamelog"])})
+    stubber.add_response("batch_get_item", {"Responses": {table_name: [wire(item) for item in match_items]}})
+
+    player_items = []
+    for guid in elo_guids:
+        player_items.append({"pk": "player#" + guid, "sk": "realname", "data": "name" + guid[0:4]})
+        player_items.append({"pk": "player#" + guid, "sk": "elo#" + match_region_type, "data": 1500, "games": 10})
+    stubber.add_response("batch_get_item", {"Responses": {table_name: [wire(item) for item in player_items]}})
+    if not with_gamelogs:
+        stubber.add_response("batch_write_item", {"UnprocessedItems": {}})
+    stubber.activate()
+    ddb_access.set_client(ddb_client)
+    return table, round1, round2
+
+
+class RecordingClient:
+    def __init__(self):
+        self.items = []
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for table, requests in RequestItems.items():
+            self.items.extend(request["PutRequest"]["Item"] for request in requests)
+        return {"UnprocessedItems": {}, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def test_load_match_context():
+    stats = convert_stats_to_dict(read_round(2)["stats"])
+    elo_guids = sorted(stats.keys())[0:3]
+    table, round1, round2 = make_table(elo_guids)
+
+    match_context = load_match_context(table, match_id, "local")
+    assert "error" not in match_context
+    assert match_context["match_region_type"] == match_region_type
+    assert match_context["stats"] == stats
+    assert match_context["wstats"] == convert_wstats_to_dict(round2["wstats"])
+    assert match_context["match"] == round2["gameinfo"]
+    assert match_context["gamelogs"] == round1["gamelog"] + round2["gamelog"]
+    assert sorted(match_context["real_names"].keys()) == elo_guids
+    assert sorted(match_context["player_items"]["elo#" + match_region_type].keys()) == elo_guids
+    assert "aggstats#" + match_region_type not in match_context["player_items"]
+
+
+def test_elo_from_match_context():
+    stats = convert_stats_to_dict(read_round(2)["stats"])
+    elo_guids = sorted(stats.keys())[0:3]
+    table, round1, round2 = make_table(elo_guids)
+    match_context = load_match_context(table, match_id, "local")
+
+    ddb_client = RecordingClient()
+    ddb_access.set_client(ddb_client)
+    elo_calc.process_rtcwpro_elo(table, ddb_client, match_id, "local", match_context)
+
+    winner, duration = elo_calc.get_winner_duration(round2["gameinfo"])
+    elo_games = {guid: 10 for guid in elo_guids}
+    player_scores = elo_calc.calculate_player_scores(stats, match_context["wstats"], winner, duration, elo_games)
+    elo_deltas, elos = elo_calc.process_elos(player_scores, {guid: 1500 for guid in elo_guids})
+
+    player_elo_items = [item for item in ddb_client.items if item["sk"]["S"] == "elo#" + match_region_type]
+    assert len(player_elo_items) == len(elos)
+    for item in player_elo_items:
+        guid = item["pk"]["S"].split("#")[1]
+        assert item["data"]["S"] == str(int(round(elos[guid].elo, 0)))
+        if guid in elo_guids:
+            assert item["real_name"]["S"] == "name" + guid[0:4]
+
+
+def test_standalone_elo_loads_context_without_gamelogs(monkeypatch):
+    stats = convert_stats_to_dict(read_round(2)["stats"])
+    elo_guids = sorted(stats.keys())[0:3]
+    table, round1, round2 = make_table(elo_guids, with_gamelogs=False)
+    board_items = []
+    monkeypatch.setattr(elo_calc, "update_boards", lambda ddb_table, items: board_items.extend(items))
+
+    message = elo_calc.process_rtcwpro_elo(table, None, match_id, "local")
+    assert message == "Elo progress records inserted.\n"
+    assert len(board_items) == len(stats)
+    assert all(item["sk"] == "elo#" + match_region_type for item in board_items)
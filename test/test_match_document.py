@@ -0,0 +1,119 @@
+"""
+Checks that precomputed /stats/{match_id} documents are served like the
+response the retriever assembles itself.
+
+    python -m pytest test/test_match_document.py
+"""
+import glob
+import json
+import logging
+import os
+import sys
+
+import pytest
+from boto3.dynamodb.types import Binary
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "postprocessing"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "delivery", "retriever"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+os.environ.setdefault("RTCWPROSTATS_TABLE_NAME", "rtcwprostats-test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import match_document
+import retriever
+from match_shards import match_pk
+
+match_document.logger.setLevel(logging.WARNING)
+retriever.logger.setLevel(logging.WARNING)
+match_id = "1609817356"
+
+
+class Context:
+    log_stream_name = "local"
+
+
+class DocumentTable:
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item):
+        self.items[Item["pk"] + Item["sk"]] = dict(Item, data=Binary(Item["data"]))
+
+    def get_item(self, Key):
+        item = self.items.get(Key["pk"] + Key["sk"])
+        return {} if item is None else {"Item": dict(item)}
+
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    monkeypatch.setattr(retriever.response_cache, "route_ttls", {})  # these check the responses themselves
+
+
+def get_raw_items():
+    """Items of a gamestats4 match the way they are stored by read_match."""
+    items = []
+    for round_num in ["1", "2"]:
+        file_name = glob.glob(os.path.join(test_dir, "gamestats4", f"gameStats_match_{match_id}_round_{round_num}_*.json"))[0]
+        with open(file_name) as file:
+            content = json.load(file)
+        if round_num == "2":
+            items.append({"pk": "statsall", "sk": match_id, "gsi1pk": "statsall#na#6", "data": json.dumps(content["stats"])})
+            items.append({"pk": "wstatsall", "sk": match_id, "data": json.dumps(content["wstats"])})
+        items.append({"pk": match_pk(match_id), "sk": match_id + round_num, "data": json.dumps(content["gameinfo"])})
+        items.append({"pk": "gamelogs", "sk": match_id + round_num, "data": json.dumps(content["gamelog"])})
+    return items
+
+
+def get_stats(table):
+    event = {"resource": "/stats/{match_id}", "pathParameters": {"match_id": match_id}}
+    original_table, original_get_batch_items = retriever.ddb_table, retriever.get_batch_items
+    retriever.ddb_table = table
+    retriever.get_batch_items = lambda item_list, ddb_table, log_stream_name: get_raw_items()
+    try:
+        return retriever.handler(event, Context())["body"]
+    finally:
+        retriever.ddb_table, retriever.get_batch_items = original_table, original_get_batch_items
+
+
+def test_document_is_served_like_assembled_response():
+    table = DocumentTable()
+    assembled = json.loads(get_stats(table))  # no document yet
+
+    match_document.save_match_document(table, match_id, get_raw_items())
+    assert table.items["statsdoc" + match_id]["data_enc"] == "zlib"
+    served = json.loads(get_stats(table))
+    assert served == assembled
+    assert served["type"] == "na#6"
+    assert sorted(served["gamelog"].keys()) == [match_id + "1", match_id + "2"]
+
+
+def test_document_is_compressed():
+    document = match_document.build_match_document(match_id, get_raw_items())
+    encoded = match_document.encode_document(document)
+    assert len(encoded["data"]) * 3 < len(json.dumps(document))
+    assert json.loads(match_document.decode_document(dict(encoded, data=Binary(encoded["data"])))) == document
+
+
+def test_missing_items_are_not_saved():
+    table = DocumentTable()
+    items = [item for item in get_raw_items() if item["pk"] != "statsall"]
+    match_document.save_match_document(table, match_id, items)
+    assert table.items == {}
+
+
+def test_split_gamelog_is_served_whole(monkeypatch):
+    gamelog_item = [item for item in get_raw_items() if item["pk"] == "gamelogs" and item["sk"] == match_id + "2"][0]
+    gamelog = json.loads(gamelog_item["data"])
+    table = DocumentTable()
+    table.items["gamelogs" + match_id + "2"] = {"pk": "gamelogs", "sk": match_id + "2", "data_parts": 2}
+    part_items = [{"pk": "gamelogs", "sk": match_id + "2#part1", "data": json.dumps(gamelog[0:100])},
+                  {"pk": "gamelogs", "sk": match_id + "2#part2", "data": json.dumps(gamelog[100:])}]
+    monkeypatch.setattr(retriever, "ddb_table", table)
+    monkeypatch.setattr(retriever, "get_batch_items", lambda item_list, ddb_table, log_stream_name:
+                        [item for item in part_items if {"pk": item["pk"], "sk": item["sk"]} in item_list])
+
+    event = {"resource": "/gamelogs/{match_round_id}", "pathParameters": {"match_round_id": match_id + "2"}}
+    assert json.loads(retriever.handler(event, Context())["body"]) == gamelog
+    part_items.pop()
+    assert "error" in json.loads(retriever.handler(event, Context())["body"])
@@ -0,0 +1,255 @@
+"""
+Checks for monthly match shards: keys, scatter-gather reads in the retriever
+and the migration of the old single match partition.
+
+    python -m pytest test/test_match_shards.py
+"""
+import json
+import logging
+import os
+import sys
+
+import pytest
+import time
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "delivery", "retriever"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "storage", "read_match"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+os.environ.setdefault("RTCWPROSTATS_TABLE_NAME", "rtcwprostats-test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import match_shards
+import migrate_match_shards
+import retriever
+
+retriever.logger.setLevel(logging.ERROR)
+migrate_match_shards.logger.setLevel(logging.ERROR)
+day = 60 * 60 * 24
+
+
+class Context:
+    log_stream_name = "local"
+
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    monkeypatch.setattr(retriever.response_cache, "route_ttls", {})  # these check the responses themselves
+
+
+def test_match_pk_is_the_month_of_the_match():
+    assert match_shards.match_pk("1609817356") == "match#202101"
+    assert match_shards.match_pk(1612137599) == "match#202101"  # 2021-01-31 23:59:59 UTC
+    assert match_shards.is_match_pk("match#202101") and match_shards.is_match_pk("match")
+    assert not match_shards.is_match_pk("matchsummary")
+
+
+def test_shards_between_months():
+    shards = match_shards.shards_between(1637000000, 1643000000)  # 2021-11-15 to 2022-01-24
+    assert shards == ["match#202201", "match#202112", "match#202111"]
+    assert match_shards.shards_between(1637000000, 1643000000, ascending=True) == shards[::-1]
+    assert match_shards.shards_between(0, 1601510400)[-1] == "match#" + match_shards.first_month
+
+
+def test_query_shards_merges_and_stops_at_limit(monkeypatch):
+    monkeypatch.setattr(match_shards, "shards_per_wave", 2)
+    shard_items = {"match#202103": ["3c", "3b", "3a"], "match#202102": ["2b", "2a"],
+                   "match#202101": ["1b", "1a"], "match#202012": ["0a"]}
+    queried = []
+
+    def query(pk):
+        queried.append(pk)
+        return [{"sk": sk} for sk in shard_items[pk]]
+
+    def query_ascending(pk):
+        return [{"sk": sk} for sk in sorted(shard_items[pk])]
+
+    items = match_shards.query_shards(list(shard_items.keys()), query, "sk", limit=4)
+    assert [item["sk"] for item in items] == ["3c", "3b", "3a", "2b"]
+    assert sorted(queried) == ["match#202102", "match#202103"]
+
+    items = match_shards.query_shards(list(shard_items.keys())[::-1], query_ascending, "sk", ascending=True)
+    assert [item["sk"] for item in items] == ["0a", "1a", "1b", "2a", "2b", "3a", "3b", "3c"]
+
+
+def test_recent_matches_are_gathered_from_shards(monkeypatch):
+    now = int(time.time())
+    rounds = [str(now - num * day) + "2" for num in range(1, 80, 3)]
+    queried = []
+
+    def get_range(index_name, pk, sklow, skhigh, table, log_stream_name, limit, ascending, page=None):
+        queried.append(pk)
+        start_key = page["start_key"] if page is not None else None
+        items = [{"pk": pk, "sk": sk, "lsipk": "na#6#" + sk, "data": json.dumps({"map": "mp_ice"})}
+                 for sk in sorted(rounds, reverse=True)
+                 if match_shards.match_pk(sk[0:-1]) == pk and sklow <= sk <= skhigh
+                 and (start_key is None or sk < start_key["sk"])]
+        if len(items) == 0:
+            return retriever.make_error_dict("[x] Items do not exist: ", pk)
+        return items[0:limit]
+
+    monkeypatch.setattr(retriever, "get_range", get_range)
+    event = {"resource": "/matches/{proxy+}", "pathParameters": {"proxy": "recent/60"}}
+    data = json.loads(retriever.handler(event, Context())["body"])
+    expected = [sk for sk in sorted(rounds, reverse=True) if sk >= str(now - 60 * day)]
+    assert [match["match_round_id"] for match in data] == expected
+    assert sorted(set(queried)) == sorted(match_shards.shards_between(now - 60 * day, now))
+    assert data[0]["type"] == "na#6"
+
+    # 100 per page
+    rounds.extend([str(now - num * 1000) + "1" for num in range(1, 250)])
+    event["queryStringParameters"] = {"paginate": "true"}
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    paged = []
+    while True:
+        response = json.loads(retriever.handler(event, Context())["body"])
+        paged.extend(match["match_round_id"] for match in response["items"])
+        if response["next"] is None:
+            break
+        event["queryStringParameters"] = {"cursor": response["next"]}
+    assert paged == [sk for sk in sorted(rounds, reverse=True) if sk >= str(now - 60 * day)]
+    assert len(paged) > 200
+
+    event["queryStringParameters"] = None
+    monkeypatch.setattr(retriever, "get_range", lambda *args: retriever.make_error_dict("[x] Client error calling database: ", ""))
+    assert "Client error" in json.loads(retriever.handler(event, Context())["body"])["error"]
+
+
+def test_sparse_server_reads_a_bounded_number_of_shards(monkeypatch):
+    now = int(time.time())
+    rounds = [str(now - 90 * day) + "2", str(now - 900 * day) + "2"]  # a quiet server, 3 and 30 months ago
+    requests = []
+
+    def get_begins(pk_name, pk, begins_with, ddb_table, index_name, skname, projections, log_stream_name, limit,
+                   ascending, page=None):
+        requests[-1].append(pk)
+        start_key = page["start_key"] if page is not None else None
+        items = [{"pk": pk, "sk": sk, "gsi1pk": pk, "gsi1sk": "virg#" + sk, "lsipk": "na#6#" + sk,
+                  "data": json.dumps({"map": "mp_ice"})}
+                 for sk in sorted(rounds, reverse=True)
+                 if match_shards.match_pk(sk[0:-1]) == pk and (start_key is None or sk < start_key["sk"])]
+        if len(items) == 0:
+            return retriever.make_error_dict("[x] Items do not exist: ", pk)
+        return items[0:limit]
+
+    monkeypatch.setattr(retriever, "get_begins", get_begins)
+    event = {"resource": "/matches/{proxy+}", "pathParameters": {"proxy": "server/virg"}}
+    requests.append([])
+    data = json.loads(retriever.handler(event, Context())["body"])
+    assert [match["match_round_id"] for match in data] == rounds[0:1]
+    assert sorted(requests[-1]) == sorted(match_shards.all_shards()[0:retriever.browse_shards])
+
+    event["queryStringParameters"] = {"paginate": "true"}
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    paged = []
+    while True:
+        requests.append([])
+        response = json.loads(retriever.handler(event, Context())["body"])
+        paged.extend(match["match_round_id"] for match in response["items"])
+        if response["next"] is None:
+            break
+        event["queryStringParameters"] = {"cursor": response["next"]}
+    assert paged == rounds
+    paged_requests = requests[1:]
+    assert max(len(shards) for shards in paged_requests) <= retriever.browse_shards
+    assert sorted(sum(paged_requests, [])) == sorted(match_shards.all_shards())  # every month once
+
+
+def test_recent_matches_since_feed(monkeypatch):
+    now = int(time.time())
+    rounds = [str(now - num * day) + "1" for num in range(1, 40)]
+    queried = []
+
+    def get_range(index_name, pk, sklow, skhigh, table, log_stream_name, limit, ascending, page=None):
+        queried.append((pk, sklow, skhigh, ascending))
+        items = [{"pk": pk, "sk": sk, "lsipk": "eu#3#" + sk, "data": json.dumps({"map": "te_frostbite"})}
+                 for sk in sorted(rounds, reverse=not ascending)
+                 if match_shards.match_pk(sk[0:-1]) == pk and sklow <= sk <= skhigh]
+        if len(items) == 0:
+            return retriever.make_error_dict("[x] Items do not exist: ", pk)
+        return items[0:limit]
+
+    monkeypatch.setattr(retriever, "get_range", get_range)
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    event = {"resource": "/matches/{proxy+}", "pathParameters": {"proxy": "recent/30"},
+             "queryStringParameters": {"since": str(now - 10 * day)}}
+    response = json.loads(retriever.handler(event, Context())["body"])
+    expected = sorted(sk for sk in rounds if sk >= str(now - 10 * day))
+    assert [match["match_round_id"] for match in response["items"]] == expected
+    assert all(ascending and skhigh == "9" for pk, sklow, skhigh, ascending in queried)
+
+    event["queryStringParameters"] = {"since": response["since"]}
+    response = json.loads(retriever.handler(event, Context())["body"])
+    assert response["items"] == []
+
+    rounds.append(str(now - 600) + "1")
+    rounds.append(str(now - 600) + "2")
+    rounds.append(str(now - day - 4 * 60 * 60) + "1")  # started long before, outside the overlap
+    event["queryStringParameters"] = {"since": response["since"]}
+    response = json.loads(retriever.handler(event, Context())["body"])
+    assert [match["match_round_id"] for match in response["items"]] == [str(now - 600) + "1", str(now - 600) + "2"]
+
+    event["queryStringParameters"] = {"since": "0"}  # no further back than the days of the path
+    response = json.loads(retriever.handler(event, Context())["body"])
+    assert response["items"][0]["match_round_id"] >= str(now - 30 * day)
+
+
+def test_migration_moves_items_to_shards(monkeypatch):
+    old_items = [{"pk": "match", "sk": "16098173562", "lsipk": "na#6#16098173562", "gsi1pk": "match", "gsi1sk": "srv#16098173562"},
+                 {"pk": "match", "sk": "16384025001", "lsipk": "eu#6#16384025001", "gsi1pk": "match", "gsi1sk": "srv#16384025001"},
+                 {"pk": "match", "sk": "log#16098173562#intake/file.json", "lsipk": "log#intake/file.json#16098173562"},
+                 {"pk": "match", "sk": "restarted"}]
+
+    class PagedTable:
+        name = "rtcwprostats-test"
+
+        def query(self, KeyConditionExpression, ExclusiveStartKey=None):
+            start = 0 if ExclusiveStartKey is None else ExclusiveStartKey["start"]
+            response = {"Items": old_items[start: start + 2]}
+            if start + 2 < len(old_items):
+                response["LastEvaluatedKey"] = {"start": start + 2}
+            return response
+
+    written, deleted = [], []
+    monkeypatch.setattr(migrate_match_shards, "batch_write_items", lambda table_name, items: written.extend(items))
+    monkeypatch.setattr(migrate_match_shards, "batch_delete_items", lambda table_name, keys: deleted.extend(keys))
+
+    shard_counts = migrate_match_shards.migrate(PagedTable(), delete=True)
+    assert shard_counts == {"match#202101": 2, "match#202112": 1}
+    assert written[0] == dict(old_items[0], pk="match#202101", gsi1pk="match#202101")
+    assert written[2]["pk"] == "match#202101" and "gsi1pk" not in written[2]
+    assert deleted == [{"pk": "match", "sk": item["sk"]} for item in old_items[0:3]]
+
+    written.clear()
+    migrate_match_shards.migrate(PagedTable(), dry_run=True)
+    assert written == []
+
+
+def test_server_query_last_match_from_shards(monkeypatch):
+    sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "delivery", "server_query"))
+    import server_query
+    server_query.logger.setLevel(logging.ERROR)
+    now = int(time.time())
+    last_month = str(now - 40 * day)
+    rounds = {match_shards.match_pk(last_month): [last_month + "1", last_month + "2"],
+              match_shards.match_pk(now): [str(now) + "1"]}  # round 2 not played yet
+    queried = []
+
+    class Table:
+        def query(self, IndexName, KeyConditionExpression, **kwargs):
+            pk_condition, sk_condition = KeyConditionExpression.get_expression()["values"]
+            pk = pk_condition.get_expression()["values"][1]
+            if IndexName == "gsi1":
+                return {"Items": [], "Count": 0}
+            queried.append(pk)
+            assert sk_condition.get_expression()["values"][1] == "na#6#"
+            items = [{"pk": pk, "sk": sk, "lsipk": "na#6#" + sk, "data": json.dumps({"round": sk[-1]})}
+                     for sk in sorted(rounds.get(pk, []), reverse=True)]
+            return {"Items": items[0:kwargs["Limit"]]}
+
+    monkeypatch.setattr(server_query, "ddb_table", Table())
+    monkeypatch.setattr(server_query, "get_server_region_code", lambda server_name: "na")
+    response = json.loads(server_query.prepare_last_match_response({"players": {"guid": {}}}, "6", "local", False))
+    assert response[0].startswith("^3Match: " + last_month + " Round 2")
+    assert queried[0] == match_shards.match_pk(now)
+    assert "match" not in queried
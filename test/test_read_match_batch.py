@@ -0,0 +1,172 @@
+"""
+Checks that read_match processes a batch of SQS records with shared lookups
+and writes, and reports only the failed files.
+
+    python -m pytest test/test_read_match_batch.py
+"""
+import glob
+import io
+import json
+import logging
+import os
+import sys
+import types
+
+from botocore.exceptions import ClientError
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "storage", "read_match"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("RTCWPROSTATS_TABLE_NAME", "rtcwprostats-test")
+os.environ.setdefault("RTCWPROSTATS_MATCH_STATE_MACHINE", "state-machine")
+os.environ.setdefault("RTCWPROSTATS_CUSTOM_BUS_ARN", "custom-bus")
+
+import ddb_access
+import read_match
+import reader_writeddb
+import ref_cache
+from match_shards import match_pk
+
+read_match.logger.setLevel(logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class FakeS3:
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self, files):
+        self.files = files
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.files:
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "slow down"}}, "GetObject")
+        return {"Body": io.BytesIO(self.files[Key].encode())}
+
+
+class FakeTable:
+    name = "rtcwprostats-test"
+
+    def __init__(self):
+        self.server_gets = 0
+        self.updates = []
+        self.meta = types.SimpleNamespace(client=self)
+
+    def get_item(self, Key):
+        self.server_gets += 1
+        return {}
+
+    def update_item(self, Key, **kwargs):
+        self.updates.append(Key)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+class FakeClient:
+    def __init__(self):
+        self.written = {}
+        self.calls = 0
+        self.batch_gets = 0
+        self.executions = []
+        self.events = []
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.batch_gets += 1
+        return {"Responses": {FakeTable.name: []}, "UnprocessedKeys": {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.calls += 1
+        keys = [(request["PutRequest"]["Item"]["pk"]["S"], request["PutRequest"]["Item"]["sk"]["S"])
+                for request in RequestItems[FakeTable.name]]
+        if len(keys) != len(set(keys)):
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "duplicates"}}, "BatchWriteItem")
+        for key, request in zip(keys, RequestItems[FakeTable.name]):
+            self.written[key] = request["PutRequest"]["Item"]
+        return {"UnprocessedItems": {}, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def start_execution(self, stateMachineArn, input):
+        self.executions.append(json.loads(input))
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, "executionArn": "arn"}
+
+    def put_events(self, Entries):
+        self.events.extend(Entries)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def make_record(message_id, file_key):
+    body = {"Records": [{"s3": {"bucket": {"name": "rtcwprostats"}, "object": {"key": file_key}}}]}
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def test_batch_with_a_failed_file(monkeypatch):
+    files = {}
+    for round_num in ["2", "1"]:
+        file_name = glob.glob(os.path.join(test_dir, "gamestats4", "gameStats_match_1609817356_round_" + round_num + "_*.json"))[0]
+        with open(file_name) as file:
+            gamestats = json.load(file)
+        # current servers send one list of players instead of two teams
+        gamestats["stats"] = [{guid: stat} for team in gamestats["stats"] for guid, stat in team.items()]
+        files["intake/round" + round_num + ".txt"] = json.dumps(gamestats)
+    files["intake/restart.txt"] = json.dumps({"map_restart": True})
+
+    for cache in ref_cache.caches.values():
+        cache.invalidate()
+    table, client = FakeTable(), FakeClient()
+    monkeypatch.setattr(read_match, "s3", FakeS3(files))
+    monkeypatch.setattr(read_match, "table", table)
+    monkeypatch.setattr(ddb_access, "_client", client)
+    monkeypatch.setattr(read_match, "sf_client", client)
+    monkeypatch.setattr(read_match, "event_client", client)
+
+    event = {"Records": [make_record("m2", "intake/round2.txt"),
+                         make_record("broken", "intake/missing-for-now.txt"),
+                         make_record("m1", "intake/round1.txt"),
+                         make_record("restart", "intake/restart.txt")]}
+    response = read_match.handler(event, None)
+
+    # the restart file can never succeed, so it is dropped and not retried
+    assert response == {"batchItemFailures": [{"itemIdentifier": "broken"}]}
+    assert client.batch_gets == 1
+    assert table.server_gets == 1
+    assert [execution["roundid"] for execution in client.executions] == [1, 2]
+    map_keys = [key for key in table.updates if key["pk"].startswith("maps#")]
+    assert len(map_keys) == len(json.loads(files["intake/round2.txt"])["stats"])
+
+    assert (match_pk("1609817356"), "16098173561") in client.written
+    assert (match_pk("1609817356"), "16098173562") in client.written
+    assert client.written[(match_pk("1609817356"), "16098173562")]["gsi1pk"] == {"S": "match#202101"}
+    server_item = client.written[("server", "RTCW NA PUB RTCWPRO N.Virginia")]
+    assert server_item["submissions"] == {"N": "2"}
+
+    new_player_guids = [json.loads(entry["Detail"])["guid"] for entry in client.events
+                        if json.loads(entry["Detail"])["notification_type"] == "new player"]
+    assert len(new_player_guids) == len(set(new_player_guids)) > 0
+
+
+def test_write_failure_is_retried_per_file(monkeypatch):
+    matches = [{"file_key": "a", "match_id": "1", "items": [{"pk": "match", "sk": "11"}]},
+               {"file_key": "b", "match_id": "2", "items": [{"pk": "match", "sk": "21"}]}]
+    calls = []
+
+    def ddb_batch_write(table_name, items):
+        calls.append(items)
+        if len(items) > 1 or items[0]["sk"] == "21":
+            raise Exception("throttled")
+
+    monkeypatch.setattr(read_match, "ddb_batch_write", ddb_batch_write)
+    assert [match["file_key"] for match in read_match.write_matches(matches)] == ["a"]
+    assert len(calls) == 3
+
+
+def test_record_updates_report_failures(monkeypatch):
+    class FailingTable(FakeTable):
+        def update_item(self, Key, **kwargs):
+            if Key["pk"] == "player#bad":
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "bad key"}}, "UpdateItem")
+            return super().update_item(Key, **kwargs)
+
+    monkeypatch.setattr(reader_writeddb.logger, "disabled", True)
+    table = FailingTable()
+    guids = ["guid" + str(num) for num in range(20)] + ["bad"]
+    assert reader_writeddb.ddb_update_user_records(guids, table) == [{"pk": "player#bad", "sk": "realname"}]
+    assert sorted(key["pk"] for key in table.updates) == sorted("player#" + guid for guid in guids[0:-1])
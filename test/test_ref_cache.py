@@ -0,0 +1,98 @@
+"""
+Checks for the warm container reference cache (lambdas/layers/ddb_access).
+
+    python -m pytest test/test_ref_cache.py
+"""
+import os
+import sys
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+
+import ref_cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def make_cache(monkeypatch, max_size=3):
+    clock = Clock()
+    monkeypatch.setattr(ref_cache, "_time", clock)
+    return ref_cache.TtlCache("test", ttl=60, max_size=max_size, negative_ttl=10), clock
+
+
+def test_values_expire_after_ttl(monkeypatch):
+    cache, clock = make_cache(monkeypatch)
+    loads = []
+    load = lambda key: loads.append(key) or key.upper()
+    assert cache.get("a", load) == "A"
+    assert cache.get("a", load) == "A"
+    clock.now += 61
+    assert cache.get("a", load) == "A"
+    assert loads == ["a", "a"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_missing_items_are_cached_shorter(monkeypatch):
+    cache, clock = make_cache(monkeypatch)
+    loads = []
+    load = lambda key: loads.append(key)
+    assert cache.get("gone", load) is None
+    assert cache.get("gone", load) is None
+    clock.now += 11
+    assert cache.get("gone", load) is None
+    assert loads == ["gone", "gone"]
+
+
+def test_failed_loads_are_not_cached(monkeypatch):
+    cache, clock = make_cache(monkeypatch)
+
+    def broken(key):
+        raise Exception("throttled")
+
+    try:
+        cache.get("a", broken)
+    except Exception:
+        pass
+    assert cache.get("a", lambda key: "A") == "A"
+
+
+def test_least_recently_used_is_dropped(monkeypatch):
+    cache, clock = make_cache(monkeypatch)
+    for key in ["a", "b", "c"]:
+        cache.put(key, key.upper())
+    cache.lookup("a")
+    cache.put("d", "D")
+    assert list(cache.entries.keys()) == ["c", "a", "d"]
+
+
+def test_get_many_loads_only_missing_keys(monkeypatch):
+    cache, clock = make_cache(monkeypatch, max_size=10)
+    cache.put("a", "A")
+    cache.put("x", None)
+    requested = []
+
+    def load_many(keys):
+        requested.append(keys)
+        return {"b": "B"}
+
+    assert cache.get_many(["a", "b", "c", "x"], load_many) == {"a": "A", "b": "B"}
+    assert requested == [["b", "c"]]
+    assert cache.get_many(["a", "b", "c", "x"], load_many) == {"a": "A", "b": "B"}
+    assert len(requested) == 1
+
+
+def test_invalidate_key_or_cache():
+    cache = ref_cache.get_cache("real_names")
+    assert ref_cache.get_cache("real_names") is cache
+    cache.put("guid1", "one")
+    cache.put("guid2", "two")
+    cache.invalidate("guid1")
+    assert cache.split(["guid1", "guid2"]) == ({"guid2": "two"}, ["guid1"])
+    cache.invalidate()
+    assert len(cache.entries) == 0
@@ -0,0 +1,256 @@
+"""
+Checks for the warm container response cache of the retriever.
+
+    python -m pytest test/test_response_cache.py
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "delivery", "retriever"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+os.environ.setdefault("RTCWPROSTATS_TABLE_NAME", "rtcwprostats-test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import response_cache
+import retriever
+
+retriever.logger.setLevel(logging.ERROR)
+response_cache.logger.setLevel(logging.ERROR)
+now = 1638402500.0  # 2021-12-01
+
+
+class Clock:
+    def __init__(self):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class Context:
+    log_stream_name = "local"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "_time", clock)
+    monkeypatch.setattr(response_cache, "cache", response_cache.ResponseCache(1000, 400))
+    return clock
+
+
+def make_builder(body):
+    builds = []
+
+    def build():
+        builds.append(body)
+        return retriever.make_response(None, body)
+    return build, builds
+
+
+def test_responses_expire_per_route(clock):
+    event = {"resource": "/leaders/{category}/region/{region}/type/{type}",
+             "pathParameters": {"category": "elo", "region": "na", "type": "6"}}
+    build, builds = make_builder('[{"guid": "a"}]')
+    assert response_cache.get(event, build)["body"] == '[{"guid": "a"}]'
+    assert response_cache.get(event, build)["body"] == '[{"guid": "a"}]'
+    assert len(builds) == 1
+    clock.now += response_cache.route_ttls[event["resource"]] + 1
+    response_cache.get(event, build)
+    assert len(builds) == 2
+
+    other_type = dict(event, pathParameters=dict(event["pathParameters"], type="3"))
+    response_cache.get(other_type, build)
+    paged = dict(event, queryStringParameters={"paginate": "true"})
+    response_cache.get(paged, build)
+    assert len(builds) == 4
+    assert (response_cache.cache.hits, response_cache.cache.misses) == (1, 4)
+
+
+def test_settled_matches_stay_cached(clock):
+    old_match = {"resource": "/stats/{match_id}", "pathParameters": {"match_id": str(int(now) - 7 * 60 * 60)}}
+    new_match = {"resource": "/stats/{match_id}", "pathParameters": {"match_id": str(int(now) - 60 * 60)}}
+    assert response_cache.get_ttl(old_match) == response_cache.forever
+    assert response_cache.get_ttl(new_match) == 60
+
+    round_ids = str(int(now) - 7 * 60 * 60) + "1," + str(int(now) - 7 * 60 * 60) + "2"
+    assert response_cache.get_ttl({"resource": "/matches/{proxy+}", "pathParameters": {"proxy": round_ids}}) == response_cache.forever
+    round_ids += "," + str(int(now)) + "1"
+    assert response_cache.get_ttl({"resource": "/matches/{proxy+}", "pathParameters": {"proxy": round_ids}}) == 60
+    assert response_cache.get_ttl({"resource": "/matches/{proxy+}", "pathParameters": {"proxy": "recent/30"}}) == 60
+    assert response_cache.get_ttl({"resource": "/serverquery"}) is None
+
+    build, builds = make_builder('{"match_id": "1"}')
+    response_cache.get(old_match, build)
+    clock.now += 365 * 24 * 60 * 60
+    response_cache.get(old_match, build)
+    assert len(builds) == 1
+
+
+def test_cache_is_bounded_by_bytes(clock):
+    events = [{"resource": "/player/{player_guid}", "pathParameters": {"player_guid": str(num)}} for num in range(5)]
+    body = json.dumps({"real_name": "x" * 250})
+    for event in events:
+        response_cache.get(event, make_builder(body)[0])
+    cache = response_cache.cache
+    assert cache.size <= cache.max_bytes and len(cache.entries) == 3 and cache.evictions == 2
+
+    response_cache.get(events[2], make_builder(body)[0])  # most recently used now
+    response_cache.get(events[0], make_builder(body)[0])
+    assert response_cache.get_key(events[2]) in cache.entries and response_cache.get_key(events[3]) not in cache.entries
+
+    big = {"resource": "/player/{player_guid}", "pathParameters": {"player_guid": "big"}}
+    response_cache.get(big, make_builder(json.dumps({"real_name": "x" * 500}))[0])
+    assert response_cache.get_key(big) not in cache.entries and len(cache.entries) == 3
+
+
+def test_errors_are_not_cached_and_bypass_refreshes(clock):
+    event = {"resource": "/player/{player_guid}", "pathParameters": {"player_guid": "a"}}
+    build, builds = make_builder('{"error": "[x] Items do not exist: "}')
+    response_cache.get(event, build)
+    response_cache.get(event, build)
+    assert len(builds) == 2
+
+    response_cache.get(event, make_builder('{"real_name": "old"}')[0])
+    refresh = dict(event, cache_bypass=True)
+    assert response_cache.get(refresh, make_builder('{"real_name": "new"}')[0])["body"] == '{"real_name": "new"}'
+    assert response_cache.get(event, make_builder('{"real_name": "stale"}')[0])["body"] == '{"real_name": "new"}'
+    assert response_cache.cache.bypasses == 1
+
+
+def test_handler_serves_from_cache(clock, monkeypatch):
+    queries = []
+    monkeypatch.setattr(retriever, "get_query_all", lambda *args: queries.append("server") or
+                        [{"sk": "srv", "region": "na", "lsipk": "na#2021-12-01 00:00:00", "submissions": 3,
+                          "data": {"serverIP": "1.2.3.4"}}])
+    event = {"resource": "/servers", "pathParameters": None}
+    first = retriever.handler(event, Context())
+    second = retriever.handler(event, Context())
+    assert first == second and json.loads(second["body"])[0]["server_name"] == "srv"
+    assert queries == ["server"]
+
+
+def use_shared(monkeypatch):
+    """A fresh local cache per call, like one more container, over one LocalBackend."""
+    monkeypatch.setattr(response_cache, "shared", response_cache.LocalBackend())
+    monkeypatch.setattr(response_cache, "shared_stats", response_cache.Counter())
+    return lambda: monkeypatch.setattr(response_cache, "cache", response_cache.ResponseCache(10000, 4000))
+
+
+def test_shared_cache_serves_other_containers(clock, monkeypatch):
+    new_container = use_shared(monkeypatch)
+    event = {"resource": "/stats/group/{group_name}", "pathParameters": {"group_name": "gather15"}}
+    build, builds = make_builder('{"statsall": []}')
+    new_container()
+    response_cache.get(event, build)
+    new_container()
+    assert response_cache.get(event, build)["body"] == '{"statsall": []}'
+    assert len(builds) == 1 and response_cache.shared_stats["hits"] == 1
+
+    not_shared = {"resource": "/player/{player_guid}", "pathParameters": {"player_guid": "a"}}
+    response_cache.get(not_shared, build)
+    assert response_cache.shared.entries.keys() == {response_cache.get_shared_key(response_cache.get_key(event))}
+
+
+def test_stale_is_served_while_one_container_refreshes(clock, monkeypatch):
+    new_container = use_shared(monkeypatch)
+    event = {"resource": "/stats/group/{group_name}", "pathParameters": {"group_name": "gather15"}}
+    shared_key = response_cache.get_shared_key(response_cache.get_key(event))
+    new_container()
+    response_cache.get(event, make_builder('{"games": 1}')[0])
+    clock.now += 61
+
+    assert response_cache.shared.lock(shared_key, clock.now)  # another container is building it
+    new_container()
+    build, builds = make_builder('{"games": 2}')
+    assert response_cache.get(event, build)["body"] == '{"games": 1}'
+    assert builds == [] and response_cache.shared_stats["stales"] == 1
+
+    clock.now += response_cache.lock_time + 1  # it never finished
+    new_container()
+    assert response_cache.get(event, build)["body"] == '{"games": 2}'
+    new_container()
+    assert response_cache.get(event, build)["body"] == '{"games": 2}'
+    assert len(builds) == 1
+
+    clock.now += 2 * 61  # past the stale window too
+    new_container()
+    response_cache.get(event, build)
+    assert len(builds) == 2
+
+
+def test_identical_requests_are_built_once(monkeypatch):
+    use_shared(monkeypatch)()
+    event = {"resource": "/stats/group/{group_name}", "pathParameters": {"group_name": "gather15"}}
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.3)
+        return retriever.make_response({"games": 3})
+
+    bodies = []
+
+    def request():
+        # all of them miss the local cache while the first one builds, like 8 containers would
+        bodies.append(response_cache.get(event, build)["body"])
+
+    threads = [threading.Thread(target=request) for num in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert bodies == ['{"games": 3}'] * 8
+    assert response_cache.shared_stats["waits"] == 7
+
+
+class CacheTable:
+    """get_item, put_item and the lock update_item of TableBackend."""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key, ConsistentRead=False):
+        item = self.items.get(Key["pk"])
+        return {} if item is None else {"Item": dict(item)}
+
+    def put_item(self, Item):
+        self.items[Item["pk"]] = dict(Item, data=Binary(Item["data"]))
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeValues=None):
+        item = self.items.setdefault(Key["pk"], dict(Key))
+        if UpdateExpression.startswith("REMOVE"):
+            item.pop("lock_until", None)
+            return
+        if item.get("lock_until", 0) >= ExpressionAttributeValues[":now"]:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}}, "UpdateItem")
+        item["lock_until"] = ExpressionAttributeValues[":until"]
+        item.setdefault("ExpirationTime", ExpressionAttributeValues[":until"])
+
+
+def test_table_backend_items():
+    table = CacheTable()
+    backend = response_cache.get_shared_backend("table", table)
+    assert backend.lock("responsecache#a", now) and not backend.lock("responsecache#a", now + 1)
+    assert table.items["responsecache#a"]["ExpirationTime"] == int(now) + response_cache.lock_time
+    assert "body" not in backend.get("responsecache#a")
+
+    body = json.dumps({"statsall": ["x" * 100] * 100})
+    backend.put("responsecache#a", {"body": body, "headers": {"Content-Type": "application/json"},
+                                    "fresh_until": now + 60, "expires": now + 120})
+    item = table.items["responsecache#a"]
+    assert item["data_enc"] == "zlib" and len(item["data"].value) < len(body) / 10 and "lock_until" not in item
+    entry = backend.get("responsecache#a")
+    assert entry["body"] == body and entry["fresh_until"] == int(now) + 60 and entry["expires"] == int(now) + 120
+    assert backend.lock("responsecache#a", now)
+    assert response_cache.get_shared_backend(None, table) is None
@@ -0,0 +1,173 @@
+"""
+Checks for cursor pagination of the retriever list routes.
+
+    python -m pytest test/test_retriever_cursor.py
+"""
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "delivery", "retriever"))
+sys.path.insert(0, os.path.join(test_dir, "..", "lambdas", "layers", "ddb_access", "python"))
+os.environ.setdefault("RTCWPROSTATS_TABLE_NAME", "rtcwprostats-test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import retriever
+
+retriever.logger.setLevel(logging.ERROR)
+
+
+class Context:
+    log_stream_name = "local"
+
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    monkeypatch.setattr(retriever.response_cache, "route_ttls", {})  # these check the responses themselves
+
+
+class EventTable:
+    """Events on gsi2, newest first, Limit and ExclusiveStartKey like DynamoDB."""
+
+    def __init__(self, count):
+        self.items = [{"pk": "event", "sk": str(num), "gsi2pk": "event", "gsi2sk": "2021-01-01 00:%02d:%02d" % divmod(num, 60),
+                       "eventtype": "New player", "eventdesc": "player" + str(num)} for num in range(count)]
+        self.items.reverse()
+        self.queries = []
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        start = 0
+        if "ExclusiveStartKey" in kwargs:
+            start = [item["sk"] for item in self.items].index(kwargs["ExclusiveStartKey"]["sk"]) + 1
+        items = self.items[start: start + kwargs["Limit"]]
+        response = {"Items": items, "Count": len(items)}
+        if start + kwargs["Limit"] < len(self.items):
+            last = items[-1]
+            response["LastEvaluatedKey"] = {"pk": last["pk"], "sk": last["sk"], "gsi2pk": last["gsi2pk"], "gsi2sk": last["gsi2sk"]}
+        return response
+
+
+def get_events(event):
+    return json.loads(retriever.handler(event, Context())["body"])
+
+
+def test_events_are_paged_without_overlap(monkeypatch):
+    table = EventTable(250)
+    monkeypatch.setattr(retriever, "ddb_table", table)
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    event = {"resource": "/events/{limit}", "pathParameters": {"limit": "100"}}
+
+    assert len(get_events(event)) == 100  # no paging asked for, same response as before
+
+    event["queryStringParameters"] = {"paginate": "true"}
+    descriptions = []
+    pages = 0
+    while True:
+        response = get_events(event)
+        pages += 1
+        descriptions.extend(line["eventdesc"] for line in response["items"])
+        if response["next"] is None:
+            break
+        event["queryStringParameters"] = {"cursor": response["next"]}
+    assert pages == 3
+    assert descriptions == [item["eventdesc"] for item in table.items]
+    assert "ExclusiveStartKey" not in table.queries[1] and table.queries[-1]["ExclusiveStartKey"]["sk"] == "50"
+
+
+def test_cursor_is_bound_to_its_query(monkeypatch):
+    monkeypatch.setattr(retriever, "ddb_table", EventTable(250))
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    event = {"resource": "/events/{limit}", "pathParameters": {"limit": "100"}, "queryStringParameters": {"paginate": "1"}}
+    cursor = get_events(event)["next"]
+
+    other_path = {"resource": "/events/{limit}", "pathParameters": {"limit": "50"}, "queryStringParameters": {"cursor": cursor}}
+    assert get_events(other_path)["error"].startswith("Invalid cursor")
+
+    payload, signature = cursor.split(".")
+    forged = retriever.base64.urlsafe_b64encode(b'{"pk":"player#x","sk":"realname"}').decode().rstrip("=") + "." + signature
+    event["queryStringParameters"] = {"cursor": forged}
+    assert get_events(event)["error"].startswith("Invalid cursor")
+
+    monkeypatch.setattr(retriever, "cursor_key", b"rotated")
+    event["queryStringParameters"] = {"cursor": cursor}
+    assert get_events(event)["error"].startswith("Invalid cursor")
+
+
+class FeedTable:
+    """Events on gsi2 for key conditions sk > value, oldest first."""
+
+    def __init__(self):
+        self.items = []
+        self.queries = []
+
+    def add(self, num, gsi2sk):
+        self.items.append({"pk": "player#" + str(num), "sk": "realname", "gsi2pk": "event", "gsi2sk": gsi2sk,
+                           "eventtype": "New player", "eventdesc": "player" + str(num)})
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        after = kwargs["KeyConditionExpression"].get_expression()["values"][1].get_expression()["values"][1]
+        items = sorted([item for item in self.items if item["gsi2sk"] > after], key=lambda item: item["gsi2sk"])
+        items = items[0: kwargs["Limit"]]
+        return {"Items": items, "Count": len(items)}
+
+
+def test_events_since_returns_each_new_event_once(monkeypatch):
+    table = FeedTable()
+    monkeypatch.setattr(retriever, "ddb_table", table)
+    monkeypatch.setattr(retriever, "cursor_key", b"test")
+    table.add(1, "2021-01-01T09:00:00.000001")
+    table.add(2, "2021-01-01T10:00:00.000002")
+    table.add(3, "2021-01-01T10:00:00.000002")  # written in the same batch
+    event = {"resource": "/events/{limit}", "pathParameters": {"limit": "2"},
+             "queryStringParameters": {"since": str(retriever.event_epoch("2021-01-01T10:00:00"))}}
+
+    response = get_events(event)
+    assert [line["eventdesc"] for line in response["items"]] == ["player2", "player3"]
+    assert table.queries[-1]["ScanIndexForward"] and table.queries[-1]["Limit"] == 2
+
+    event["queryStringParameters"] = {"since": response["since"]}
+    response = get_events(event)
+    assert response["items"] == [] and len(json.dumps(response)) < 200
+    assert table.queries[-1]["Limit"] == 4  # room for the two already returned
+
+    table.add(4, "2021-01-01T10:10:00")
+    event["queryStringParameters"] = {"since": response["since"]}
+    response = get_events(event)
+    assert [line["eventdesc"] for line in response["items"]] == ["player4"]
+
+    table.add(5, "2021-01-01T10:07:00")  # written late, inside the overlap
+    table.add(6, "2021-01-01T10:01:00")  # too late
+    event["queryStringParameters"] = {"since": response["since"]}
+    response = get_events(event)
+    assert [line["eventdesc"] for line in response["items"]] == ["player5"]
+
+    event["queryStringParameters"] = {"since": response["since"]}
+    assert get_events(event)["items"] == []
+
+    event["queryStringParameters"] = {"since": "x" + response["since"]}
+    assert get_events(event)["error"].startswith("Invalid cursor")
+    page_cursor = retriever.encode_cursor("/events/{limit}" + json.dumps({"limit": "2"}), {"low": 0, "seen": []})
+    event["queryStringParameters"] = {"since": page_cursor}
+    assert get_events(event)["error"].startswith("Invalid cursor")
+
+
+def test_cursor_key_comes_from_the_stack_secret(monkeypatch):
+    requests = []
+
+    class SecretsManager:
+        def get_secret_value(self, SecretId):
+            requests.append(SecretId)
+            return {"SecretString": "generated"}
+
+    monkeypatch.setattr(retriever, "cursor_key", None)
+    monkeypatch.setattr(retriever, "cursor_secret_arn", "arn:secret")
+    monkeypatch.setattr(retriever.boto3, "client", lambda service: SecretsManager())
+    assert retriever.get_cursor_key() == b"generated"
+    assert retriever.get_cursor_key() == b"generated"
+    assert requests == ["arn:secret"]  # read once per container
@@ -8,6 +8,9 @@ import boto3
 import json
 import logging
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "layers", "ddb_access", "python"))
+from match_shards import match_pk
+
 def get_files(test_dir):
     test_files = [] 
     for subdir, dirs, files in os.walk(test_dir):
@@ -90,7 +93,7 @@ time.sleep(sleep_time)
 # ===========
 # match record
 # ===========
-response = table.get_item(Key={"pk": "match", 'sk': match_id_round}, ReturnConsumedCapacity='TOTAL')
+response = table.get_item(Key={"pk": match_pk(match_id_round[0:-1]), 'sk': match_id_round}, ReturnConsumedCapacity='TOTAL')
 if "Item" not in response:
     logger.warning("Item not found.")
 else:
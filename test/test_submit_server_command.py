@@ -1,11 +1,15 @@
 import requests
 import os
+import sys
 import time
 import boto3
 import json
 import logging
 from boto3.dynamodb.conditions import Attr, Key
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "layers", "ddb_access", "python"))
+from match_shards import match_pk
+
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger("test_submit")
@@ -24,7 +28,7 @@ curl --location --request POST 'https://rtcwproapi.donkanator.com/serverquery' \
 def get_matches(starting_key, region, type_, limit):
     match_type = region + "#" + type_ + "#"
     response = table.query(IndexName="lsi",
-                           KeyConditionExpression=Key("pk").eq("match") & Key("lsipk").begins_with(match_type),
+                           KeyConditionExpression=Key("pk").eq(match_pk(time.time())) & Key("lsipk").begins_with(match_type),
                            Limit=limit,
                            ScanIndexForward=False)
                            # ,ExclusiveStartKey={"pk": {"S": "match"}, "lsipk": {"S": match_type + "16748768752"}})